@@ -0,0 +1,285 @@
+import glob
+import math
+import threading
+import logging
+
+import numpy as np
+import pandas as pd
+
+from jalali import parse_jalali_date, parse_clock
+from outage_index import split_description
+
+logger = logging.getLogger(__name__)
+
+# نوع خاموشی‌های بدون برنامه در ستون region
+UNPLANNED_REGION = 'بی برنامه'
+
+# فیدرهای بدون شماره در گروه -1 قرار می‌گیرند
+UNKNOWN_FEEDER = -1
+
+
+class GroupTotals:
+    """مجموع‌های جاری یک گروه (منطقه یا فیدر) که آمار گروه از آن‌ها محاسبه می‌شود"""
+
+    __slots__ = ('frequency', 'total_minutes', 'known_count', 'unplanned', 'hours', 'last_day')
+
+    def __init__(self):
+        self.frequency = 0
+        self.total_minutes = 0.0
+        self.known_count = 0
+        self.unplanned = 0
+        self.hours = [0] * 24
+        self.last_day = 0
+
+    def add_outage(self, day, start, unplanned):
+        self.frequency += 1
+        self.hours[start // 60 % 24] += 1
+        self.unplanned += unplanned
+        self.last_day = max(self.last_day, day)
+
+    def add_duration(self, duration):
+        self.total_minutes += duration
+        self.known_count += 1
+
+    def remove_duration(self, duration):
+        self.total_minutes -= duration
+        self.known_count -= 1
+
+    def stats(self):
+        return {
+            'frequency': self.frequency,
+            'total_minutes': self.total_minutes,
+            'mean_minutes': self.total_minutes / self.known_count if self.known_count else math.nan,
+            'unplanned_share': self.unplanned / max(self.frequency, 1),
+            'typical_start_hour': self.hours.index(max(self.hours)),
+            'last_day': self.last_day,
+        }
+
+
+class OutageAnalytics:
+    """آمار خاموشی‌ها به ازای هر فیدر و منطقه روی آرایه‌های ستونی NumPy
+
+    هر خاموشی یکتا (منطقه، فیدر/توضیحات، تاریخ، ساعت شروع) یک ردیف در
+    آرایه‌هاست؛ snapshotهای تکراری فقط ردیف موجود را به‌روز می‌کنند (وقتی
+    ساعت پایان «***» مشخص یا بعداً اصلاح می‌شود). هر منطقه و فیدر مجموع‌های جاری (GroupTotals)
+    دارد که با هر ردیف جدید یا تغییر کرده به‌روز می‌شوند و فقط آمار گروه‌های
+    تغییر کرده در جدول‌ها جایگزین می‌شود. بارگذاری تاریخچه CSV همه را یکجا با
+    bincount می‌سازد. جدول‌ها به صورت یکجا جایگزین می‌شوند تا پرسش‌ها فقط خواندن باشند.
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._area_ids = {}
+        self.area_names = []
+        self._size = 0
+        self._area = np.zeros(capacity, dtype=np.int32)
+        self._feeder = np.zeros(capacity, dtype=np.int32)
+        self._day = np.zeros(capacity, dtype=np.int32)
+        self._start = np.zeros(capacity, dtype=np.int16)
+        self._duration = np.zeros(capacity, dtype=np.float32)
+        self._unplanned = np.zeros(capacity, dtype=bool)
+        self._area_totals = {}      # area_name -> GroupTotals
+        self._feeder_totals = {}    # (area_name, feeder) -> GroupTotals
+        self.feeder_table = {}
+        self.area_table = {}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        """دو برابر کردن ظرفیت آرایه‌ها"""
+        for name in ('_area', '_feeder', '_day', '_start', '_duration', '_unplanned'):
+            column = getattr(self, name)
+            grown = np.zeros(len(column) * 2, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _add_row(self, area_name, outage):
+        """افزودن یا به‌روزرسانی یک خاموشی؛ (ردیف، جدید بودن، مدت قبلی) اگر داده‌ها تغییر کردند وگرنه None"""
+        day = parse_jalali_date(outage.get('date', ''))
+        start = parse_clock(outage.get('start_time', ''))
+        if day is None or start is None:
+            return None
+
+        feeder = outage.get('feeder')
+        key = (area_name, feeder or outage.get('description', ''), day, start)
+        end = parse_clock(outage.get('end_time', ''))
+        if end is None:
+            duration = np.nan
+        else:
+            duration = end - start if end >= start else end + 24 * 60 - start
+
+        row = self._keys.get(key)
+        if row is not None:
+            # ساعت پایان تازه مشخص شده یا اصلاح شده؛ مدت قبلی برای کم کردن از مجموع‌ها
+            previous = float(self._duration[row])
+            if (np.isnan(previous) and np.isnan(duration)) or previous == duration:
+                return None
+            self._duration[row] = duration
+            return row, False, previous
+
+        if area_name not in self._area_ids:
+            self._area_ids[area_name] = len(self.area_names)
+            self.area_names.append(area_name)
+        if self._size == len(self._area):
+            self._grow()
+
+        row = self._size
+        self._keys[key] = row
+        self._area[row] = self._area_ids[area_name]
+        self._feeder[row] = int(feeder) if feeder else UNKNOWN_FEEDER
+        self._day[row] = day.toordinal()
+        self._start[row] = start
+        self._duration[row] = duration
+        self._unplanned[row] = ' '.join(outage.get('region', '').split()) == UNPLANNED_REGION
+        self._size += 1
+        return row, True, np.nan
+
+    def _accumulate(self, row, new, previous, areas, feeders):
+        """افزودن ردیف جدید یا جایگزینی مدت تغییر کرده در مجموع‌های منطقه و فیدر آن"""
+        area_name = self.area_names[self._area[row]]
+        groups = [self._area_totals.setdefault(area_name, GroupTotals())]
+        areas.add(area_name)
+        if self._feeder[row] != UNKNOWN_FEEDER:
+            key = (area_name, str(self._feeder[row]))
+            groups.append(self._feeder_totals.setdefault(key, GroupTotals()))
+            feeders.add(key)
+
+        duration = self._duration[row]
+        for totals in groups:
+            if new:
+                totals.add_outage(int(self._day[row]), int(self._start[row]), bool(self._unplanned[row]))
+            if not np.isnan(previous):
+                totals.remove_duration(previous)
+            if not np.isnan(duration):
+                totals.add_duration(float(duration))
+
+    def add_snapshot(self, area_name, outages):
+        """افزودن خاموشی‌های یک snapshot و به‌روزرسانی آمار گروه‌های تغییر کرده"""
+        with self._lock:
+            areas, feeders = set(), set()
+            for outage in outages:
+                change = self._add_row(area_name, outage)
+                if change is not None:
+                    self._accumulate(*change, areas, feeders)
+            if areas:
+                area_table = dict(self.area_table)
+                for name in areas:
+                    area_table[name] = self._area_totals[name].stats()
+                feeder_table = dict(self.feeder_table)
+                for key in feeders:
+                    feeder_table[key] = self._feeder_totals[key].stats()
+                self.area_table = area_table
+                self.feeder_table = feeder_table
+        return bool(areas)
+
+    def load_csv_history(self, pattern, area_name):
+        """بارگذاری فایل‌های CSV ذخیره شده توسط run_check برای یک منطقه
+
+        ردیف‌ها بدون به‌روزرسانی تدریجی اضافه و جدول‌ها در پایان یکجا ساخته می‌شوند.
+        """
+        changed = False
+        for path in sorted(glob.glob(pattern)):
+            try:
+                frame = pd.read_csv(path, encoding='utf-8-sig', dtype=str).fillna('')
+            except Exception as e:
+                logger.error(f"خطا در خواندن تاریخچه {path}: {e}")
+                continue
+            outages = frame.to_dict('records')
+            for outage in outages:
+                if not outage.get('feeder'):
+                    outage['feeder'] = split_description(outage.get('description', ''))[0]
+            with self._lock:
+                for outage in outages:
+                    changed = self._add_row(area_name, outage) is not None or changed
+        if changed:
+            with self._lock:
+                self._rebuild()
+
+    def _aggregate(self, groups, count):
+        """مجموع‌های گروه‌ها با عملیات برداری روی ردیف‌های گروه‌بندی شده"""
+        duration = self._duration[:self._size]
+        known = ~np.isnan(duration)
+        frequency = np.bincount(groups, minlength=count)
+        total_minutes = np.bincount(groups, weights=np.where(known, duration, 0), minlength=count)
+        known_count = np.bincount(groups, weights=known, minlength=count)
+        unplanned = np.bincount(groups, weights=self._unplanned[:self._size], minlength=count)
+        hours = self._start[:self._size].astype(np.int64) // 60 % 24
+        histogram = np.bincount(groups * 24 + hours, minlength=count * 24).reshape(count, 24)
+        days = np.zeros(count, dtype=np.int64)
+        np.maximum.at(days, groups, self._day[:self._size])
+
+        totals = []
+        for group in range(count):
+            group_totals = GroupTotals()
+            group_totals.frequency = int(frequency[group])
+            group_totals.total_minutes = float(total_minutes[group])
+            group_totals.known_count = int(known_count[group])
+            group_totals.unplanned = int(unplanned[group])
+            group_totals.hours = histogram[group].tolist()
+            group_totals.last_day = int(days[group])
+            totals.append(group_totals)
+        return totals
+
+    def _rebuild(self):
+        """ساخت دوباره مجموع‌ها و جدول‌های فیدر و منطقه از کل آرایه‌ها"""
+        if self._size == 0:
+            return
+        area = self._area[:self._size].astype(np.int64)
+        feeder = self._feeder[:self._size].astype(np.int64)
+
+        area_totals = dict(zip(self.area_names, self._aggregate(area, len(self.area_names))))
+
+        # کلید ترکیبی منطقه و فیدر برای گروه‌بندی در یک گذر
+        span = int(feeder.max()) + 2
+        combined = area * span + (feeder + 1)
+        unique_keys, groups = np.unique(combined, return_inverse=True)
+        feeder_totals = {}
+        for key, totals in zip(unique_keys, self._aggregate(groups, len(unique_keys))):
+            area_id, feeder_number = divmod(int(key), span)
+            if feeder_number - 1 == UNKNOWN_FEEDER:
+                continue
+            feeder_totals[(self.area_names[area_id], str(feeder_number - 1))] = totals
+
+        self._area_totals = area_totals
+        self._feeder_totals = feeder_totals
+        self.area_table = {name: totals.stats() for name, totals in area_totals.items()}
+        self.feeder_table = {key: totals.stats() for key, totals in feeder_totals.items()}
+
+    def area_stats(self, area_name):
+        """آمار یک منطقه یا None"""
+        return self.area_table.get(area_name)
+
+    def feeder_stats(self, area_name, feeder):
+        """آمار یک فیدر در یک منطقه یا None"""
+        return self.feeder_table.get((area_name, str(feeder)))
+
+    def top_feeders(self, area_name, limit=5, key='total_minutes'):
+        """فیدرهای منطقه به ترتیب نزولی یک شاخص"""
+        rows = [(feeder, stats) for (area, feeder), stats in self.feeder_table.items() if area == area_name]
+        rows.sort(key=lambda item: item[1][key], reverse=True)
+        return rows[:limit]
+
+    def start_series(self, area_name, planned_only=True):
+        """زمان شروع خاموشی‌های هر فیدر منطقه به دقیقه محلی از مبدأ ordinal، مرتب شده"""
+        with self._lock:
+            area_id = self._area_ids.get(area_name)
+            if area_id is None:
+                return {}
+            size = self._size
+            mask = (self._area[:size] == area_id) & (self._feeder[:size] != UNKNOWN_FEEDER)
+            if planned_only:
+                mask &= ~self._unplanned[:size]
+            feeders = self._feeder[:size][mask].astype(np.int64)
+            minutes = self._day[:size][mask].astype(np.int64) * 1440 + self._start[:size][mask]
+
+        if len(feeders) == 0:
+            return {}
+        order = np.lexsort((minutes, feeders))
+        feeders, minutes = feeders[order], minutes[order]
+        unique_feeders, first_rows = np.unique(feeders, return_index=True)
+        return {
+            str(feeder): series
+            for feeder, series in zip(unique_feeders, np.split(minutes, first_rows[1:]))
+        }
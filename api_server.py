@@ -0,0 +1,404 @@
+import os
+import sys
+import gzip
+import json
+import socket
+import asyncio
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from config import (
+    AREAS, AREA_ALIASES, PREFETCH_INTERVAL, LEADER_LEASE_TTL, KV_PURGE_INTERVAL,
+    API_HOST, API_PORT, API_RESPONSE_CACHE_BYTES, INDEX_CACHE_BYTES
+)
+from snapshot_store import MemorySnapshotStore, SQLiteSnapshotStore
+from snapshot_file import MappedSnapshotStore
+from snapshot_cache import SnapshotCache
+from prefetcher import SnapshotPrefetcher
+from session_pool import build_session_pool
+from poll_scheduler import build_scheduler
+from query_router import QueryRouter
+from outage_index import OutageIndex, parse_feeder_term
+from jalali import IRAN_TZ
+from ical_feeds import CalendarFeeds
+
+logger = logging.getLogger(__name__)
+
+# پاسخ‌های کوچک‌تر از این فشرده نمی‌شوند (بایت)
+GZIP_MIN_SIZE = 1024
+
+# مدت انتظار برای درخواست بعدی روی یک اتصال keep-alive (ثانیه)
+KEEPALIVE_TIMEOUT = 15
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+class APIError(Exception):
+    """خطای قابل گزارش به کاربر API با کد وضعیت HTTP"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class OutageAPI:
+    """API فقط-خواندنی JSON روی snapshotهای store و ایندکس آن‌ها
+
+    هر پاسخ نسخه‌ای دارد که از digest snapshotهای استفاده شده و پارامترهای
+    درخواست ساخته می‌شود؛ ETag همین نسخه است، پس تا snapshot عوض نشود پاسخ
+    304 است و بدنه (JSON یا iCalendar) و نسخه gzip آن فقط یک بار ساخته و در
+    کش نگه داشته می‌شوند. نسخه فقط با خواندن digestها (بدون بارگذاری
+    خاموشی‌ها) روی event loop برای پاسخ 304 و کش محاسبه می‌شود و ساخت بدنه در
+    thread جدا انجام می‌شود؛ ETag بدنه ساخته شده از digest همان snapshotهایی
+    است که در ساخت خوانده شده‌اند، پس انتشار snapshot در این فاصله بدنه جدید را
+    زیر ETag قدیمی کش نمی‌کند. درخواست‌ها هرگز به سایت خاموشی نمی‌رسند.
+    """
+
+    def __init__(self, store, areas, aliases=None, response_cache_bytes=16 * 1024 * 1024,
+                 index_cache_bytes=64 * 1024 * 1024):
+        self.store = store
+        self.areas = areas
+        self.router = QueryRouter(areas, aliases)
+        self.index_cache = SnapshotCache(index_cache_bytes)
+        self.responses = SnapshotCache(response_cache_bytes)
+        self.calendars = CalendarFeeds()
+        self.routes = [
+            (('areas',), self.areas_resource),
+            (('areas', None, 'outages'), self.outages_resource),
+            (('areas', None, 'feeders', None), self.feeder_resource),
+            (('areas', None, 'search'), self.search_resource),
+            (('active',), self.active_resource),
+            (('areas', None, 'calendar.ics'), self.area_calendar_resource),
+            (('areas', None, 'feeders', None, 'calendar.ics'), self.feeder_calendar_resource),
+        ]
+
+    def resolve_area(self, name):
+        """نام منطقه از نام دقیق یا نام جایگزین"""
+        if name in self.areas:
+            return name
+        area_name, terms = self.router.route(name)
+        if area_name is None or terms:
+            raise APIError(404, f"منطقه ناشناخته: {name}")
+        return area_name
+
+    def area_digest(self, area_name):
+        """digest snapshot منطقه یا APIError اگر هنوز داده‌ای دریافت نشده است"""
+        digest = self.store.get_digest(area_name)
+        if digest is None:
+            raise APIError(404, f"هنوز داده‌ای برای {area_name} دریافت نشده است")
+        return digest
+
+    def area_snapshot(self, area_name):
+        """(snapshot، ایندکس) منطقه یا APIError اگر هنوز داده‌ای دریافت نشده است"""
+        snapshot = self.store.get_snapshot(area_name)
+        if snapshot is None:
+            raise APIError(404, f"هنوز داده‌ای برای {area_name} دریافت نشده است")
+        if 'index' in snapshot:
+            return snapshot, snapshot['index']
+        key = (area_name, snapshot['digest'])
+        index = self.index_cache.get(key)
+        if index is None:
+            index = OutageIndex(snapshot['outages'])
+            self.index_cache.put(key, index, pin_group=area_name)
+        return snapshot, index
+
+    def snapshot_payload(self, snapshot, outages, **extra):
+        payload = {
+            'area': snapshot['area'],
+            'fetched_at': snapshot['fetched_at'],
+            'digest': snapshot['digest'],
+        }
+        payload.update(extra)
+        payload['count'] = len(outages)
+        payload['outages'] = list(outages)
+        return payload
+
+    # هر resource خروجی (نسخه، تابع سازنده) دارد تا ساخت بدنه فقط در صورت نیاز انجام شود؛
+    # نسخه فقط از digestها ساخته می‌شود و snapshotها داخل تابع سازنده خوانده می‌شوند. سازنده
+    # (نسخه، payload) را برمی‌گرداند که نسخه آن از digest همان snapshotهای خوانده شده است
+
+    def areas_resource(self, params):
+        version = '|'.join(self.store.get_digest(name) or '-' for name in self.areas)
+
+        def build():
+            areas = []
+            digests = []
+            for name, info in self.areas.items():
+                snapshot = self.store.get_snapshot(name)
+                digests.append(snapshot['digest'] if snapshot else '-')
+                areas.append({
+                    'name': name,
+                    'city_code': info['city_code'],
+                    'area_code': info['area_code'],
+                    'fetched_at': snapshot['fetched_at'] if snapshot else None,
+                    'count': len(snapshot['outages']) if snapshot else 0,
+                })
+            return '|'.join(digests), areas
+        return version, build
+
+    def outages_resource(self, params, area):
+        area_name = self.resolve_area(area)
+
+        def build():
+            snapshot, _ = self.area_snapshot(area_name)
+            return snapshot['digest'], self.snapshot_payload(snapshot, snapshot['outages'])
+        return self.area_digest(area_name), build
+
+    def feeder_resource(self, params, area, feeder):
+        area_name = self.resolve_area(area)
+        number = parse_feeder_term(feeder)
+        if number is None:
+            raise APIError(400, f"شماره فیدر نامعتبر: {feeder}")
+
+        def build():
+            snapshot, index = self.area_snapshot(area_name)
+            return snapshot['digest'], self.snapshot_payload(snapshot, index.feeder_outages(number), feeder=number)
+        return self.area_digest(area_name), build
+
+    def search_resource(self, params, area):
+        query = params.get('q', '').strip()
+        if not query:
+            raise APIError(400, "پارامتر q لازم است")
+        area_name = self.resolve_area(area)
+
+        def build():
+            snapshot, index = self.area_snapshot(area_name)
+            terms = query.split()
+            outages = index.search(terms)
+            match = 'exact'
+            if not outages:
+                # مانند ربات: املای متفاوت نام خیابان با جستجوی تقریبی
+                text_terms = [term for term in terms if not parse_feeder_term(term)]
+                outages = [outage for outage, _ in index.fuzzy_search(' '.join(text_terms))] if text_terms else []
+                match = 'similar'
+            return snapshot['digest'], self.snapshot_payload(snapshot, outages, query=query, match=match)
+        return self.area_digest(area_name), build
+
+    def active_resource(self, params):
+        at_text = params.get('at')
+        try:
+            at = datetime.fromisoformat(at_text) if at_text else datetime.now(IRAN_TZ)
+        except ValueError:
+            raise APIError(400, f"زمان نامعتبر: {at_text}")
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=IRAN_TZ)
+        # پاسخ «هم‌اکنون» در هر دقیقه ثابت است
+        at = at.replace(second=0, microsecond=0)
+
+        area_names = [self.resolve_area(params['area'])] if params.get('area') else list(self.areas)
+        digests = [(name, self.store.get_digest(name)) for name in area_names]
+        digests = [(name, digest) for name, digest in digests if digest is not None]
+        version = '|'.join(digest for _, digest in digests) + f"@{at.timestamp():.0f}"
+
+        def build():
+            results = []
+            used = []
+            for name, _ in digests:
+                # بازه‌های زمانی هر ردیف از پیش در ایندکس محاسبه شده‌اند
+                snapshot, index = self.area_snapshot(name)
+                used.append(snapshot['digest'])
+                results.append(self.snapshot_payload(snapshot, index.active_outages(at.timestamp())))
+            return '|'.join(used) + f"@{at.timestamp():.0f}", {'at': at.isoformat(), 'areas': results}
+        return version, build
+
+    def calendar_feed(self, area, feeder=None):
+        """فید تقویم منطقه یا فیدر؛ فقط با digest جدید snapshot رویدادها به‌روز می‌شوند"""
+        area_name = self.resolve_area(area)
+        if self.calendars.digests.get(area_name) == self.area_digest(area_name):
+            feed = self.calendars.feed(area_name, feeder)
+            # بدنه از پیش ساخته شده است؛ نسخه همان ETag محتوای فید است
+            return feed.etag, lambda: (feed.etag, feed.body)
+
+        def build():
+            snapshot = self.store.get_snapshot(area_name)
+            if snapshot is None:
+                raise APIError(404, f"هنوز داده‌ای برای {area_name} دریافت نشده است")
+            self.calendars.update_area(area_name, snapshot)
+            return None, self.calendars.feed(area_name, feeder).body
+        # نسخه None: پس از ساخت از محتوای بدنه (همان ETag فید) محاسبه می‌شود
+        return None, build
+
+    def area_calendar_resource(self, params, area):
+        return self.calendar_feed(area)
+
+    def feeder_calendar_resource(self, params, area, feeder):
+        number = parse_feeder_term(feeder)
+        if number is None:
+            raise APIError(400, f"شماره فیدر نامعتبر: {feeder}")
+        return self.calendar_feed(area, number)
+
+    def match_route(self, path):
+        parts = tuple(unquote(part) for part in path.strip('/').split('/') if part)
+        for pattern, handler in self.routes:
+            if len(pattern) == len(parts) and all(p is None or p == part for p, part in zip(pattern, parts)):
+                return handler, [part for p, part in zip(pattern, parts) if p is None]
+        raise APIError(404, f"مسیر ناشناخته: {path}")
+
+    def resolve(self, method, target, headers):
+        """بخش ارزان پاسخ که روی event loop اجرا می‌شود: مسیر، نسخه و ETag
+
+        خروجی (پاسخ، None) برای خطا، 304 و پاسخ کش شده است و (None، render)
+        وقتی بدنه باید ساخته شود؛ render را می‌توان در thread جدا اجرا کرد.
+        """
+        if method not in ('GET', 'HEAD'):
+            return self.error_response(405, "فقط GET و HEAD پشتیبانی می‌شوند", {'Allow': 'GET, HEAD'}), None
+
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            handler, args = self.match_route(url.path)
+            version, build = handler(params, *args)
+        except APIError as e:
+            return self.error_response(e.status, e.message), None
+        except Exception as e:
+            logger.error(f"خطا در پاسخ {target}: {e}")
+            return self.error_response(500, "خطای داخلی سرور"), None
+
+        request_key = f"{url.path}?{sorted(params.items())}"
+        content_type = 'text/calendar; charset=utf-8' if url.path.endswith('.ics') else 'application/json; charset=utf-8'
+        if version is not None:
+            etag = self.etag(request_key, version)
+            if self.not_modified(etag, headers):
+                return (304, self.cache_headers(etag), b''), None
+            cached = self.responses.get(etag)
+            if cached is not None:
+                return self.full_response(etag, cached, content_type, headers), None
+        return None, lambda: self.render(target, request_key, build, content_type, headers)
+
+    def render(self, target, request_key, build, content_type, headers):
+        """ساخت، فشرده‌سازی و کش بدنه
+
+        ETag از نسخه‌ای که سازنده همراه بدنه برمی‌گرداند ساخته می‌شود (نه نسخه
+        محاسبه شده در resolve) و با نسخه None از محتوای بدنه.
+        """
+        try:
+            version, payload = build()
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            if version is None:
+                version = hashlib.sha1(body).hexdigest()[:24]
+            etag = self.etag(request_key, version)
+            if self.not_modified(etag, headers):
+                return 304, self.cache_headers(etag), b''
+            cached = self.responses.get(etag)
+            if cached is None:
+                compressed = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_SIZE else None
+                cached = (body, compressed)
+                self.responses.put(etag, cached, size=len(body) + len(compressed or b''))
+        except APIError as e:
+            return self.error_response(e.status, e.message)
+        except Exception as e:
+            logger.error(f"خطا در ساخت پاسخ {target}: {e}")
+            return self.error_response(500, "خطای داخلی سرور")
+        return self.full_response(etag, cached, content_type, headers)
+
+    def respond(self, method, target, headers):
+        """پاسخ یک درخواست به صورت (وضعیت، headerها، بدنه)"""
+        response, render = self.resolve(method, target, headers)
+        return response if render is None else render()
+
+    def etag(self, request_key, version):
+        return 'W/"' + hashlib.sha1(f"{request_key}|{version}".encode('utf-8')).hexdigest()[:24] + '"'
+
+    def not_modified(self, etag, headers):
+        return etag in (tag.strip() for tag in headers.get('if-none-match', '').split(','))
+
+    def cache_headers(self, etag):
+        return {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+    def full_response(self, etag, cached, content_type, headers):
+        body, compressed = cached
+        response_headers = self.cache_headers(etag)
+        response_headers['Content-Type'] = content_type
+        if compressed is not None and 'gzip' in headers.get('accept-encoding', ''):
+            response_headers['Content-Encoding'] = 'gzip'
+            body = compressed
+        return 200, response_headers, body
+
+    def error_response(self, status, message, extra_headers=None):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        headers.update(extra_headers or {})
+        return status, headers, body
+
+    async def handle_connection(self, reader, writer):
+        """خواندن درخواست‌های HTTP/1.1 یک اتصال (با keep-alive) و نوشتن پاسخ‌ها"""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get('content-length'):
+                    await reader.readexactly(int(headers['content-length']))
+
+                # ساخت بدنه (خواندن snapshot، JSON و gzip) event loop را متوقف نمی‌کند
+                response, render = self.resolve(method, target, headers)
+                if render is not None:
+                    response = await asyncio.to_thread(render)
+                status, response_headers, body = response
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                response_headers['Content-Length'] = str(len(body))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                head += ''.join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"API خاموشی‌ها روی {host}:{port} اجرا شد")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    """اجرای API؛ با SNAPSHOT_DB همان snapshotهای ربات خوانده می‌شوند"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='API خاموشی‌های برق مازندران')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+
+    snapshot_db = os.getenv('SNAPSHOT_DB')
+    store = SQLiteSnapshotStore(snapshot_db) if snapshot_db else MemorySnapshotStore()
+    mmap_dir = os.getenv('SNAPSHOT_MMAP_DIR')
+    if snapshot_db and mmap_dir:
+        store = MappedSnapshotStore(store, mmap_dir)
+    # prefetcher در انتخاب رهبر شرکت می‌کند؛ کنار رباتِ رهبر فقط از store می‌خواند
+    prefetcher = SnapshotPrefetcher(
+        store, AREAS, os.getenv('WORKER_ID') or f"api-{socket.gethostname()}-{os.getpid()}",
+        interval=PREFETCH_INTERVAL, lease_ttl=LEADER_LEASE_TTL, scheduler=build_scheduler(AREAS),
+        sessions=build_session_pool(), purge_interval=KV_PURGE_INTERVAL
+    )
+    prefetcher.start()
+
+    api = OutageAPI(store, AREAS, AREA_ALIASES, API_RESPONSE_CACHE_BYTES, INDEX_CACHE_BYTES)
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        prefetcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
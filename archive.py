@@ -0,0 +1,126 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # zstd اختیاری است؛ در نبود آن gzip استفاده می‌شود
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# شناسه جدول خاموشی‌ها در پاسخ سایت
+GRID_ID = 'id="ContentPlaceHolder1_grdOutages"'
+
+
+def extract_grid(html_content):
+    """جدا کردن جدول خاموشی‌ها از پاسخ کامل یا None اگر جدول پیدا نشد"""
+    marker = html_content.find(GRID_ID)
+    if marker < 0:
+        return None
+    start = html_content.rfind('<table', 0, marker)
+    end = html_content.find('</table>', marker)
+    if start < 0 or end < 0:
+        return None
+    return html_content[start:end + len('</table>')]
+
+
+def parse_time(value):
+    """تبدیل datetime یا رشته ISO به datetime محلی بدون منطقه زمانی برای مقایسه
+
+    زمان‌های دارای منطقه زمانی به وقت محلی سیستم (مثل datetime.now در store) تبدیل می‌شوند.
+    """
+    moment = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+class ResponseArchive:
+    """بایگانی فشرده پاسخ‌های سایت با آدرس‌دهی بر اساس محتوا
+
+    هر محتوا یک بار با نام hash خود (SHA-256) ذخیره می‌شود؛ پاسخ‌های تکراری
+    فقط یک خط به index.jsonl اضافه می‌کنند که زمان دریافت را به hash نگاشت می‌کند.
+    به طور پیش‌فرض فقط جدول خاموشی‌ها نگه داشته می‌شود و ViewState حذف می‌شود.
+    """
+
+    def __init__(self, root, grid_only=True):
+        self.root = root
+        self.grid_only = grid_only
+        self.index_path = os.path.join(root, 'index.jsonl')
+        self.extension = '.zst' if zstandard else '.gz'
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    def _object_path(self, digest, extension=None):
+        return os.path.join(self.root, 'objects', digest[:2], digest + (extension or self.extension))
+
+    def _compress(self, data):
+        if zstandard:
+            return zstandard.ZstdCompressor(level=19).compress(data)
+        return gzip.compress(data, compresslevel=9)
+
+    def store(self, html_content, area=None, timestamp=None):
+        """بایگانی یک پاسخ و برگرداندن hash محتوا"""
+        content = extract_grid(html_content) if self.grid_only else None
+        kind = 'grid' if content is not None else 'full'
+        data = (content if content is not None else html_content).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        timestamp = timestamp or datetime.now()
+
+        with self._lock:
+            path = self._object_path(digest)
+            if not any(os.path.exists(self._object_path(digest, ext)) for ext in ('.zst', '.gz')):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(self._compress(data))
+                os.replace(temp_path, path)
+                logger.info(f"پاسخ جدید در بایگانی ذخیره شد: {digest[:12]}")
+
+            entry = {'time': timestamp.isoformat(timespec='seconds'), 'hash': digest, 'kind': kind}
+            if area:
+                entry['area'] = area
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return digest
+
+    def load(self, digest):
+        """خواندن محتوای یک hash از بایگانی"""
+        gz_path = self._object_path(digest, '.gz')
+        if os.path.exists(gz_path):
+            with open(gz_path, 'rb') as f:
+                return gzip.decompress(f.read()).decode('utf-8')
+
+        zst_path = self._object_path(digest, '.zst')
+        if zstandard is None:
+            raise RuntimeError("برای خواندن فایل‌های .zst پکیج zstandard لازم است")
+        with open(zst_path, 'rb') as f:
+            return zstandard.ZstdDecompressor().decompress(f.read()).decode('utf-8')
+
+    def entries(self, area=None):
+        """خطوط index به ترتیب زمان ثبت"""
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if area is not None:
+            entries = [entry for entry in entries if entry.get('area') == area]
+        return entries
+
+    def replay(self, at, area=None):
+        """محتوای آخرین پاسخ دریافت شده تا زمان at (datetime یا رشته ISO) یا None
+
+        زمان‌ها به datetime تبدیل و مقایسه می‌شوند، نه به صورت رشته، تا زمان بدون
+        ثانیه یا با منطقه زمانی درست مرتب شود.
+        """
+        at = parse_time(at)
+        match = None
+        for entry in self.entries(area):
+            if parse_time(entry['time']) <= at:
+                match = entry
+        return self.load(match['hash']) if match else None
@@ -38,6 +38,81 @@ DEFAULT_AREA_CODE = '61'
 MAX_RESULTS = 10
 MAX_MESSAGE_LENGTH = 4096
 
+# نام‌های جایگزین مناطق برای تشخیص در پیام کاربران
+AREA_ALIASES = {
+    'ساری': ['ساري'],
+    'قائم‌شهر': ['قائمشهر', 'قائم شهر', 'قایمشهر', 'قایم‌شهر', 'قایم شهر'],
+}
+
+# محدودیت درخواست: نرخ (توکن در ثانیه) و ظرفیت burst برای هر کاربر و هر چت
+THROTTLE_USER_RATE = 0.2
+THROTTLE_USER_BURST = 5
+THROTTLE_CHAT_RATE = 0.5
+THROTTLE_CHAT_BURST = 10
+SEARCH_CACHE_TTL = 120      # نگه‌داری نتیجه جستجوها برای پاسخ به تکرارها (ثانیه)
+SUBSCRIBER_CACHE_TTL = 30 * 24 * 3600   # نگه‌داری نگاشت کد اشتراک به منطقه و فیدر
+
+# صف جستجوهای ربات: تعداد worker همزمان و حداکثر جستجوهای متمایز در انتظار
+SEARCH_WORKERS = 4
+SEARCH_QUEUE_SIZE = 100
+
+# بودجه حافظه کش‌های درون پردازه (بایت): ایندکس snapshotها و مقدارهای کش شده
+INDEX_CACHE_BYTES = 64 * 1024 * 1024
+VALUE_CACHE_BYTES = 32 * 1024 * 1024
+
+# فاصله ذخیره وضعیت برای شروع دوباره سریع (با متغیر محیطی STATE_FILE فعال می‌شود)
+STATE_SAVE_INTERVAL = 60
+
+# API وب (api_server.py)
+API_HOST = '0.0.0.0'
+API_PORT = 8080
+API_RESPONSE_CACHE_BYTES = 16 * 1024 * 1024   # بدنه‌های JSON و gzip آماده بر اساس ETag
+
+# حالت inline: فقط از snapshot موجود پاسخ داده می‌شود و هرگز به سایت درخواست نمی‌رود
+INLINE_CACHE_TIME = 30      # مدت کش نتایج در سرورهای تلگرام (ثانیه)
+INLINE_RESULTS_LIMIT = 20   # حداکثر نتایج هر پرسش (سقف تلگرام 50)
+INLINE_CACHE_SIZE = 2000    # تعداد پرسش‌های کش شده در حافظه
+
+# اعلان تغییرات به مشترکان: تغییرات هر چت در این پنجره یک پیام خلاصه می‌شوند (ثانیه)
+DIGEST_WINDOW = 120
+# هر snapshot جدید فقط در یک worker اعلان می‌شود؛ مدت نگه‌داری این ثبت در store (ثانیه)
+NOTIFY_CLAIM_TTL = 24 * 3600
+SUBSCRIPTIONS_PER_CHAT = 10
+
+# پیام‌های نتیجه با خاموشی بدون ساعت پایان («***») با تغییر جدول در جا ویرایش می‌شوند
+LIVE_MESSAGE_TTL = 6 * 3600     # مدت دنبال کردن هر پیام (ثانیه)
+LIVE_MESSAGES_LIMIT = 5000      # حداکثر پیام‌های دنبال شده
+LIVE_EDIT_RATE = 20             # حداکثر ویرایش در ثانیه (سقف تلگرام حدود 30 پیام در ثانیه)
+LIVE_CHECK_INTERVAL = 15        # فاصله بررسی تغییر snapshotها (ثانیه)
+
+# فایل‌های CSV ذخیره شده برای بارگذاری تاریخچه آمار (منطقه پیش‌فرض)
+ANALYTICS_HISTORY_GLOB = 'power_outages_*.csv'
+
+# بایگانی فشرده پاسخ‌های سایت (به جای فایل‌های HTML خام)
+ARCHIVE_DIR = 'archive'
+
+# مسیر پیش‌فرض فایل‌های پروفایل وقتی ادمین با /profile on آن را فعال می‌کند
+PROFILE_DIR = 'profiles'
+
+# تنظیمات snapshot و اجرای چند پردازه‌ای (ثانیه)
+SNAPSHOT_TTL = 300          # عمر snapshot پیش از دریافت دوباره از سایت
+PREFETCH_INTERVAL = 300     # فاصله دریافت دوره‌ای توسط پردازه رهبر وقتی POLL_BUDGET_PER_HOUR صفر است
+LEADER_LEASE_TTL = 60       # مدت اعتبار اجاره رهبری
+KV_PURGE_INTERVAL = 3600    # فاصله حذف مقدارها و claimهای منقضی شده store توسط رهبر (ثانیه)
+
+# زمان‌بندی تطبیقی دریافت: بودجه کل درخواست‌ها بین مناطق به نسبت نرخ تغییرشان تقسیم می‌شود
+POLL_BUDGET_PER_HOUR = 45   # مجموع درخواست‌های دوره‌ای همه مناطق در ساعت (0 = فاصله ثابت)
+POLL_MIN_INTERVAL = 60      # کمترین فاصله دریافت یک منطقه
+POLL_MAX_STALENESS = 1800   # بیشترین عمر snapshot هر منطقه
+POLL_HALF_LIFE_HOURS = 72   # نیمه‌عمر آمار نرخ تغییر
+
+# مخزن sessionهای مستقل سایت (هر session با cookie و tokenهای ViewState خود)
+SESSION_POOL_SIZE = 4       # حداکثر درخواست همزمان به سایت
+SESSION_MAX_ERRORS = 3      # خطای پیاپی که session را کنار می‌گذارد
+SESSION_MAX_USES = 500      # تعداد استفاده پیش از جایگزینی session با session تازه
+SESSION_IDLE_CHECK = 600    # بررسی سلامت sessionی که این مدت (ثانیه) موفق نبوده پیش از استفاده دوباره
+SESSION_ACQUIRE_TIMEOUT = 30  # حداکثر انتظار برای session آزاد پیش از صرف‌نظر از درخواست (ثانیه)
+
 # پیام‌های ربات
 MESSAGES = {
     'welcome': """
@@ -51,6 +126,10 @@ MESSAGES = {
 /search - جستجوی خاموشی
 /areas - لیست مناطق
 /latest - آخرین خاموشی‌ها
+/subscriber - جستجو با کد اشتراک
+/stats - آمار خاموشی‌ها
+/next - خاموشی بعدی یک فیدر
+/subscribe - اعلان تغییرات یک فیدر
 
 💡 **نحوه استفاده:**
 - برای جستجو: `/search منطقه کلمه_کلیدی`
@@ -77,11 +156,33 @@ MESSAGES = {
 📋 **آخرین خاموشی‌ها:**
 - `/latest` - نمایش آخرین خاموشی‌های ثبت شده
 
+🔢 **کد اشتراک:**
+- `/subscriber کد_اشتراک` - خاموشی‌های مربوط به کنتور شما
+- `/subscriber` - تکرار آخرین کد اشتراک وارد شده
+
+📊 **آمار:**
+- `/stats` - آمار همه مناطق
+- `/stats ساری` - آمار منطقه و پرخاموشی‌ترین فیدرها
+- `/stats ساری 53` - آمار یک فیدر
+
+⏭ **خاموشی بعدی:**
+- `/next ساری 53` - زمان خاموشی اعلام شده یا برآورد شده بعدی فیدر
+
+🔔 **اعلان تغییرات:**
+- `/subscribe ساری 53` - اعلان خاموشی‌های جدید، تغییر ساعت یا لغو فیدر 53
+- `/subscribe ساری شهاب نیا` - اعلان برای یک کلمه کلیدی
+- `/subscribe` - لیست اشتراک‌های این چت
+- `/unsubscribe ساری 53` یا `/unsubscribe` برای لغو همه
+- تغییرات چند دقیقه جمع و در یک پیام فرستاده می‌شوند
+
 💡 **جستجوی سریع:**
 - فقط نام منطقه را تایپ کنید: "بابل"
 - یا کلمه کلیدی: "شهاب نیا"
 - یا ترکیبی: " شهاب"
 
+⌨️ **حالت inline:**
+- در هر چتی تایپ کنید: `@نام_ربات شهاب نیا`
+
 ⚙️ **نکات مهم:**
 - از کلمات فارسی استفاده کنید
 - برای جستجوی دقیق‌تر، نام منطقه + کلمه کلیدی را ترکیب کنید
@@ -92,6 +193,8 @@ MESSAGES = {
     'no_results': "❌ هیچ خاموشی‌ای یافت نشد.",
     'error': "❌ خطا در دریافت اطلاعات خاموشی‌ها",
     'search_error': "❌ خطا در انجام جستجو",
+    'overloaded': "⏳ سرور در حال حاضر شلوغ است. لطفاً چند دقیقه دیگر دوباره تلاش کنید.",
+    'throttled': "⏳ تعداد درخواست‌های شما زیاد است؛ لطفاً چند ثانیه دیگر دوباره تلاش کنید.",
     'no_token': "❌ متغیر محیطی TELEGRAM_BOT_TOKEN تنظیم نشده است!"
 }
 
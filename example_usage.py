@@ -121,7 +121,7 @@ def example_save_data():
         save_html=True
     )
     
-    if result:
+    if result is not None:
         print("✅ داده‌ها با موفقیت ذخیره شدند")
         print("📁 فایل‌های ایجاد شده:")
         print("   - power_outages_YYYYMMDD_HHMMSS.csv")
@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from analytics import UNPLANNED_REGION
+from jalali import outage_window, local_minutes_to_datetime
+
+# بازه خاموشی: زمان شروع و پایان (epoch، پایان نامشخص None) و با برنامه بودن
+Window = namedtuple('Window', ['start', 'end', 'planned'])
+
+# برآورد چرخش: فاصله معمول بین خاموشی‌ها (ثانیه) و آخرین شروع مشاهده شده (epoch)
+Rotation = namedtuple('Rotation', ['interval', 'last_start'])
+
+# ورودی جدول برای هر فیدر
+ScheduleEntry = namedtuple('ScheduleEntry', ['windows', 'rotation'])
+
+# کمترین فاصله قابل قبول بین دو خاموشی برای برآورد چرخش (ثانیه)
+MIN_ROTATION_INTERVAL = 3600
+
+
+class FeederSchedule:
+    """جدول از پیش ساخته شده خاموشی‌های آینده هر فیدر در هر منطقه
+
+    برای هر فیدر، بازه‌های اعلام شده‌ای که هنوز تمام نشده‌اند و برآورد چرخش
+    خاموشی‌های با برنامه (میانه فاصله شروع‌ها در تاریخچه) نگه داشته می‌شود.
+    جدول هر منطقه با رسیدن snapshot جدید یکجا جایگزین می‌شود تا پرسش «خاموشی
+    بعدی من کی است» فقط یک جستجوی دیکشنری باشد.
+    """
+
+    def __init__(self):
+        self._areas = {}
+        self._lock = threading.Lock()
+
+    def rebuild_area(self, area_name, outages, analytics=None, now=None):
+        """ساخت دوباره جدول یک منطقه از snapshot جاری و تاریخچه آمار"""
+        now = now if now is not None else time.time()
+        windows = {}
+        for outage in outages:
+            feeder = outage.get('feeder')
+            start_at, end_at = outage_window(outage)
+            if not feeder or start_at is None:
+                continue
+            end = end_at.timestamp() if end_at else None
+            if end is not None and end <= now:
+                continue
+            planned = ' '.join(outage.get('region', '').split()) != UNPLANNED_REGION
+            windows.setdefault(feeder, []).append(Window(start_at.timestamp(), end, planned))
+
+        rotations = {}
+        series = analytics.start_series(area_name) if analytics is not None else {}
+        for feeder, starts in series.items():
+            starts = np.unique(starts)
+            if len(starts) < 2:
+                continue
+            interval = float(np.median(np.diff(starts))) * 60
+            if interval < MIN_ROTATION_INTERVAL:
+                continue
+            last_start = local_minutes_to_datetime(starts[-1]).timestamp()
+            rotations[feeder] = Rotation(interval, last_start)
+
+        table = {}
+        for feeder in set(windows) | set(rotations):
+            feeder_windows = tuple(sorted(windows.get(feeder, ())))
+            table[feeder] = ScheduleEntry(feeder_windows, rotations.get(feeder))
+
+        with self._lock:
+            self._areas[area_name] = table
+        return table
+
+    def feeders(self, area_name):
+        """شماره فیدرهای شناخته شده یک منطقه"""
+        return sorted(self._areas.get(area_name, {}), key=int)
+
+    def next_outage(self, area_name, feeder, now=None):
+        """خاموشی بعدی فیدر: (Window اعلام شده یا None، زمان برآوردی epoch یا None)"""
+        entry = self._areas.get(area_name, {}).get(str(feeder))
+        if entry is None:
+            return None, None
+        now = now if now is not None else time.time()
+
+        announced = next(
+            (window for window in entry.windows if window.end is None or window.end > now),
+            None
+        )
+
+        estimate = None
+        if entry.rotation is not None:
+            interval, last_start = entry.rotation
+            steps = max(1, int(np.ceil((now - last_start) / interval)))
+            estimate = last_start + steps * interval
+        return announced, estimate
@@ -0,0 +1,173 @@
+import time
+import hashlib
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from analytics import UNPLANNED_REGION
+from jalali import outage_window, IRAN_TZ
+from outage_index import parse_feeder_term
+
+# رویداد تقویم یک خاموشی: فیدر، روز محلی، زمان شروع (epoch) و متن VEVENT
+CalendarEvent = namedtuple('CalendarEvent', ['feeder', 'day', 'start', 'text'])
+
+# فید آماده: بدنه بایتی و ETag آن
+CalendarFeed = namedtuple('CalendarFeed', ['body', 'etag'])
+
+# مدت فرضی خاموشی‌هایی که ساعت پایان آن‌ها «***» است
+UNKNOWN_END_DURATION = timedelta(hours=2)
+
+
+def escape_text(text):
+    """escape متن برای مقدارهای TEXT در iCalendar"""
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold_line(line):
+    """شکستن خط به تکه‌های حداکثر 75 بایتی بدون بریدن نویسه‌های UTF-8"""
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    pieces = []
+    current = ''
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            pieces.append(current)
+            current = ''
+            size = 0
+            limit = 74  # خطوط ادامه با یک فاصله شروع می‌شوند
+        current += char
+        size += char_size
+    pieces.append(current)
+    return '\r\n '.join(pieces)
+
+
+def format_utc(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def outage_event(area_name, outage):
+    """رویداد تقویم یک خاموشی یا None اگر تاریخ/ساعت آن معتبر نیست"""
+    start_at, end_at = outage_window(outage)
+    if start_at is None:
+        return None
+
+    # شماره فیدر به همان شکل کلیدهای OutageIndex («053» -> «53»)
+    feeder = parse_feeder_term(outage['feeder']) if outage.get('feeder') else None
+    description = outage.get('description', '')
+    # شناسه پایدار: همان خاموشی در snapshotهای بعدی همان UID را دارد
+    identity = f"{area_name}|{feeder or description}|{outage.get('date')}|{outage.get('start_time')}"
+    uid = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    planned = ' '.join(outage.get('region', '').split()) != UNPLANNED_REGION
+    summary = f"خاموشی فیدر {feeder}" if feeder else "خاموشی برق"
+    summary += f" - {area_name} ({'با برنامه' if planned else 'بی برنامه'})"
+    details = description if end_at else f"{description}\nساعت پایان اعلام نشده است"
+
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}@khamooshi.maztozi.ir',
+        # DTSTAMP ثابت تا بدنه فید بین snapshotهای یکسان تغییر نکند
+        f'DTSTAMP:{format_utc(start_at)}',
+        f'DTSTART:{format_utc(start_at)}',
+        f'DTEND:{format_utc(end_at or start_at + UNKNOWN_END_DURATION)}',
+        f'SUMMARY:{escape_text(summary)}',
+        f'LOCATION:{escape_text(area_name)}',
+        f'DESCRIPTION:{escape_text(details)}',
+        'END:VEVENT',
+    ]
+    text = ''.join(fold_line(line) + '\r\n' for line in lines)
+    return uid, CalendarEvent(feeder, start_at.date(), start_at.timestamp(), text)
+
+
+class CalendarFeeds:
+    """فیدهای iCalendar هر منطقه و هر فیدر که فقط با تغییر رویدادها دوباره ساخته می‌شوند
+
+    رویدادهای روزهایی که snapshot جاری پوشش می‌دهد با همان snapshot جایگزین
+    می‌شوند و رویدادهای روزهای قبل تا history_days روز نگه داشته می‌شوند تا
+    خاموشی‌های گذشته از تقویم کاربران پاک نشوند. بدنه هر فید به صورت بایت کش
+    می‌شود و فقط فیدهایی که مجموعه رویدادشان عوض شده دوباره ساخته می‌شوند.
+    """
+
+    def __init__(self, history_days=14):
+        self.history_days = history_days
+        self.digests = {}       # منطقه -> digest آخرین snapshot اعمال شده
+        self._events = {}       # منطقه -> {uid: CalendarEvent}
+        self._feeds = {}        # (منطقه، فیدر یا None) -> CalendarFeed
+        self._lock = threading.Lock()
+
+    def update_area(self, area_name, snapshot, now=None):
+        """اعمال snapshot جدید یک منطقه؛ خروجی کلید فیدهایی که دوباره ساخته شدند"""
+        with self._lock:
+            if self.digests.get(area_name) == snapshot['digest']:
+                return set()
+
+            now = now if now is not None else time.time()
+            today = datetime.fromtimestamp(now, IRAN_TZ).date()
+            fresh = {}
+            for outage in snapshot['outages']:
+                event = outage_event(area_name, outage)
+                if event:
+                    fresh[event[0]] = event[1]
+            covered = {event.day for event in fresh.values()} | {today}
+            oldest = today - timedelta(days=self.history_days)
+
+            previous = self._events.get(area_name, {})
+            events = {
+                uid: event for uid, event in previous.items()
+                if event.day not in covered and event.day >= oldest
+            }
+            events.update(fresh)
+
+            changed_feeders = {
+                event.feeder for uid, event in previous.items() if events.get(uid) != event
+            } | {
+                event.feeder for uid, event in events.items() if previous.get(uid) != event
+            }
+            self._events[area_name] = events
+            self.digests[area_name] = snapshot['digest']
+
+            rebuilt = set()
+            if changed_feeders or (area_name, None) not in self._feeds:
+                for feeder in changed_feeders | {None}:
+                    key = (area_name, feeder)
+                    if feeder is not None and not any(event.feeder == feeder for event in events.values()):
+                        self._feeds.pop(key, None)
+                        continue
+                    self._feeds[key] = self._render(area_name, feeder)
+                    rebuilt.add(key)
+            return rebuilt
+
+    def _render(self, area_name, feeder):
+        """ساخت بدنه فید منطقه (feeder=None) یا یک فیدر"""
+        events = self._events.get(area_name, {}).values()
+        if feeder is not None:
+            events = [event for event in events if event.feeder == feeder]
+        name = f"خاموشی فیدر {feeder} - {area_name}" if feeder else f"خاموشی‌های {area_name}"
+
+        lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//khamooshi-mazandaran//outage-feeds//FA',
+            'CALSCALE:GREGORIAN',
+            'METHOD:PUBLISH',
+            f'X-WR-CALNAME:{escape_text(name)}',
+            'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+            'X-PUBLISHED-TTL:PT1H',
+        ]
+        body = ''.join(fold_line(line) + '\r\n' for line in lines)
+        body += ''.join(event.text for event in sorted(events, key=lambda event: (event.start, event.text)))
+        body = (body + 'END:VCALENDAR\r\n').encode('utf-8')
+
+        return CalendarFeed(body, hashlib.sha1(body).hexdigest()[:24])
+
+    def feed(self, area_name, feeder=None):
+        """فید آماده یک منطقه یا فیدر؛ فیدر بدون رویداد تقویم خالی (کش نشده) می‌گیرد"""
+        with self._lock:
+            cached = self._feeds.get((area_name, feeder))
+            if cached is None:
+                cached = self._render(area_name, feeder)
+            return cached
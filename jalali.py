@@ -0,0 +1,110 @@
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# منطقه زمانی ساعت‌های اعلام شده در سایت
+IRAN_TZ = ZoneInfo('Asia/Tehran')
+
+
+def jalali_to_gregorian(jy, jm, jd):
+    """تبدیل تاریخ شمسی به میلادی و برگرداندن (سال، ماه، روز)"""
+    jy += 1595
+    days = -355668 + 365 * jy + (jy // 33) * 8 + ((jy % 33) + 3) // 4 + jd
+    days += (jm - 1) * 31 if jm < 7 else (jm - 7) * 30 + 186
+
+    gy = 400 * (days // 146097)
+    days %= 146097
+    if days > 36524:
+        days -= 1
+        gy += 100 * (days // 36524)
+        days %= 36524
+        if days >= 365:
+            days += 1
+    gy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        gy += (days - 1) // 365
+        days = (days - 1) % 365
+
+    gd = days + 1
+    leap = (gy % 4 == 0 and gy % 100 != 0) or gy % 400 == 0
+    month_days = [31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    gm = 0
+    while gm < 12 and gd > month_days[gm]:
+        gd -= month_days[gm]
+        gm += 1
+    return gy, gm + 1, gd
+
+
+def gregorian_to_jalali(gy, gm, gd):
+    """تبدیل تاریخ میلادی به شمسی و برگرداندن (سال، ماه، روز)"""
+    g_days_before = [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+    gy2 = gy + 1 if gm > 2 else gy
+    days = (355666 + 365 * gy + (gy2 + 3) // 4 - (gy2 + 99) // 100
+            + (gy2 + 399) // 400 + gd + g_days_before[gm - 1])
+    jy = -1595 + 33 * (days // 12053)
+    days %= 12053
+    jy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        jy += (days - 1) // 365
+        days = (days - 1) % 365
+    if days < 186:
+        return jy, 1 + days // 31, 1 + days % 31
+    return jy, 7 + (days - 186) // 30, 1 + (days - 186) % 30
+
+
+def parse_jalali_date(text):
+    """تبدیل «1404/05/16» به date میلادی یا None برای متن نامعتبر"""
+    try:
+        jy, jm, jd = (int(part) for part in text.strip().split('/'))
+        return date(*jalali_to_gregorian(jy, jm, jd))
+    except (ValueError, AttributeError):
+        return None
+
+
+def parse_clock(text):
+    """تبدیل «10:35» به دقیقه از ابتدای روز یا None (مثلاً برای «***»)"""
+    try:
+        hour, minute = (int(part) for part in text.strip().split(':'))
+    except (ValueError, AttributeError):
+        return None
+    if 0 <= hour <= 24 and 0 <= minute < 60:
+        return hour * 60 + minute
+    return None
+
+
+def outage_window(outage):
+    """بازه زمانی (شروع، پایان) یک خاموشی به وقت ایران؛ پایان نامشخص None است"""
+    day = parse_jalali_date(outage.get('date', ''))
+    start = parse_clock(outage.get('start_time', ''))
+    if day is None or start is None:
+        return None, None
+
+    base = datetime(day.year, day.month, day.day, tzinfo=IRAN_TZ)
+    start_at = base.replace(hour=start // 60 % 24, minute=start % 60)
+    end = parse_clock(outage.get('end_time', ''))
+    if end is None:
+        return start_at, None
+
+    end_minutes = end if end >= start else end + 24 * 60
+    end_at = datetime.fromtimestamp(base.timestamp() + end_minutes * 60, IRAN_TZ)
+    return start_at, end_at
+
+
+def today_jalali(now=None):
+    """تاریخ شمسی امروز به وقت ایران به صورت «1404/05/16»"""
+    now = now or datetime.now(IRAN_TZ)
+    jy, jm, jd = gregorian_to_jalali(now.year, now.month, now.day)
+    return f"{jy:04d}/{jm:02d}/{jd:02d}"
+
+
+def local_minutes_to_datetime(minutes):
+    """تبدیل دقیقه محلی از مبدأ ordinal (خروجی آمار) به datetime وقت ایران"""
+    day = date.fromordinal(int(minutes) // 1440)
+    return datetime(day.year, day.month, day.day, tzinfo=IRAN_TZ) + timedelta(minutes=int(minutes) % 1440)
+
+
+def format_jalali_datetime(moment):
+    """نمایش datetime به صورت «1404/05/16 ساعت 10:35» به وقت ایران"""
+    moment = moment.astimezone(IRAN_TZ)
+    return f"{today_jalali(moment)} ساعت {moment:%H:%M}"
@@ -0,0 +1,139 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from jalali import outage_window
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# پیام زنده: کلید جستجو (منطقه، کلمات)، digest snapshot سازنده متن، متن نتایج (بدون پانویس) و زمان ثبت
+LiveMessage = namedtuple('LiveMessage', ['key', 'digest', 'body', 'registered_at'])
+
+
+def is_open_ended(outage):
+    """خاموشی شروع شده یا اعلام شده‌ای که ساعت پایان آن هنوز «***» است"""
+    start_at, end_at = outage_window(outage)
+    return start_at is not None and end_at is None
+
+
+class LiveMessages:
+    """پیام‌های نتیجه جستجو که با تغییر snapshot منطقه در جا ویرایش می‌شوند
+
+    هر پیام با کلید جستجو و digest snapshotی که از آن ساخته شده ثبت می‌شود.
+    ویرایش‌ها در صفی جمع می‌شوند که برای هر پیام فقط آخرین متن را نگه
+    می‌دارد و با نرخ کلی rate ویرایش در ثانیه و حداکثر یک ویرایش در هر
+    chat_interval ثانیه برای هر چت (سه برابر برای گروه‌ها) خارج می‌شود.
+    پیام‌ها پس از ttl ثانیه یا وقتی خاموشی بی‌پایانی در نتیجه نماند رها می‌شوند.
+    """
+
+    def __init__(self, ttl=6 * 3600, limit=5000, rate=20, chat_interval=1.0):
+        self.ttl = ttl
+        self.limit = limit
+        self.chat_interval = chat_interval
+        self.messages = OrderedDict()   # (chat_id, message_id) -> LiveMessage
+        self.edits = OrderedDict()      # (chat_id, message_id) -> متن در انتظار ویرایش
+        self.bucket = TokenBucket(rate, rate, now=0)
+        self.chat_ready = {}            # chat_id -> زمانی که ویرایش بعدی آن چت مجاز است
+        self.edited = 0
+        self.unchanged = 0
+        self.superseded = 0
+        self._lock = threading.Lock()
+
+    def register(self, chat_id, message_id, key, digest, body, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self.messages[(chat_id, message_id)] = LiveMessage(key, digest, body, now)
+            while len(self.messages) > self.limit:
+                self.messages.popitem(last=False)
+
+    def areas(self):
+        """مناطقی که پیام زنده دارند"""
+        with self._lock:
+            return {message.key[0] for message in self.messages.values()}
+
+    def stale(self, area_name, digest, now=None):
+        """پیام‌های منطقه که از snapshot دیگری ساخته شده‌اند، گروه‌بندی شده با کلید جستجو
+
+        پیام‌های منقضی در همین گذر رها می‌شوند.
+        """
+        now = now if now is not None else time.monotonic()
+        groups = {}
+        with self._lock:
+            for ref, message in list(self.messages.items()):
+                if now - message.registered_at > self.ttl:
+                    del self.messages[ref]
+                elif message.key[0] == area_name and message.digest != digest:
+                    groups.setdefault(message.key, []).append(ref)
+        return groups
+
+    def refresh(self, ref, digest, body, text, finished=False):
+        """متن جدید یک پیام برای snapshot با digest داده شده
+
+        فقط وقتی نتایج (body) عوض شده باشند text به صف ویرایش می‌رود؛ با
+        finished پیام پس از آخرین ویرایش دیگر دنبال نمی‌شود.
+        """
+        with self._lock:
+            message = self.messages.get(ref)
+            if message is None:
+                return
+            if finished:
+                del self.messages[ref]
+            else:
+                self.messages[ref] = message._replace(digest=digest, body=body)
+            if body == message.body:
+                self.unchanged += 1
+                return
+            if ref in self.edits:
+                self.superseded += 1
+            self.edits[ref] = text
+
+    def forget(self, ref):
+        """رها کردن پیامی که دیگر قابل ویرایش نیست (حذف شده یا ربات مسدود شده)"""
+        with self._lock:
+            self.messages.pop(ref, None)
+            self.edits.pop(ref, None)
+
+    def take_edits(self, now=None):
+        """ویرایش‌هایی که اکنون مجازند به صورت لیست (chat_id، message_id، متن)"""
+        now = now if now is not None else time.monotonic()
+        ready = []
+        with self._lock:
+            self.bucket.refill(now)
+            for ref, text in list(self.edits.items()):
+                if self.bucket.tokens < 1:
+                    break
+                chat_id = ref[0]
+                if self.chat_ready.get(chat_id, 0) > now:
+                    continue
+                # گروه‌ها (شناسه منفی) محدودیت سخت‌گیرانه‌تری در تلگرام دارند
+                interval = self.chat_interval * (3 if chat_id < 0 else 1)
+                self.chat_ready[chat_id] = now + interval
+                self.bucket.tokens -= 1
+                del self.edits[ref]
+                ready.append((chat_id, ref[1], text))
+            self.edited += len(ready)
+            # زمان‌های گذشته دیگر لازم نیستند
+            self.chat_ready = {chat_id: ready_at for chat_id, ready_at in self.chat_ready.items() if ready_at > now}
+        return ready
+
+    def retry_after(self, chat_id, message_id, text, delay, now=None):
+        """بازگرداندن ویرایش به صف و توقف همه ویرایش‌ها به مدت delay ثانیه (خطای RetryAfter)"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self.edits.setdefault((chat_id, message_id), text)
+            self.edits.move_to_end((chat_id, message_id), last=False)
+            self.edited -= 1
+            self.bucket.refill(now)
+            self.bucket.tokens = -delay * self.bucket.rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'messages': len(self.messages),
+                'pending_edits': len(self.edits),
+                'edited': self.edited,
+                'unchanged': self.unchanged,
+                'superseded': self.superseded,
+            }
@@ -0,0 +1,326 @@
+import sys
+import glob
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from main import PowerOutageChecker
+from telegram_bot import BlackoutTelegramBot
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Load Test', 'username': 'load_test_bot'}
+
+# صفحه اولیه با فیلدهای مخفی ASP.NET که checker از آن ViewState می‌خواند
+INITIAL_PAGE = """<html><body><form>
+<input type="hidden" name="__VIEWSTATE" value="stub-viewstate" />
+<input type="hidden" name="__VIEWSTATEGENERATOR" value="stub-generator" />
+<input type="hidden" name="__EVENTVALIDATION" value="stub-validation" />
+</form></body></html>"""
+
+DEFAULT_MIX = 'search=50,text=30,latest=10,callback=10'
+
+CALLBACK_DATA = ['latest_outages', 'areas_list', 'help_info', 'search_area_ساری', 'free_search']
+
+
+class UpstreamStub:
+    """سایت خاموشی محلی: GET صفحه اولیه و POST پاسخ delta نمونه را با تأخیر latency برمی‌گرداند"""
+
+    def __init__(self, response_html, latency=0.0):
+        self.response = response_html.encode('utf-8')
+        self.latency = latency
+        self.requests = Counter()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests['GET'] += 1
+                self.reply(INITIAL_PAGE.encode('utf-8'))
+
+            def do_POST(self):
+                stub.requests['POST'] += 1
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(stub.latency)
+                self.reply(stub.response)
+
+            def reply(self, body):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        self._thread = threading.Thread(target=self.server.serve_forever, name='upstream-stub', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockTelegramRequest(BaseRequest):
+    """BaseRequest بدون شبکه: هر متد API تلگرام پس از latency ثانیه پاسخ موفق ساختگی می‌گیرد"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        parameters = request_data.parameters if request_data is not None else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': parameters.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': parameters.get('chat_id'), 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def parse_mix(text):
+    """«search=50,text=30» -> {'search': 50.0, 'text': 30.0}"""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in ('search', 'text', 'latest', 'callback'):
+            raise ValueError(f"نوع درخواست ناشناخته: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(values, fraction):
+    """صدک با روش nearest-rank روی لیست مرتب"""
+    if not values:
+        return float('nan')
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+class LoadGenerator:
+    """ساخت Updateهای ساختگی و ارسال آن‌ها به application با نرخ ثابت (open-loop)
+
+    هر Update در task جداگانه با application.process_update پردازش می‌شود؛
+    تأخیر از لحظه ارسال تا پایان handler اندازه گرفته می‌شود، پس صف شدن در
+    صف جستجو و انتظار برای دریافت از سایت هم در آن دیده می‌شود.
+    """
+
+    def __init__(self, application, mix, users, queries, seed=None):
+        self.application = application
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.users = users
+        self.queries = queries
+        self.random = random.Random(seed)
+        self.latencies = {kind: [] for kind in self.kinds}
+        self.errors = Counter()
+        self._kinds_by_update = {}
+        self._update_ids = itertools.count(1)
+        application.add_error_handler(self.on_error)
+
+    async def on_error(self, update, context):
+        kind = self._kinds_by_update.get(getattr(update, 'update_id', None), 'unknown')
+        self.errors[kind] += 1
+        if self.errors[kind] <= 3:
+            logger.warning(f"خطا در handler ({kind}): {context.error!r}")
+
+    def make_update(self, kind):
+        update_id = next(self._update_ids)
+        user_id = self.random.randint(1, self.users)
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+        chat = {'id': user_id, 'type': 'private'}
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user}
+
+        if kind == 'callback':
+            bot_message = dict(message, **{'from': BOT_USER, 'text': 'منو'})
+            data = {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                'message': bot_message, 'data': self.random.choice(CALLBACK_DATA),
+            }}
+        else:
+            if kind == 'search':
+                text = f"/search {self.random.choice(self.queries)}"
+            elif kind == 'latest':
+                text = '/latest'
+            else:
+                text = self.random.choice(self.queries)
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            data = {'update_id': update_id, 'message': message}
+
+        self._kinds_by_update[update_id] = kind
+        return Update.de_json(data, self.application.bot)
+
+    async def process(self, kind, update):
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    async def run(self, rate, duration):
+        """ارسال rate درخواست در ثانیه به مدت duration ثانیه؛ خروجی مدت کل تا پایان آخرین handler"""
+        total = int(rate * duration)
+        tasks = []
+        started = time.perf_counter()
+        for position in range(total):
+            delay = started + position / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            tasks.append(asyncio.create_task(self.process(kind, self.make_update(kind))))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return time.perf_counter() - started
+
+
+def sample_queries(bot, outages, count=40, seed=None):
+    """پرسش‌های نمونه از روی داده‌ها: «منطقه فیدر» و کلمات توضیحات"""
+    rng = random.Random(seed)
+    areas = list(bot.default_areas)
+    feeders = sorted({outage['feeder'] for outage in outages if outage.get('feeder')}) or ['53']
+    words = [word for outage in outages for word in outage.get('description', '').split() if len(word) > 3] or ['شهاب']
+    queries = []
+    for _ in range(count):
+        area = rng.choice(areas)
+        queries.append(f"{area} {rng.choice(feeders)}" if rng.random() < 0.6 else f"{area} {rng.choice(words)}")
+    return queries
+
+
+def format_report(result):
+    lines = [
+        f"درخواست‌ها: {result['requests']} در {result['elapsed']:.1f} ثانیه "
+        f"(نرخ هدف {result['rate']:.0f}/s، توان عملیاتی {result['throughput']:.1f}/s)",
+        f"{'نوع':10} {'تعداد':>7} {'خطا':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+    ]
+    for kind, row in result['latency'].items():
+        lines.append(
+            f"{kind:10} {row['count']:7d} {row['errors']:5d} "
+            f"{row['p50']:9.1f} {row['p95']:9.1f} {row['p99']:9.1f} {row['max']:9.1f}"
+        )
+    lines.append(f"درخواست‌های سایت (stub): {dict(result['upstream'])}")
+    lines.append(f"فراخوانی‌های API تلگرام: {dict(result['telegram'])}")
+    lines.append(f"صف جستجو: {result['search_queue']}")
+    return '\n'.join(lines)
+
+
+async def run_load_test(rate, duration, users, mix, response_html, upstream_latency=0.0,
+                        telegram_latency=0.0, seed=None):
+    """اجرای یک آزمون بار روی نمونه تازه ربات و برگرداندن نتایج"""
+    upstream = UpstreamStub(response_html, upstream_latency)
+    upstream.start()
+    telegram = MockTelegramRequest(telegram_latency)
+    bot = BlackoutTelegramBot('1000000:LOADTEST', request=telegram)
+    bot.checker.base_url = upstream.url
+
+    def stub_checker():
+        checker = PowerOutageChecker()
+        checker.base_url = upstream.url
+        # درخواست‌های stub محلی نباید از proxy محیط بگذرند
+        checker.session.trust_env = False
+        return checker
+
+    bot.sessions.factory = stub_checker
+
+    try:
+        await bot.application.initialize()
+        queries = sample_queries(bot, bot.checker.parse_outages(response_html), seed=seed)
+        generator = LoadGenerator(bot.application, mix, users, queries, seed)
+        elapsed = await generator.run(rate, duration)
+        await bot.search_queue.close()
+        await bot.application.shutdown()
+    finally:
+        upstream.stop()
+
+    all_latencies = sorted(value for values in generator.latencies.values() for value in values)
+    latency = {}
+    for kind, values in list(generator.latencies.items()) + [('all', all_latencies)]:
+        values = sorted(values)
+        latency[kind] = {
+            'count': len(values),
+            'errors': sum(generator.errors.values()) if kind == 'all' else generator.errors[kind],
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+            'max': (values[-1] if values else float('nan')) * 1000,
+        }
+    return {
+        'rate': rate,
+        'requests': len(all_latencies),
+        'elapsed': elapsed,
+        'throughput': len(all_latencies) / elapsed if elapsed else 0.0,
+        'latency': latency,
+        'upstream': dict(upstream.requests),
+        'telegram': dict(telegram.calls),
+        'search_queue': bot.search_queue.stats(),
+    }
+
+
+def main(argv=None):
+    """آزمون بار ربات با API تلگرام ساختگی و سایت محلی: python load_test.py --rate 200 --duration 30"""
+    parser = argparse.ArgumentParser(description='آزمون بار ربات خاموشی‌ها')
+    parser.add_argument('--rate', type=float, default=100, help='درخواست در ثانیه')
+    parser.add_argument('--duration', type=float, default=10, help='مدت ارسال درخواست‌ها (ثانیه)')
+    parser.add_argument('--users', type=int, default=1000, help='تعداد کاربران ساختگی متمایز')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'سهم انواع درخواست (پیش‌فرض {DEFAULT_MIX})')
+    parser.add_argument('--upstream-latency', type=float, default=0.3, help='تأخیر پاسخ سایت ساختگی (ثانیه)')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='تأخیر پاسخ API تلگرام ساختگی (ثانیه)')
+    parser.add_argument('--fixture', help='فایل پاسخ نمونه سایت (پیش‌فرض آخرین raw_response_*.html)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='ذخیره نتایج در فایل JSON')
+    args = parser.parse_args(argv)
+
+    fixture = args.fixture or next(iter(sorted(glob.glob('raw_response_*.html'), reverse=True)), None)
+    if not fixture:
+        print("فایل پاسخ نمونه‌ای پیدا نشد؛ با --fixture مشخص کنید")
+        return 2
+    with open(fixture, encoding='utf-8') as f:
+        response_html = f.read()
+
+    # لاگ هر درخواست در این حجم خود گلوگاه می‌شود
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run_load_test(
+        args.rate, args.duration, args.users, parse_mix(args.mix), response_html,
+        args.upstream_latency, args.telegram_latency, args.seed
+    ))
+    print(format_report(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,49 @@
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
+import os
 import re
+import csv
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import time
 import logging
+import threading
+
+from outage_index import OUTAGE_FIELDS, OutageIndex, outage_text, parse_feeder_term
+from parsers import OutageStreamParser, select_backend
+from archive import ResponseArchive
+from profiling import profiled
 
 # تنظیم logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# ستون‌های فایل CSV خروجی
+CSV_FIELDS = OUTAGE_FIELDS + ['feeder']
+
+# پاسخ delta خطای ASP.NET، مثلاً «47|error|500|Validation of viewstate MAC failed|»
+DELTA_ERROR_PATTERN = re.compile(r'\d+\|error\|')
+
+
 class PowerOutageChecker:
-    def __init__(self):
+    # عمر tokenهای ViewState صفحه اولیه پیش از دریافت دوباره (ثانیه)
+    token_ttl = 30 * 60
+    # مهلت اتصال و خواندن هر درخواست به سایت (ثانیه)؛ اتصال معلق session را نگه نمی‌دارد
+    request_timeout = (10, 30)
+    
+    def __init__(self, parser_backend=None):
         self.base_url = 'https://khamooshi.maztozi.ir/'
+        # سریع‌ترین backend نصب شده یا backend تعیین شده با PARSER_BACKEND
+        self.parser = select_backend(parser_backend or os.getenv('PARSER_BACKEND'))
         self.session = requests.Session()
         self.setup_session()
+        self.form_tokens = None
+        self.form_tokens_at = 0
+        self._tokens_lock = threading.Lock()
     
     def setup_session(self):
         """تنظیم session با headers مناسب"""
@@ -40,7 +69,7 @@ class PowerOutageChecker:
     def get_initial_data(self):
         """دریافت داده‌های اولیه برای استخراج ViewState و سایر فیلدهای ضروری"""
         try:
-            response = self.session.get(self.base_url)
+            response = self.session.get(self.base_url, timeout=self.request_timeout)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
                 
@@ -60,21 +89,67 @@ class PowerOutageChecker:
             logger.error(f"خطا در دریافت داده‌های اولیه: {e}")
             return None
 
-    def search_outages(self, city_code='990090345', area_code='61'):
-        """جستجوی خاموشی‌ها برای شهر و منطقه مشخص"""
-        initial_data = self.get_initial_data()
-        if not initial_data:
-            return None
-        
-        # داده‌های فرم برای ارسال درخواست
-        form_data = {
+    def get_form_tokens(self, refresh=False):
+        """tokenهای ViewState کش شده یا دریافت دوباره آن‌ها پس از token_ttl یا با refresh"""
+        with self._tokens_lock:
+            if refresh or not self.form_tokens or time.time() - self.form_tokens_at >= self.token_ttl:
+                tokens = self.get_initial_data()
+                if not tokens:
+                    return None
+                self.form_tokens = tokens
+                self.form_tokens_at = time.time()
+            return self.form_tokens
+
+    def submit_search(self, city_code, area_code, date_from='', date_to='', subscriber_code='', post=None):
+        """ارسال فرم با tokenهای کش شده؛ اگر رد شد یک بار با tokenهای تازه تکرار می‌شود
+
+        post فرم را می‌فرستد و پاسخ یا None (خطا یا رد شدن tokenها) برمی‌گرداند؛
+        پیش‌فرض post_search است و iter_outages نسخه تدریجی آن را می‌دهد.
+        """
+        post = post or self.post_search
+        for refresh in (False, True):
+            fetched_at = self.form_tokens_at
+            initial_data = self.get_form_tokens(refresh)
+            if not initial_data:
+                return None
+            
+            form_data = self.build_search_form(
+                initial_data, city_code, area_code, date_from, date_to, subscriber_code=subscriber_code
+            )
+            html_content = post(form_data)
+            if html_content is not None:
+                return html_content
+            if self.form_tokens_at != fetched_at:
+                # tokenها همین حالا دریافت شده بودند؛ تکرار فایده‌ای ندارد
+                break
+            logger.warning("پاسخ با tokenهای کش شده ناموفق بود؛ دریافت tokenهای تازه")
+        return None
+
+    def export_state(self):
+        """tokenها و cookieهای session برای ذخیره در شروع دوباره"""
+        return {
+            'form_tokens': self.form_tokens,
+            'form_tokens_at': self.form_tokens_at,
+            'cookies': self.session.cookies,
+        }
+
+    def restore_state(self, state):
+        """بازگرداندن tokenها و cookieهای ذخیره شده با export_state"""
+        self.form_tokens = state.get('form_tokens')
+        self.form_tokens_at = state.get('form_tokens_at', 0)
+        if state.get('cookies') is not None:
+            self.session.cookies.update(state['cookies'])
+
+    def build_search_form(self, initial_data, city_code, area_code, date_from='', date_to='', subscriber_code=''):
+        """ساخت داده‌های فرم جستجو (با subscriber_code جستجو بر اساس کد اشتراک انجام می‌شود)"""
+        return {
             'ctl00$ScriptManager1': 'ctl00$ContentPlaceHolder1$upOutage|ctl00$ContentPlaceHolder1$btnSearchOutage',
-            'ctl00$ContentPlaceHolder1$txtSubscriberCode': '',
-            'ctl00$ContentPlaceHolder1$outage': 'rbIsAddress',
+            'ctl00$ContentPlaceHolder1$txtSubscriberCode': subscriber_code,
+            'ctl00$ContentPlaceHolder1$outage': 'rbIsSubscriberCode' if subscriber_code else 'rbIsAddress',
             'ctl00$ContentPlaceHolder1$ddlCity': city_code,
             'ctl00$ContentPlaceHolder1$ddlArea': area_code,
-            'ctl00$ContentPlaceHolder1$txtPDateFrom': '',
-            'ctl00$ContentPlaceHolder1$txtPDateTo': '',
+            'ctl00$ContentPlaceHolder1$txtPDateFrom': date_from,
+            'ctl00$ContentPlaceHolder1$txtPDateTo': date_to,
             'ctl00$ContentPlaceHolder1$txtAddress': '',
             '__EVENTTARGET': '',
             '__EVENTARGUMENT': '',
@@ -85,11 +160,25 @@ class PowerOutageChecker:
             '__ASYNCPOST': 'true',
             'ctl00$ContentPlaceHolder1$btnSearchOutage': 'جستجو',
         }
-        
+
+    @profiled
+    def search_outages(self, city_code='990090345', area_code='61', date_from='', date_to=''):
+        """جستجوی خاموشی‌ها برای شهر و منطقه مشخص (تاریخ‌ها به صورت شمسی 1404/05/16)"""
+        return self.submit_search(city_code, area_code, date_from, date_to)
+
+    def search_by_subscriber_code(self, subscriber_code, date_from='', date_to=''):
+        """جستجوی خاموشی‌ها بر اساس کد اشتراک برق"""
+        return self.submit_search('-1', '-1', date_from, date_to, subscriber_code=subscriber_code)
+
+    def post_search(self, form_data):
+        """ارسال فرم جستجو و برگرداندن HTML پاسخ یا None"""
         # ارسال درخواست POST
         try:
-            response = self.session.post(self.base_url, data=form_data)
+            response = self.session.post(self.base_url, data=form_data, timeout=self.request_timeout)
             if response.status_code == 200:
+                if DELTA_ERROR_PATTERN.match(response.text):
+                    logger.warning("سایت فرم را با خطای ASP.NET رد کرد")
+                    return None
                 logger.info("درخواست با موفقیت ارسال شد")
                 return response.text
             else:
@@ -99,47 +188,149 @@ class PowerOutageChecker:
             logger.error(f"خطا در ارسال درخواست: {e}")
             return None
 
+    def post_search_stream(self, form_data, chunk_size=8192):
+        """ارسال فرم جستجو با دریافت تدریجی پاسخ؛ خروجی iterator تکه‌های متن یا None
+
+        فقط ابتدای پاسخ پیش از برگرداندن خوانده می‌شود تا خطای ASP.NET (tokenهای
+        رد شده) مثل post_search تشخیص داده شود؛ بقیه هنگام پیمایش دریافت می‌شود.
+        """
+        try:
+            response = self.session.post(self.base_url, data=form_data, stream=True, timeout=self.request_timeout)
+        except Exception as e:
+            logger.error(f"خطا در ارسال درخواست: {e}")
+            return None
+        
+        try:
+            if response.status_code != 200:
+                logger.error(f"خطا در ارسال درخواست: {response.status_code}")
+                response.close()
+                return None
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            chunks = response.iter_content(chunk_size=chunk_size, decode_unicode=True)
+            head = ''
+            for chunk in chunks:
+                head += chunk
+                if len(head) >= 64:
+                    break
+        except Exception as e:
+            logger.error(f"خطا در دریافت پاسخ: {e}")
+            response.close()
+            return None
+        
+        if DELTA_ERROR_PATTERN.match(head):
+            logger.warning("سایت فرم را با خطای ASP.NET رد کرد")
+            response.close()
+            return None
+        return self._stream_chunks(response, head, chunks)
+
+    @staticmethod
+    def _stream_chunks(response, head, chunks):
+        with response:
+            if head:
+                yield head
+            yield from chunks
+
+    def stream_outages(self, city_code='990090345', area_code='61', date_from='', date_to='', chunk_size=8192,
+                       raw=None):
+        """جستجو با دریافت تدریجی؛ خروجی generator خاموشی‌ها یا None اگر درخواست ناموفق بود
+
+        خطای اتصال در میانه پاسخ هنگام پیمایش به صورت استثنا بالا می‌آید. با
+        لیست raw تکه‌های متن پاسخ هم (برای ذخیره HTML خام) در آن جمع می‌شوند.
+        """
+        chunks = self.submit_search(
+            city_code, area_code, date_from, date_to,
+            post=lambda form_data: self.post_search_stream(form_data, chunk_size)
+        )
+        if chunks is None:
+            return None
+        return self._parse_chunks(chunks, raw)
+
+    @staticmethod
+    def _parse_chunks(chunks, raw=None):
+        parser = OutageStreamParser()
+        try:
+            for chunk in chunks:
+                if raw is not None:
+                    raw.append(chunk)
+                parser.feed(chunk)
+                yield from parser.drain()
+            parser.close()
+            yield from parser.drain()
+        finally:
+            chunks.close()
+
+    @profiled
+    def iter_outages(self, city_code='990090345', area_code='61', date_from='', date_to='', chunk_size=8192):
+        """جستجو و تحویل تدریجی خاموشی‌ها همزمان با دریافت پاسخ
+
+        پاسخ به صورت تکه‌ای خوانده و به OutageStreamParser داده می‌شود، پس
+        اولین رکوردها پیش از پایان دریافت در دسترس‌اند و حافظه ثابت می‌ماند.
+        tokenها مثل search_outages کش و در صورت رد شدن یک بار تازه می‌شوند.
+        خطای اتصال در میانه پاسخ پس از ثبت دوباره بالا می‌آید تا خروجی ناقص
+        (مثلاً CSV نیمه‌کاره) موفق به نظر نرسد.
+        """
+        outages = self.stream_outages(city_code, area_code, date_from, date_to, chunk_size)
+        if outages is None:
+            return
+        try:
+            yield from outages
+        except Exception as e:
+            logger.error(f"خطا در دریافت تدریجی خاموشی‌ها: {e}")
+            raise
+
+    def extract_selected_location(self, html_content):
+        """کد شهر و امور برق انتخاب شده در فرم پاسخ (کلیدهای نامشخص حذف می‌شوند)"""
+        soup = BeautifulSoup(html_content, 'html.parser')
+        location = {}
+        for field, name in (('city_code', 'ddlCity'), ('area_code', 'ddlArea')):
+            select = soup.find('select', {'name': f'ctl00$ContentPlaceHolder1${name}'})
+            option = select.find('option', selected=True) if select else None
+            if option is not None and option.get('value', '-1') != '-1':
+                location[field] = option['value']
+        return location
+
+    def resolve_subscriber(self, subscriber_code):
+        """یافتن منطقه، فیدرها و خاموشی‌های یک کد اشتراک"""
+        html_content = self.search_by_subscriber_code(subscriber_code)
+        if html_content is None:
+            return None
+        
+        outages = self.parse_outages(html_content)
+        location = self.extract_selected_location(html_content)
+        feeders = []
+        for outage in outages:
+            if outage.get('feeder') and outage['feeder'] not in feeders:
+                feeders.append(outage['feeder'])
+        
+        return {
+            'subscriber_code': subscriber_code,
+            'city_code': location.get('city_code'),
+            'area_code': location.get('area_code'),
+            'feeders': feeders,
+            'outages': outages,
+        }
+
+    @profiled
     def parse_outages(self, html_content):
         """تجزیه و تحلیل HTML و استخراج اطلاعات خاموشی‌ها"""
         if not html_content:
             return []
         
-        soup = BeautifulSoup(html_content, 'html.parser')
-        outages = []
-        
-        # جستجوی جدول خاموشی‌ها
+        # ردیف‌های جدول با حداقل 5 ستون با backend انتخاب شده استخراج می‌شوند
         try:
-            # پیدا کردن ردیف‌های داده
-            rows = soup.find_all('tr')
-            
-            for row in rows:
-                cells = row.find_all('td')
-                if len(cells) >= 5:  # حداقل 5 ستون انتظار داریم
-                    outage_info = {}
-                    
-                    # استخراج اطلاعات از هر سلول
-                    if len(cells) > 0 and cells[0].get_text(strip=True):
-                        outage_info['date'] = cells[0].get_text(strip=True)
-                    if len(cells) > 1 and cells[1].get_text(strip=True):
-                        outage_info['start_time'] = cells[1].get_text(strip=True)
-                    if len(cells) > 2 and cells[2].get_text(strip=True):
-                        outage_info['end_time'] = cells[2].get_text(strip=True)
-                    if len(cells) > 3 and cells[3].get_text(strip=True):
-                        outage_info['region'] = cells[3].get_text(strip=True)
-                    if len(cells) > 4 and cells[4].get_text(strip=True):
-                        outage_info['description'] = cells[4].get_text(strip=True)
-                    
-                    if outage_info:  # اگر اطلاعاتی پیدا شد
-                        outages.append(outage_info)
-            
-            return outages
+            return self.parser.parse(html_content)
             
         except Exception as e:
             logger.error(f"خطا در تجزیه HTML: {e}")
             return []
 
     def check_specific_outage(self, html_content, search_terms):
-        """بررسی وجود خاموشی خاص بر اساس کلمات کلیدی"""
+        """بررسی وجود خاموشی خاص بر اساس کلمات کلیدی
+
+        به جای جستجو در کل HTML (که ViewState و گزینه‌های فرم را هم شامل می‌شود)
+        فقط ردیف‌های جدول بررسی می‌شوند؛ شماره فیدر از ایندکس فیدرها خوانده می‌شود.
+        """
         if not html_content:
             return False
         
@@ -147,15 +338,38 @@ class PowerOutageChecker:
         if isinstance(search_terms, str):
             search_terms = [search_terms]
         
+        index = OutageIndex(self.parse_outages(html_content))
+        
         # بررسی وجود هر یک از کلمات کلیدی
         for term in search_terms:
-            if term in html_content:
+            if index.match_term(term):
                 logger.info(f"خاموشی '{term}' در لیست پیدا شد!")
                 return True
         
         logger.info("خاموشی مورد نظر پیدا نشد.")
         return False
 
+    def find_matching_outages(self, outages, search_terms):
+        """انتخاب خاموشی‌هایی که حداقل یکی از کلمات کلیدی را دارند"""
+        if isinstance(search_terms, str):
+            search_terms = [search_terms]
+        
+        matches = []
+        for outage in outages:
+            text = outage_text(outage).lower()
+            if any(term.lower() in text for term in search_terms):
+                matches.append(outage)
+        return matches
+
+    def outage_matches(self, outage, search_terms):
+        """آیا خاموشی با حداقل یکی از کلمات کلیدی (شماره فیدر یا بخشی از متن) منطبق است"""
+        text = outage_text(outage).lower()
+        for term in search_terms:
+            feeder = parse_feeder_term(term)
+            if outage.get('feeder') == feeder if feeder else term.lower() in text:
+                return True
+        return False
+
     def save_to_csv(self, outages, filename=None):
         """ذخیره اطلاعات خاموشی‌ها در فایل CSV"""
         if not outages:
@@ -167,12 +381,37 @@ class PowerOutageChecker:
             filename = f"power_outages_{timestamp}.csv"
         
         try:
-            df = pd.DataFrame(outages)
+            df = pd.DataFrame(outages, columns=CSV_FIELDS)
             df.to_csv(filename, index=False, encoding='utf-8-sig')
             logger.info(f"اطلاعات در فایل {filename} ذخیره شد")
         except Exception as e:
             logger.error(f"خطا در ذخیره فایل CSV: {e}")
 
+    def save_stream_to_csv(self, outages, filename=None):
+        """ذخیره تدریجی خاموشی‌ها در CSV بدون نگه‌داشتن کل لیست در حافظه
+
+        خطای فایل ثبت می‌شود؛ خطای منبع خاموشی‌ها (مثلاً قطع اتصال) بالا می‌آید.
+        """
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"power_outages_{timestamp}.csv"
+        
+        count = 0
+        try:
+            with open(filename, "w", encoding="utf-8-sig", newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for outage in outages:
+                    writer.writerow(outage)
+                    count += 1
+            logger.info(f"{count} خاموشی در فایل {filename} ذخیره شد")
+        except OSError as e:
+            # خطاهای requests هم از OSError مشتق می‌شوند ولی خطای منبع‌اند نه فایل
+            if isinstance(e, requests.RequestException):
+                raise
+            logger.error(f"خطا در ذخیره فایل CSV: {e}")
+        return count
+
     def save_raw_html(self, html_content, filename=None):
         """ذخیره HTML خام در فایل"""
         if filename is None:
@@ -186,43 +425,74 @@ class PowerOutageChecker:
         except Exception as e:
             logger.error(f"خطا در ذخیره فایل HTML: {e}")
 
-    def run_check(self, search_terms=None, save_csv=True, save_html=False):
-        """اجرای کامل فرآیند بررسی خاموشی"""
+    def archive_response(self, html_content, archive_dir, area=None):
+        """ذخیره پاسخ در بایگانی فشرده؛ پاسخ‌های تکراری دوباره نوشته نمی‌شوند"""
+        try:
+            digest = ResponseArchive(archive_dir).store(html_content, area=area)
+            logger.info(f"پاسخ در بایگانی {archive_dir} ثبت شد ({digest[:12]})")
+            return digest
+        except Exception as e:
+            logger.error(f"خطا در بایگانی پاسخ: {e}")
+            return None
+
+    def run_check(self, search_terms=None, save_csv=True, save_html=False, archive_dir=None):
+        """اجرای کامل فرآیند بررسی خاموشی (با archive_dir پاسخ به جای HTML خام بایگانی می‌شود)
+
+        خاموشی‌ها همزمان با دریافت پاسخ بررسی و در CSV نوشته می‌شوند؛ متن کامل
+        پاسخ فقط برای save_html یا archive_dir نگه داشته می‌شود. خروجی تعداد
+        خاموشی‌ها یا None در صورت خطا است.
+        """
         logger.info("شروع بررسی خاموشی‌ها...")
         
-        # جستجوی خاموشی‌ها
-        html_content = self.search_outages()
-        
-        if html_content:
-            # بررسی خاموشی خاص اگر مشخص شده
-            if search_terms:
-                found = self.check_specific_outage(html_content, search_terms)
-                if found:
-                    logger.info("خاموشی مورد نظر یافت شد!")
-                else:
-                    logger.info("خاموشی مورد نظر یافت نشد.")
-            
-            # ذخیره HTML خام اگر درخواست شده
-            if save_html:
-                self.save_raw_html(html_content)
-            
-            # تجزیه و ذخیره در CSV اگر درخواست شده
-            if save_csv:
-                outages = self.parse_outages(html_content)
-                if outages:
-                    self.save_to_csv(outages)
-                    return outages
-                else:
-                    logger.warning("هیچ خاموشی پردازش شده‌ای پیدا نشد")
-            
-            return html_content
-        else:
+        if isinstance(search_terms, str):
+            search_terms = [search_terms]
+        raw = [] if save_html or archive_dir else None
+        outages = self.stream_outages(raw=raw)
+        if outages is None:
             logger.error("دریافت اطلاعات ناموفق بود")
             return None
+        
+        found = []
+        
+        def checked(outages):
+            for outage in outages:
+                if search_terms and not found and self.outage_matches(outage, search_terms):
+                    found.append(outage)
+                yield outage
+        
+        try:
+            if save_csv:
+                count = self.save_stream_to_csv(checked(outages))
+            else:
+                count = sum(1 for _ in checked(outages))
+        except Exception as e:
+            logger.error(f"خطا در دریافت تدریجی خاموشی‌ها: {e}")
+            return None
+        
+        # بررسی خاموشی خاص اگر مشخص شده
+        if search_terms:
+            if found:
+                logger.info("خاموشی مورد نظر یافت شد!")
+            else:
+                logger.info("خاموشی مورد نظر یافت نشد.")
+        if not count:
+            logger.warning("هیچ خاموشی پردازش شده‌ای پیدا نشد")
+        
+        # ذخیره HTML خام اگر درخواست شده
+        if raw is not None:
+            html_content = ''.join(raw)
+            if save_html:
+                self.save_raw_html(html_content)
+            if archive_dir:
+                self.archive_response(html_content, archive_dir)
+        
+        return count
 
 
-# نحوه استفاده
-if __name__ == "__main__":
+def run_default_check():
+    """بررسی پیش‌فرض خاموشی ۵۳ (رفتار قبلی اجرای مستقیم اسکریپت)"""
+    from config import ARCHIVE_DIR
+    
     # ایجاد instance از کلاس
     checker = PowerOutageChecker()
     
@@ -233,15 +503,176 @@ if __name__ == "__main__":
     result = checker.run_check(
         search_terms=search_terms,
         save_csv=True,
-        save_html=True
+        archive_dir=ARCHIVE_DIR
     )
     
     # نمایش نتیجه
-    if result:
+    if result is not None:
         print("بررسی با موفقیت انجام شد!")
+        return 0
     else:
         print("خطا در بررسی خاموشی‌ها")
+        return 1
     
     # مثال استفاده مستقل از توابع
     # outages_list = checker.parse_outages(result)
-    # checker.save_to_csv(outages_list, "my_outages.csv")
\ No newline at end of file
+    # checker.save_to_csv(outages_list, "my_outages.csv")
+
+
+def load_jobs(path):
+    """خواندن فایل کارها (JSONL): هر خط شامل area یا city_code/area_code، بازه تاریخ و terms"""
+    from config import AREAS
+    
+    jobs = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"خط {line_no}: JSON نامعتبر ({e})")
+            if not isinstance(job, dict):
+                raise ValueError(f"خط {line_no}: هر کار باید یک شیء JSON باشد")
+            
+            # امکان استفاده از نام منطقه به جای کدها
+            if 'area' in job and job['area'] in AREAS:
+                job.setdefault('city_code', AREAS[job['area']]['city_code'])
+                job.setdefault('area_code', AREAS[job['area']]['area_code'])
+            if 'city_code' not in job or 'area_code' not in job:
+                raise ValueError(f"خط {line_no}: city_code و area_code (یا area معتبر) لازم است")
+            
+            terms = job.get('terms') or []
+            job['terms'] = [terms] if isinstance(terms, str) else terms
+            job.setdefault('id', line_no)
+            jobs.append(job)
+    return jobs
+
+
+def run_job(checker, job):
+    """اجرای یک کار و ساخت رکورد نتیجه"""
+    result = {
+        'id': job['id'],
+        'city_code': job['city_code'],
+        'area_code': job['area_code'],
+        'date_from': job.get('date_from', ''),
+        'date_to': job.get('date_to', ''),
+        'terms': job['terms'],
+    }
+    outages = checker.stream_outages(
+        city_code=job['city_code'],
+        area_code=job['area_code'],
+        date_from=job.get('date_from', ''),
+        date_to=job.get('date_to', '')
+    )
+    if outages is None:
+        result.update(ok=False, error='دریافت اطلاعات ناموفق بود')
+        return result
+    
+    # فقط خاموشی‌های منطبق نگه داشته می‌شوند، نه کل پاسخ؛ تطبیق مثل run_check
+    # (شماره فیدر دقیق، بقیه کلمات به صورت بخشی از متن)
+    count = 0
+    matches = []
+    for outage in outages:
+        count += 1
+        if not job['terms'] or checker.outage_matches(outage, job['terms']):
+            matches.append(outage)
+    result.update(
+        ok=True,
+        outage_count=count,
+        found=bool(matches),
+        matches=matches
+    )
+    return result
+
+
+def run_batch(jobs_path, output=None, workers=4):
+    """اجرای همزمان کارهای فایل jobs و نوشتن نتایج JSONL؛ کد خروج غیر صفر در صورت خطای جزئی"""
+    try:
+        jobs = load_jobs(jobs_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"خطا در خواندن فایل کارها: {e}")
+        return 2
+    
+    from session_pool import build_session_pool
+    
+    # هر کار یک session مستقل (cookie و tokenهای ViewState) از مخزن برمی‌دارد؛
+    # sessionی که پیاپی خطا می‌دهد با session تازه جایگزین می‌شود
+    workers = max(1, min(workers, len(jobs) or 1))
+    pool = build_session_pool(workers)
+    
+    def execute(job):
+        checker = pool.acquire()
+        result = None
+        try:
+            result = run_job(checker, job)
+            return result
+        except Exception as e:
+            logger.error(f"خطا در اجرای کار {job['id']}: {e}")
+            return {'id': job['id'], 'ok': False, 'error': str(e)}
+        finally:
+            pool.release(checker, failed=not (result and result['ok']))
+    
+    out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(execute, job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                if not result['ok']:
+                    failed += 1
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+    finally:
+        pool.close()
+        if output:
+            out.close()
+    
+    logger.info(f"{len(jobs) - failed} از {len(jobs)} کار با موفقیت انجام شد")
+    return 1 if failed else 0
+
+
+def run_replay(archive_dir, at, area=None, raw=False):
+    """چاپ پاسخ بایگانی شده تا زمان at به صورت HTML یا JSONL خاموشی‌ها"""
+    html_content = ResponseArchive(archive_dir).replay(at, area)
+    if html_content is None:
+        logger.error(f"پاسخی تا زمان {at} در بایگانی پیدا نشد")
+        return 1
+    
+    if raw:
+        print(html_content)
+    else:
+        for outage in PowerOutageChecker().parse_outages(html_content):
+            print(json.dumps(outage, ensure_ascii=False))
+    return 0
+
+
+def main(argv=None):
+    """نقطه ورود خط فرمان"""
+    parser = argparse.ArgumentParser(description='بررسی خاموشی‌های برق مازندران')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    batch_parser = subparsers.add_parser('batch', help='اجرای دسته‌ای کارها از فایل JSONL')
+    batch_parser.add_argument('jobs', help='فایل کارها (هر خط یک شیء JSON)')
+    batch_parser.add_argument('-o', '--output', help='فایل خروجی JSONL (پیش‌فرض: stdout)')
+    batch_parser.add_argument('-j', '--workers', type=int, default=4, help='تعداد کارهای همزمان')
+    
+    replay_parser = subparsers.add_parser('replay', help='بازخوانی پاسخ بایگانی شده')
+    replay_parser.add_argument('time', type=datetime.fromisoformat, help='زمان به صورت ISO، مثلاً 2025-08-07T14:40:00')
+    replay_parser.add_argument('--area', help='فقط پاسخ‌های این منطقه')
+    replay_parser.add_argument('--archive', default='archive', help='مسیر بایگانی')
+    replay_parser.add_argument('--raw', action='store_true', help='چاپ HTML به جای خاموشی‌ها')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'batch':
+        return run_batch(args.jobs, args.output, args.workers)
+    if args.command == 'replay':
+        return run_replay(args.archive, args.time, args.area, args.raw)
+    return run_default_check()
+
+
+# نحوه استفاده
+if __name__ == "__main__":
+    sys.exit(main())
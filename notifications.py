@@ -0,0 +1,123 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from outage_index import parse_feeder_term, normalize_persian, outage_text
+
+logger = logging.getLogger(__name__)
+
+
+def outage_identity(outage):
+    """خاموشی‌های یک فیدر (یا یک متن بدون فیدر) در یک روز؛ مبنای جفت کردن ردیف‌های دو snapshot"""
+    return (outage.get('feeder') or normalize_persian(outage.get('description', '')), outage.get('date'))
+
+
+def outage_state_key(area_name, outage):
+    """کلید یک وضعیت مشخص از یک خاموشی برای زنجیره کردن تغییرات پیاپی"""
+    return (area_name,) + outage_identity(outage) + (outage.get('start_time'),)
+
+
+def diff_outages(previous, current):
+    """تغییرات بین دو لیست خاموشی به صورت (قبل، بعد)
+
+    قبل None یعنی خاموشی جدید و بعد None یعنی خاموشی از جدول حذف شده است.
+    ردیف‌های تغییر کرده یک فیدر در یک روز به ترتیب ساعت شروع جفت می‌شوند.
+    """
+    def group(outages):
+        groups = {}
+        for outage in outages:
+            groups.setdefault(outage_identity(outage), []).append(outage)
+        return groups
+
+    before_groups, after_groups = group(previous), group(current)
+    changes = []
+    for identity in list(before_groups) + [key for key in after_groups if key not in before_groups]:
+        before = before_groups.get(identity, [])
+        after = after_groups.get(identity, [])
+        removed = sorted((outage for outage in before if outage not in after), key=lambda outage: outage.get('start_time', ''))
+        added = sorted((outage for outage in after if outage not in before), key=lambda outage: outage.get('start_time', ''))
+        for position in range(max(len(removed), len(added))):
+            changes.append((
+                removed[position] if position < len(removed) else None,
+                added[position] if position < len(added) else None,
+            ))
+    return changes
+
+
+def subscription_matches(term, outage):
+    """آیا خاموشی با اشتراک (شماره فیدر، کلمه کلیدی یا '' برای کل منطقه) منطبق است"""
+    if outage is None:
+        return False
+    if not term:
+        return True
+    feeder = parse_feeder_term(term)
+    if feeder:
+        return outage.get('feeder') == feeder
+    return normalize_persian(term) in normalize_persian(outage_text(outage))
+
+
+class DigestBatcher:
+    """جمع کردن تغییرات هر چت در یک پنجره زمانی و ارسال یک پیام خلاصه
+
+    اولین تغییر هر چت پنجره window ثانیه‌ای را باز می‌کند. تغییرهای پیاپی یک
+    خاموشی (مثلاً دو بار تغییر ساعت پایان) به یک مورد «از وضعیت اول به وضعیت
+    آخر» تبدیل می‌شوند و موردی که به وضعیت اول برگشته (یا جدیدی که حذف شده)
+    اصلاً فرستاده نمی‌شود.
+    """
+
+    def __init__(self, window=120):
+        self.window = window
+        self.pending = {}       # chat_id -> (زمان ارسال، OrderedDict کلید وضعیت -> [منطقه، قبل، بعد])
+        self.events = 0
+        self.collapsed = 0
+        self.digests = 0
+        self._lock = threading.Lock()
+
+    def add(self, chat_id, area_name, before, after, now):
+        """افزودن یک تغییر (قبل، بعد) برای یک چت"""
+        with self._lock:
+            self.events += 1
+            if chat_id not in self.pending:
+                self.pending[chat_id] = (now + self.window, OrderedDict())
+            entries = self.pending[chat_id][1]
+
+            lookup = outage_state_key(area_name, before if before is not None else after)
+            entry = entries.get(lookup)
+            if entry is not None and entry[2] == before:
+                # ادامه زنجیره: وضعیت اول حفظ و وضعیت آخر جایگزین می‌شود
+                self.collapsed += 1
+                del entries[lookup]
+                entry[2] = after
+                if entry[1] is None and after is None:
+                    # خاموشی جدیدی که پیش از ارسال خلاصه حذف شد
+                    return
+            else:
+                entry = [area_name, before, after]
+            entries[outage_state_key(area_name, after if after is not None else entry[1])] = entry
+
+    def due(self, now):
+        """خارج کردن چت‌هایی که پنجره‌شان بسته شده؛ خروجی لیست (chat_id، لیست (منطقه، قبل، بعد))"""
+        ready = []
+        with self._lock:
+            for chat_id, (send_at, entries) in list(self.pending.items()):
+                if send_at > now:
+                    continue
+                del self.pending[chat_id]
+                events = [tuple(entry) for entry in entries.values() if entry[1] != entry[2]]
+                if events:
+                    self.digests += 1
+                    ready.append((chat_id, events))
+        return ready
+
+    def discard(self, chat_id):
+        with self._lock:
+            self.pending.pop(chat_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_chats': len(self.pending),
+                'events': self.events,
+                'collapsed': self.collapsed,
+                'digests': self.digests,
+            }
@@ -0,0 +1,321 @@
+import re
+import math
+import time
+from bisect import bisect_left
+
+from jalali import outage_window
+
+# ترتیب ستون‌های جدول خاموشی‌ها در سایت
+OUTAGE_FIELDS = ['date', 'start_time', 'end_time', 'region', 'description']
+
+# تبدیل ارقام فارسی و عربی به لاتین
+DIGITS_TRANSLATION = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '0123456789' * 2)
+
+# شماره فیدر در ابتدای توضیحات: «30- جاده کیاکلا» یا «32-از میدان فاضل»
+FEEDER_PATTERN = re.compile(r'^\s*(\d+)\s*[-–ـ]\s*')
+
+# جداکننده‌های بخش‌های آدرس در توضیحات
+LOCALITY_SEPARATORS = re.compile(r'[،,؛;()\[\]]|(?:^|\s+)(?:و|تا|از)\s+')
+
+# پارامترهای BM25 برای رتبه‌بندی نتایج جستجو
+BM25_K1 = 1.2
+BM25_B = 0.75
+# وزن کلمه‌ای از توضیحات که فقط با ابتدای کلمه پرسش منطبق است («شهاب» -> «شهابیه»)
+PREFIX_MATCH_WEIGHT = 0.5
+# امتیاز اضافه خاموشی با شماره فیدر پرسیده شده و خاموشی در حال اجرا
+FEEDER_BOOST = 5.0
+ACTIVE_BOOST = 3.0
+
+
+def split_description(description):
+    """جدا کردن شماره فیدر و فهرست خیابان‌ها/محله‌ها از توضیحات خاموشی"""
+    text = description.translate(DIGITS_TRANSLATION)
+    feeder = None
+    match = FEEDER_PATTERN.match(text)
+    if match:
+        feeder = match.group(1).lstrip('0') or '0'
+        text = text[match.end():]
+    
+    localities = []
+    for part in LOCALITY_SEPARATORS.split(text):
+        part = ' '.join(part.split())
+        if len(part) > 1 and not part.isdigit() and part not in localities:
+            localities.append(part)
+    return feeder, localities
+
+
+def parse_feeder_term(term):
+    """اگر کلمه کلیدی شماره فیدر باشد («53» یا «۵۳-») شماره را برمی‌گرداند"""
+    match = re.fullmatch(r'\s*(\d+)\s*[-–ـ]?\s*', term.translate(DIGITS_TRANSLATION))
+    if match:
+        return match.group(1).lstrip('0') or '0'
+    return None
+
+
+# یکسان‌سازی نویسه‌های فارسی/عربی برای جستجوی تقریبی
+PERSIAN_NORMALIZATION = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ؤ': 'و',
+    'ء': None, 'ـ': None, '\u200c': None, '\u200f': None, '\u200e': None,
+})
+DIACRITICS = re.compile(r'[\u064b-\u065f\u0670]')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize_persian(text):
+    """یکسان‌سازی متن فارسی: ی/ک عربی، همزه، اعراب، نیم‌فاصله و ارقام"""
+    text = DIACRITICS.sub('', text.translate(DIGITS_TRANSLATION))
+    return text.translate(PERSIAN_NORMALIZATION).lower()
+
+
+def tokenize(text):
+    """کلمات یکسان‌سازی شده یک متن"""
+    return WORD_PATTERN.findall(normalize_persian(text))
+
+
+def trigrams(token):
+    """سه‌حرفی‌های یک کلمه با علامت ابتدا و انتها"""
+    padded = f'#{token}#'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """فاصله ویرایشی Levenshtein؛ اگر از limit بیشتر شود limit + 1 برمی‌گرداند"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def outage_text(outage):
+    """متن قابل جستجوی یک خاموشی (فقط ستون‌های اصلی جدول)"""
+    return ' '.join(outage.get(field, '') for field in OUTAGE_FIELDS)
+
+
+class OutageIndex:
+    """ایندکس‌های جستجوی یک snapshot از خاموشی‌های یک منطقه
+
+    یک بار به ازای هر snapshot ساخته می‌شود تا پرسش‌هایی مثل «فیدر ۵۳ قطع
+    است؟» به جای پیمایش همه ردیف‌ها با یک جستجوی دیکشنری پاسخ داده شوند.
+    آمار کلمات برای رتبه‌بندی BM25 (تکرار کلمه در هر ردیف، طول ردیف‌ها و
+    idf) و بازه زمانی هر خاموشی هم همین‌جا محاسبه می‌شوند.
+    """
+
+    def __init__(self, outages):
+        self.outages = outages
+        self.feeder_rows = {}       # شماره فیدر -> شماره ردیف‌ها
+        self.texts = []             # شماره ردیف -> متن قابل جستجو با حروف کوچک
+        self.token_postings = {}    # کلمه یکسان‌سازی شده -> شماره ردیف‌ها
+        self.term_frequencies = {}  # کلمه یکسان‌سازی شده -> {شماره ردیف: تعداد}
+        self.trigram_tokens = {}    # سه‌حرفی -> کلمات دارای آن
+        self.lengths = []           # شماره ردیف -> تعداد کلمات توضیحات
+        self.windows = []           # شماره ردیف -> (شروع، پایان) به ثانیه؛ پایان نامشخص inf
+        
+        for position, outage in enumerate(outages):
+            feeder = outage.get('feeder')
+            if feeder:
+                self.feeder_rows.setdefault(feeder, []).append(position)
+            self.texts.append(outage_text(outage).lower())
+            
+            # کلمات و ترکیب هر دو کلمه پشت سر هم («شهاب نیا» -> «شهابنیا»)
+            words = tokenize(outage.get('description', ''))
+            for token in words + [a + b for a, b in zip(words, words[1:])]:
+                self.token_postings.setdefault(token, set()).add(position)
+                counts = self.term_frequencies.setdefault(token, {})
+                counts[position] = counts.get(position, 0) + 1
+            self.lengths.append(len(words))
+            
+            start_at, end_at = outage_window(outage)
+            self.windows.append(
+                None if start_at is None else (start_at.timestamp(), end_at.timestamp() if end_at else math.inf)
+            )
+        
+        for token in self.token_postings:
+            for gram in trigrams(token):
+                self.trigram_tokens.setdefault(gram, []).append(token)
+        
+        # کلمات مرتب برای جستجوی پیشوندی با bisect
+        self.sorted_tokens = sorted(self.token_postings)
+        
+        count = len(outages)
+        self.average_length = (sum(self.lengths) / count if count else 0) or 1
+        self.idf = {
+            token: math.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            for token, positions in self.token_postings.items()
+        }
+
+    def active_outages(self, at):
+        """خاموشی‌هایی که در لحظه at (ثانیه epoch) در جریان‌اند؛ پایان نامشخص یعنی هنوز ادامه دارد"""
+        return [
+            self.outages[position] for position, window in enumerate(self.windows)
+            if window is not None and window[0] <= at < window[1]
+        ]
+
+    def feeder_outages(self, feeder):
+        """خاموشی‌های ثبت شده برای یک شماره فیدر"""
+        feeder = parse_feeder_term(str(feeder))
+        return [self.outages[position] for position in self.feeder_rows.get(feeder, ())] if feeder else []
+
+    def match_positions(self, term):
+        """شماره ردیف‌های منطبق با یک کلمه کلیدی (شماره فیدر یا بخشی از متن)"""
+        feeder = parse_feeder_term(term)
+        if feeder:
+            return list(self.feeder_rows.get(feeder, ()))
+        
+        term = term.lower()
+        return [position for position, text in enumerate(self.texts) if term in text]
+
+    def match_term(self, term):
+        """خاموشی‌های منطبق با یک کلمه کلیدی (شماره فیدر یا بخشی از متن)"""
+        return [self.outages[position] for position in self.match_positions(term)]
+
+    def matched_positions(self, search_terms):
+        """شماره ردیف‌هایی که با حداقل یکی از کلمات کلیدی منطبق‌اند"""
+        matched = set()
+        for term in search_terms:
+            matched.update(self.match_positions(term))
+        return matched
+
+    def search(self, search_terms):
+        """خاموشی‌هایی که با حداقل یکی از کلمات کلیدی منطبق‌اند، به ترتیب جدول"""
+        return [self.outages[position] for position in sorted(self.matched_positions(search_terms))]
+
+    def tokens_with_prefix(self, prefix):
+        """کلمات ایندکس که با prefix شروع می‌شوند، به ترتیب الفبا"""
+        for position in range(bisect_left(self.sorted_tokens, prefix), len(self.sorted_tokens)):
+            token = self.sorted_tokens[position]
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def token_frequencies(self, token):
+        """(شماره ردیف، تعداد تکرار) ردیف‌های دارای کلمه"""
+        return self.term_frequencies.get(token, {}).items()
+
+    def query_weights(self, search_terms):
+        """وزن کلمات ایندکس برای کلمات متنی پرسش
+
+        کلمه دقیق (و ترکیب دو کلمه پشت سر هم پرسش) وزن 1 و کلمات ایندکس که
+        با یک کلمه پرسش شروع می‌شوند وزن PREFIX_MATCH_WEIGHT می‌گیرند.
+        """
+        words = tokenize(' '.join(term for term in search_terms if not parse_feeder_term(term)))
+        weights = {}
+        for word in words + [a + b for a, b in zip(words, words[1:])]:
+            if len(word) > 1:
+                for token in self.tokens_with_prefix(word):
+                    weights[token] = max(weights.get(token, 0), PREFIX_MATCH_WEIGHT)
+            if word in self.token_postings:
+                weights[word] = 1.0
+        return weights
+
+    def ranked_search(self, search_terms, now=None, limit=None):
+        """خاموشی‌های منطبق با کلمات کلیدی به ترتیب امتیاز؛ امتیازهای برابر به ترتیب جدول
+
+        امتیاز هر ردیف BM25 کلمات پرسش به اضافه FEEDER_BOOST برای فیدر پرسیده
+        شده و ACTIVE_BOOST برای خاموشی در حال اجرا در لحظه now است.
+        """
+        now = now if now is not None else time.time()
+        scores = dict.fromkeys(self.matched_positions(search_terms), 0.0)
+        
+        # امتیازدهی کلمه به کلمه روی فهرست ردیف‌های هر کلمه
+        for token, weight in self.query_weights(search_terms).items():
+            idf = self.idf[token]
+            for position, frequency in self.token_frequencies(token):
+                if position in scores:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / self.average_length)
+                    scores[position] += weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        
+        for term in search_terms:
+            feeder = parse_feeder_term(term)
+            for position in self.feeder_rows.get(feeder, ()) if feeder else ():
+                if position in scores:
+                    scores[position] += FEEDER_BOOST
+        for position in scores:
+            window = self.windows[position]
+            if window is not None and window[0] <= now < window[1]:
+                scores[position] += ACTIVE_BOOST
+        
+        ranked = sorted(scores, key=lambda position: (-scores[position], position))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.outages[position] for position in ranked]
+
+    def prefix_postings(self, prefix):
+        """شماره ردیف‌های همه کلماتی که با prefix شروع می‌شوند"""
+        positions = set()
+        for token in self.tokens_with_prefix(prefix):
+            positions |= self.token_postings[token]
+        return positions
+
+    def prefix_search(self, query, limit=None):
+        """جستجوی هنگام تایپ: همه کلمات باید در توضیحات باشند و کلمه آخر می‌تواند ناقص باشد"""
+        words = tokenize(query)
+        if not words:
+            return self.outages[:limit]
+        
+        positions = self.prefix_postings(words[-1])
+        for word in words[:-1]:
+            if not positions:
+                break
+            positions = positions & self.token_postings.get(word, set())
+        return [self.outages[position] for position in sorted(positions)[:limit]]
+
+    def similar_tokens(self, word):
+        """کلمات ایندکس با فاصله ویرایشی کم از word به صورت (کلمه، شباهت)"""
+        if word in self.token_postings:
+            return [(word, 1.0)]
+        
+        limit = 1 if len(word) <= 5 else 2
+        word_grams = trigrams(word)
+        shared = {}
+        for gram in word_grams:
+            for token in self.trigram_tokens.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        
+        # فقط کلماتی که به اندازه کافی سه‌حرفی مشترک دارند بررسی دقیق می‌شوند
+        min_shared = max(1, len(word_grams) - 3 * limit)
+        results = []
+        for token, count in shared.items():
+            if count < min_shared:
+                continue
+            distance = edit_distance(word, token, limit)
+            if distance <= limit:
+                results.append((token, 1.0 - distance / max(len(word), len(token))))
+        return results
+
+    def fuzzy_search(self, query, limit=None):
+        """جستجوی تقریبی خیابان/محله؛ خروجی (خاموشی، امتیاز) به ترتیب امتیاز"""
+        words = tokenize(query)
+        if not words:
+            return []
+        
+        # املای بدون فاصله («شهابنیا») هم به عنوان یک کلمه بررسی می‌شود
+        groups = [[word] for word in words]
+        if len(words) > 1:
+            groups.append([''.join(words)])
+        
+        scores = {}
+        for group in groups:
+            best = {}
+            for token, similarity in self.similar_tokens(group[0]):
+                for position in self.token_postings[token]:
+                    if similarity > best.get(position, 0):
+                        best[position] = similarity
+            for position, similarity in best.items():
+                scores[position] = scores.get(position, 0) + similarity
+        
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(self.outages[position], score) for position, score in ranked]
@@ -0,0 +1,273 @@
+import re
+import sys
+import glob
+import time
+import html
+import logging
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+from outage_index import OUTAGE_FIELDS, split_description
+
+try:
+    import lxml.html
+except ImportError:  # lxml اختیاری است؛ در نبود آن backendهای stdlib انتخاب می‌شوند
+    lxml = None
+
+logger = logging.getLogger(__name__)
+
+
+def build_outage_record(cell_texts):
+    """ساخت رکورد خاموشی از متن سلول‌های یک ردیف جدول"""
+    outage_info = {}
+    for field, text in zip(OUTAGE_FIELDS, cell_texts):
+        if text:
+            outage_info[field] = text
+    
+    # فیلدهای ساخت‌یافته برای جستجوی سریع
+    if 'description' in outage_info:
+        feeder, localities = split_description(outage_info['description'])
+        if feeder:
+            outage_info['feeder'] = feeder
+        outage_info['localities'] = localities
+    return outage_info
+
+
+class OutageStreamParser(HTMLParser):
+    """تجزیه‌گر افزایشی که هر ردیف خاموشی را به محض بسته شدن تگ tr تحویل می‌دهد
+
+    خروجی آن با parse_outages یکسان است: متن هر سلول مانند get_text(strip=True)
+    از به‌هم‌چسباندن گره‌های متنی strip شده ساخته می‌شود.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._rows = []       # ردیف‌های باز (برای جدول‌های تو در تو)
+        self._cells = []      # سلول‌های باز
+        self._text = []       # متن در حال جمع‌آوری بین دو تگ
+        self._ready = []      # رکوردهای کامل شده که هنوز تحویل نشده‌اند
+
+    def _flush_text(self):
+        """افزودن گره متنی جاری به همه سلول‌های باز"""
+        if not self._text:
+            return
+        text = ''.join(self._text).strip()
+        self._text = []
+        if text:
+            for cell in self._cells:
+                cell.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag == 'tr':
+            self._rows.append([])
+        elif tag == 'td' and self._rows:
+            cell = []
+            for row in self._rows:
+                row.append(cell)
+            self._cells.append(cell)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if tag == 'td' and self._cells:
+            self._cells.pop()
+        elif tag == 'tr' and self._rows:
+            row = self._rows.pop()
+            row_cells = {id(cell) for cell in row}
+            self._cells = [cell for cell in self._cells if id(cell) not in row_cells]
+            if len(row) >= 5:  # حداقل 5 ستون انتظار داریم
+                outage_info = build_outage_record(''.join(cell) for cell in row)
+                if outage_info:
+                    self._ready.append(outage_info)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
+    def drain(self):
+        """تحویل و پاک کردن رکوردهای کامل شده تا این لحظه"""
+        ready, self._ready = self._ready, []
+        return ready
+
+
+class BeautifulSoupBackend:
+    """تجزیه کامل سند با BeautifulSoup (مرجع رفتار بقیه backendها)"""
+
+    auto_select = True
+
+    def __init__(self, name, features):
+        self.name = name
+        self.features = features
+
+    def available(self):
+        return self.features != 'lxml' or lxml is not None
+
+    def parse(self, html_content):
+        soup = BeautifulSoup(html_content, self.features)
+        outages = []
+        for row in soup.find_all('tr'):
+            cells = row.find_all('td')
+            if len(cells) >= 5:  # حداقل 5 ستون انتظار داریم
+                outage_info = build_outage_record(cell.get_text(strip=True) for cell in cells)
+                if outage_info:
+                    outages.append(outage_info)
+        return outages
+
+
+class LxmlBackend:
+    """تجزیه مستقیم با lxml بدون ساخت درخت BeautifulSoup"""
+
+    name = 'lxml'
+    auto_select = True
+
+    def available(self):
+        return lxml is not None
+
+    def parse(self, html_content):
+        document = lxml.html.fromstring(html_content)
+        outages = []
+        for row in document.iter('tr'):
+            cells = list(row.iter('td'))
+            if len(cells) >= 5:
+                outage_info = build_outage_record(
+                    ''.join(text.strip() for text in cell.itertext()) for cell in cells
+                )
+                if outage_info:
+                    outages.append(outage_info)
+        return outages
+
+
+class StreamBackend:
+    """تجزیه با OutageStreamParser (فقط کتابخانه استاندارد)"""
+
+    name = 'stream'
+    auto_select = True
+
+    def available(self):
+        return True
+
+    def parse(self, html_content):
+        parser = OutageStreamParser()
+        parser.feed(html_content)
+        parser.close()
+        return parser.drain()
+
+
+class RegexBackend:
+    """مسیر سریع با regex برای جدول‌های ساده سایت
+
+    اگر ردیفی جدول یا ردیف تو در تو داشته باشد، regex نمی‌تواند ساختار را
+    درست تشخیص دهد و کل سند به StreamBackend سپرده می‌شود. چون HTML نامعمول
+    را تشخیص نمی‌دهد فقط با نام صریح (PARSER_BACKEND=regex) انتخاب می‌شود.
+    """
+
+    name = 'regex'
+    auto_select = False
+    ROW_PATTERN = re.compile(r'<tr\b[^>]*>(.*?)</tr\s*>', re.S | re.I)
+    CELL_PATTERN = re.compile(r'<td\b[^>]*>(.*?)</td\s*>', re.S | re.I)
+    MARKUP_PATTERN = re.compile(r'<!--.*?-->|<[^>]*>', re.S)
+    NESTED_PATTERN = re.compile(r'<(?:tr|table)\b', re.I)
+
+    def __init__(self):
+        self.fallback = StreamBackend()
+
+    def available(self):
+        return True
+
+    def cell_text(self, cell):
+        return ''.join(html.unescape(text).strip() for text in self.MARKUP_PATTERN.split(cell))
+
+    def parse(self, html_content):
+        outages = []
+        for row in self.ROW_PATTERN.finditer(html_content):
+            body = row.group(1)
+            if self.NESTED_PATTERN.search(body):
+                return self.fallback.parse(html_content)
+            cells = self.CELL_PATTERN.findall(body)
+            if len(cells) >= 5:
+                outage_info = build_outage_record(self.cell_text(cell) for cell in cells)
+                if outage_info:
+                    outages.append(outage_info)
+        return outages
+
+
+# همه backendها به ترتیب ترجیح (سریع‌ترین تجزیه‌گر واقعی اول)؛ html.parser مرجع مقایسه است
+BACKENDS = [
+    LxmlBackend(),
+    StreamBackend(),
+    RegexBackend(),
+    BeautifulSoupBackend('bs4-lxml', 'lxml'),
+    BeautifulSoupBackend('html.parser', 'html.parser'),
+]
+REFERENCE_BACKEND = 'html.parser'
+
+
+def get_backend(name):
+    """backend با نام مشخص یا ValueError اگر وجود ندارد یا نصب نیست"""
+    for backend in BACKENDS:
+        if backend.name == name:
+            if not backend.available():
+                raise ValueError(f"backend {name} نصب نیست")
+            return backend
+    raise ValueError(f"backend ناشناخته: {name}")
+
+
+def select_backend(name=None):
+    """backend درخواستی یا اولین backend نصب شده به ترتیب ترجیح"""
+    if name:
+        return get_backend(name)
+    return next(backend for backend in BACKENDS if backend.auto_select and backend.available())
+
+
+def verify_backends(paths):
+    """مقایسه خروجی همه backendهای نصب شده با backend مرجع روی فایل‌های نمونه
+
+    خروجی: دیکشنری نام backend -> (مجموع زمان به ثانیه، لیست فایل‌های ناهمخوان)
+    """
+    reference = get_backend(REFERENCE_BACKEND)
+    contents = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            html_content = f.read()
+        contents.append((path, html_content, reference.parse(html_content)))
+
+    results = {}
+    for backend in BACKENDS:
+        if not backend.available():
+            continue
+        elapsed = 0.0
+        mismatches = []
+        for path, html_content, expected in contents:
+            started = time.perf_counter()
+            outages = backend.parse(html_content)
+            elapsed += time.perf_counter() - started
+            if outages != expected:
+                mismatches.append(path)
+        results[backend.name] = (elapsed, mismatches)
+    return results
+
+
+def main(argv=None):
+    """مقایسه backendها روی فایل‌های نمونه: python parsers.py [files...]"""
+    paths = (argv if argv is not None else sys.argv[1:]) or sorted(glob.glob('raw_response_*.html'))
+    if not paths:
+        print("فایل نمونه‌ای پیدا نشد")
+        return 2
+
+    results = verify_backends(paths)
+    for name, (elapsed, mismatches) in sorted(results.items(), key=lambda item: item[1][0]):
+        status = "یکسان" if not mismatches else f"ناهمخوان: {', '.join(mismatches)}"
+        print(f"{name:12} {elapsed * 1000 / len(paths):8.2f} ms/file  {status}")
+    print(f"backend انتخابی: {select_backend().name}")
+    return 1 if any(mismatches for _, mismatches in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
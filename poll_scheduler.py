@@ -0,0 +1,181 @@
+import math
+import logging
+import threading
+from datetime import datetime
+
+from analytics import UNPLANNED_REGION
+from jalali import IRAN_TZ
+
+logger = logging.getLogger(__name__)
+
+# برآورد اولیه نرخ تغییر منطقه‌ای که هنوز مشاهده‌ای ندارد (تغییر در ساعت)
+PRIOR_RATE = 0.5
+# وزن برآورد اولیه و نرخ کلی منطقه در برابر مشاهدات هر ساعت از روز (ساعت مشاهده)
+PRIOR_HOURS = 2.0
+HOUR_PRIOR_HOURS = 1.0
+
+# ضریب نرخ وقتی snapshot فعلی خاموشی بی‌برنامه دارد
+UNPLANNED_BOOST = 2.0
+
+
+class AreaChangeStats:
+    """شمارش کاهنده تغییرات و مدت مشاهده یک منطقه، کلی و برای هر ساعت از روز"""
+
+    def __init__(self):
+        self.changes = 0.0
+        self.exposure = 0.0                 # ساعت
+        self.hour_changes = [0.0] * 24
+        self.hour_exposure = [0.0] * 24
+        self.unplanned = False
+
+    def decay(self, factor):
+        self.changes *= factor
+        self.exposure *= factor
+        self.hour_changes = [value * factor for value in self.hour_changes]
+        self.hour_exposure = [value * factor for value in self.hour_exposure]
+
+
+class AdaptivePollScheduler:
+    """زمان‌بندی دریافت هر منطقه بر اساس نرخ تغییر مشاهده شده در snapshotها
+
+    نرخ تغییر هر منطقه (و هر ساعت از روز به وقت ایران) از مقایسه digest
+    snapshotهای پیاپی با میانگین کاهنده (نیمه‌عمر half_life_hours) برآورد
+    می‌شود. بودجه ثابت budget_per_hour درخواست در ساعت طوری بین مناطق تقسیم
+    می‌شود که مجموع تأخیر تشخیص تغییرات کمینه شود: بسامد دریافت هر منطقه
+    متناسب با جذر نرخ تغییر آن است. هیچ منطقه‌ای کمتر از هر max_staleness
+    ثانیه و بیشتر از هر min_interval ثانیه دریافت نمی‌شود.
+    """
+
+    def __init__(self, areas, budget_per_hour=45, min_interval=60, max_staleness=1800, half_life_hours=72):
+        self.areas = list(areas)
+        self.budget_per_hour = budget_per_hour
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+        self.half_life_hours = half_life_hours
+        self.stats = {area_name: AreaChangeStats() for area_name in self.areas}
+        self._lock = threading.Lock()
+        self._warned_budget = False
+
+    def observe(self, area_name, snapshot, previous=None):
+        """ثبت snapshot جدید یک منطقه در مقایسه با snapshot قبلی آن"""
+        with self._lock:
+            stats = self.stats.setdefault(area_name, AreaChangeStats())
+            stats.unplanned = any(
+                ' '.join(outage.get('region', '').split()) == UNPLANNED_REGION
+                for outage in snapshot['outages']
+            )
+            if previous is None or snapshot['fetched_at'] <= previous['fetched_at']:
+                return
+
+            # فاصله‌های طولانی (مثلاً پس از توقف) فقط تا max_staleness شمرده می‌شوند تا نرخ کم برآورد نشود
+            elapsed = min(snapshot['fetched_at'] - previous['fetched_at'], self.max_staleness) / 3600
+            stats.decay(0.5 ** (elapsed / self.half_life_hours))
+            changed = 1.0 if snapshot['digest'] != previous['digest'] else 0.0
+            hour = datetime.fromtimestamp(snapshot['fetched_at'], IRAN_TZ).hour
+            stats.changes += changed
+            stats.exposure += elapsed
+            stats.hour_changes[hour] += changed
+            stats.hour_exposure[hour] += elapsed
+
+    def change_rate(self, area_name, now):
+        """برآورد تغییر در ساعت منطقه برای ساعت جاری روز"""
+        stats = self.stats.get(area_name) or AreaChangeStats()
+        with self._lock:
+            overall = (stats.changes + PRIOR_RATE * PRIOR_HOURS) / (stats.exposure + PRIOR_HOURS)
+            hour = datetime.fromtimestamp(now, IRAN_TZ).hour
+            rate = (stats.hour_changes[hour] + overall * HOUR_PRIOR_HOURS) / (stats.hour_exposure[hour] + HOUR_PRIOR_HOURS)
+            return rate * UNPLANNED_BOOST if stats.unplanned else rate
+
+    def intervals(self, now):
+        """فاصله دریافت هر منطقه (ثانیه) با تقسیم بودجه متناسب با جذر نرخ تغییر"""
+        floor = 3600 / self.max_staleness
+        cap = 3600 / self.min_interval
+        weights = {area_name: math.sqrt(self.change_rate(area_name, now)) for area_name in self.areas}
+
+        if floor * len(weights) >= self.budget_per_hour:
+            # تضمین بیشینه کهنگی بر بودجه مقدم است
+            if not self._warned_budget:
+                logger.warning(f"بودجه {self.budget_per_hour} درخواست در ساعت برای بیشینه کهنگی {self.max_staleness} ثانیه کافی نیست")
+                self._warned_budget = True
+            return {area_name: self.max_staleness for area_name in weights}
+        if cap * len(weights) <= self.budget_per_hour:
+            return {area_name: self.min_interval for area_name in weights}
+
+        # جستجوی دودویی ضریبی که مجموع بسامدهای محدود شده را برابر بودجه کند
+        low, high = 0.0, cap / min(weight for weight in weights.values())
+        for _ in range(50):
+            scale = (low + high) / 2
+            total = sum(min(cap, max(floor, scale * weight)) for weight in weights.values())
+            if total > self.budget_per_hour:
+                high = scale
+            else:
+                low = scale
+        return {
+            area_name: 3600 / min(cap, max(floor, low * weight))
+            for area_name, weight in weights.items()
+        }
+
+    def due_areas(self, fetched_times, now):
+        """مناطقی که نوبت دریافتشان رسیده، به ترتیب بیشترین تأخیر نسبت به فاصله خود
+
+        fetched_times زمان آخرین snapshot هر منطقه در store است (None اگر نیست)،
+        پس رهبر جدید از همان جایی ادامه می‌دهد که رهبر قبلی رها کرده است.
+        """
+        intervals = self.intervals(now)
+        overdue = []
+        for area_name in self.areas:
+            fetched_at = fetched_times.get(area_name)
+            if fetched_at is None:
+                overdue.append((math.inf, area_name))
+                continue
+            ratio = (now - fetched_at) / intervals[area_name]
+            if ratio >= 1:
+                overdue.append((ratio, area_name))
+        overdue.sort(key=lambda item: item[0], reverse=True)
+        return [area_name for _, area_name in overdue]
+
+    def is_due(self, area_name, fetched_at, now):
+        """آیا دریافت منطقه اکنون در بودجه جا می‌شود (snapshot ندارد یا فاصله‌اش گذشته است)"""
+        return fetched_at is None or now - fetched_at >= self.intervals(now)[area_name]
+
+    def next_delay(self, fetched_times, now):
+        """ثانیه‌های باقی‌مانده تا نوبت نزدیک‌ترین منطقه"""
+        intervals = self.intervals(now)
+        delays = [
+            0 if fetched_times.get(area_name) is None
+            else fetched_times[area_name] + intervals[area_name] - now
+            for area_name in self.areas
+        ]
+        return max(1.0, min(delays, default=self.max_staleness))
+
+    def describe(self, now):
+        """(نرخ تغییر در ساعت، فاصله دریافت ثانیه) هر منطقه برای گزارش"""
+        intervals = self.intervals(now)
+        return {area_name: (self.change_rate(area_name, now), intervals[area_name]) for area_name in self.areas}
+
+    def export_state(self):
+        with self._lock:
+            return {
+                area_name: {key: list(value) if isinstance(value, list) else value for key, value in vars(stats).items()}
+                for area_name, stats in self.stats.items()
+            }
+
+    def restore_state(self, state):
+        """بازگرداندن آمار ذخیره شده با export_state"""
+        if not state:
+            return
+        with self._lock:
+            for area_name, values in state.items():
+                stats = AreaChangeStats()
+                stats.__dict__.update(values)
+                self.stats[area_name] = stats
+
+
+def build_scheduler(areas):
+    """زمان‌بند تطبیقی با تنظیمات config یا None وقتی POLL_BUDGET_PER_HOUR صفر است"""
+    from config import POLL_BUDGET_PER_HOUR, POLL_MIN_INTERVAL, POLL_MAX_STALENESS, POLL_HALF_LIFE_HOURS
+    if not POLL_BUDGET_PER_HOUR:
+        return None
+    return AdaptivePollScheduler(
+        areas, POLL_BUDGET_PER_HOUR, POLL_MIN_INTERVAL, POLL_MAX_STALENESS, POLL_HALF_LIFE_HOURS
+    )
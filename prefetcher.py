@@ -0,0 +1,205 @@
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from main import PowerOutageChecker
+from session_pool import SessionPoolExhausted
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotPrefetcher:
+    """دریافت دوره‌ای خاموشی‌های همه مناطق و انتشار آن‌ها در SnapshotStore
+
+    چند پردازه می‌توانند هر کدام یک prefetcher اجرا کنند؛ فقط پردازه‌ای که
+    اجاره رهبری را در store در اختیار دارد به سایت خاموشی درخواست می‌فرستد.
+    با scheduler (AdaptivePollScheduler) فاصله دریافت هر منطقه از نرخ تغییر
+    آن تعیین می‌شود و در غیر این صورت همه مناطق هر interval ثانیه دریافت می‌شوند.
+    با sessions (SessionPool) مناطق به صورت موازی و هر کدام با session مستقل
+    دریافت می‌شوند؛ بدون آن همه دریافت‌ها از یک checker و پشت سر هم انجام می‌شوند.
+    رهبر هر purge_interval ثانیه مقدارهای منقضی شده store را هم حذف می‌کند.
+    """
+
+    def __init__(self, store, areas, worker_id, interval=300, lease_ttl=60, checker=None, archive=None,
+                 scheduler=None, sessions=None, purge_interval=3600):
+        self.store = store
+        self.areas = areas
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lease_ttl = lease_ttl
+        self.checker = checker or PowerOutageChecker()
+        self.archive = archive
+        self.scheduler = scheduler
+        self.sessions = sessions
+        self.purge_interval = purge_interval
+        self.purged_at = 0
+        self.is_leader = False
+        self.listeners = []
+        self._fetch_lock = threading.Lock()
+        # ذخیره snapshot و اجرای listenerها حتی در دریافت موازی پشت سر هم است
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """ثبت تابعی که با (area_name, snapshot, previous) پس از هر snapshot جدید صدا زده می‌شود"""
+        self.listeners.append(callback)
+
+    def fetch_area(self, area_name):
+        """دریافت خاموشی‌های یک منطقه از سایت و ذخیره در store"""
+        area_info = self.areas[area_name]
+        if self.sessions is not None:
+            try:
+                html_content = self.sessions.call(
+                    'search_outages', city_code=area_info['city_code'], area_code=area_info['area_code']
+                )
+            except SessionPoolExhausted as e:
+                logger.warning(f"دریافت {area_name} انجام نشد: {e}")
+                return None
+        else:
+            with self._fetch_lock:
+                html_content = self.checker.search_outages(
+                    city_code=area_info['city_code'],
+                    area_code=area_info['area_code']
+                )
+        if html_content is None:
+            return None
+        if self.archive is not None:
+            try:
+                self.archive.store(html_content, area=area_name)
+            except Exception as e:
+                logger.error(f"خطا در بایگانی پاسخ {area_name}: {e}")
+
+        outages = self.checker.parse_outages(html_content)
+        with self._publish_lock:
+            previous = self.store.get_snapshot(area_name)
+            snapshot = self.store.put_snapshot(area_name, outages)
+            if self.scheduler is not None:
+                self.scheduler.observe(area_name, snapshot, previous)
+
+            for callback in self.listeners:
+                try:
+                    callback(area_name, snapshot, previous)
+                except Exception as e:
+                    logger.error(f"خطا در پردازش snapshot جدید {area_name}: {e}")
+        return snapshot
+
+    def refresh_leadership(self):
+        """تمدید یا گرفتن اجاره رهبری"""
+        was_leader = self.is_leader
+        self.is_leader = self.store.acquire_leadership(self.worker_id, self.lease_ttl)
+        if self.is_leader != was_leader:
+            state = "رهبر" if self.is_leader else "پیرو"
+            logger.info(f"worker {self.worker_id} اکنون {state} است")
+        return self.is_leader
+
+    def is_stale(self, area_name):
+        """آیا snapshot منطقه قدیمی‌تر از بازه دریافت است"""
+        snapshot = self.store.get_snapshot(area_name)
+        return snapshot is None or time.time() - snapshot['fetched_at'] >= self.interval
+
+    def fetched_times(self):
+        """زمان آخرین snapshot هر منطقه در store"""
+        times = {}
+        for area_name in self.areas:
+            snapshot = self.store.get_snapshot(area_name)
+            times[area_name] = snapshot['fetched_at'] if snapshot else None
+        return times
+
+    def due_areas(self):
+        """مناطقی که باید اکنون دریافت شوند، فوری‌ترین اول"""
+        if self.scheduler is None:
+            return [area_name for area_name in self.areas if self.is_stale(area_name)]
+        return self.scheduler.due_areas(self.fetched_times(), time.time())
+
+    def on_demand_allowed(self, area_name, snapshot):
+        """آیا دریافت درخواستی (به خاطر کاربر) منطقه مجاز است
+
+        با زمان‌بند تطبیقی فقط وقتی که منطقه سررسید شده باشد، تا درخواست‌های
+        کاربران در ساعات شلوغ بودجه درخواست به سایت را دور نزنند؛ در غیر این
+        صورت snapshot موجود استفاده می‌شود و منطقه در نوبت خود دریافت می‌شود.
+        """
+        if self.scheduler is None or snapshot is None:
+            return True
+        return self.scheduler.is_due(area_name, snapshot['fetched_at'], time.time())
+
+    def next_delay(self):
+        """ثانیه‌های باقی‌مانده تا دریافت بعدی"""
+        if self.scheduler is None:
+            return self.interval
+        return self.scheduler.next_delay(self.fetched_times(), time.time())
+
+    def purge_expired(self):
+        """حذف مقدارهای منقضی شده store اگر purge_interval از حذف قبلی گذشته باشد"""
+        now = time.time()
+        if now - self.purged_at < self.purge_interval:
+            return 0
+        self.purged_at = now
+        removed = self.store.purge_expired()
+        if removed:
+            logger.info(f"{removed} مقدار منقضی شده از store حذف شد")
+        return removed
+
+    def run_once(self):
+        """دریافت مناطقی که نوبتشان رسیده در صورت رهبر بودن"""
+        if not self.refresh_leadership():
+            return
+        try:
+            self.purge_expired()
+        except Exception as e:
+            logger.error(f"خطا در حذف مقدارهای منقضی شده: {e}")
+        due = self.due_areas()
+        if self.sessions is not None and len(due) > 1:
+            self.fetch_parallel(due)
+            return
+        for area_name in due:
+            if self._stop.is_set():
+                break
+            # تمدید اجاره بین مناطق تا دریافت طولانی باعث از دست رفتن رهبری نشود
+            if not self.refresh_leadership():
+                break
+            self.fetch_area(area_name)
+
+    def fetch_parallel(self, area_names):
+        """دریافت همزمان مناطق با حداکثر یک درخواست به ازای هر session مخزن"""
+        workers = min(self.sessions.size, len(area_names))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') as executor:
+            futures = {executor.submit(self.fetch_area, area_name): area_name for area_name in area_names}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"خطا در دریافت {futures[future]}: {e}")
+                # تمدید اجاره پس از هر منطقه؛ با توقف یا از دست رفتن رهبری بقیه لغو می‌شوند
+                if self._stop.is_set() or not self.refresh_leadership():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                delay = self.next_delay()
+            except Exception as e:
+                logger.error(f"خطا در دریافت دوره‌ای خاموشی‌ها: {e}")
+                delay = self.interval
+            # بیدار شدن پیش از پایان اجاره برای تمدید رهبری
+            self._stop.wait(min(delay, self.lease_ttl / 3))
+
+    def start(self):
+        """شروع thread پس‌زمینه"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='snapshot-prefetcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """توقف thread و آزاد کردن رهبری"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.is_leader:
+            self.store.release_leadership(self.worker_id)
+            self.is_leader = False
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+import inspect
+import itertools
+import contextvars
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# شناسه thread درخواست در حال پروفایل؛ فراخوانی‌های تو در تو در همان thread جدا پروفایل نمی‌شوند
+_active_thread = contextvars.ContextVar('profiled_thread', default=None)
+
+
+class StackSampler:
+    """نمونه‌برداری دوره‌ای از پشته یک thread و شمارش پشته‌های فشرده (collapsed)"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+class Profiler:
+    """پروفایل اختیاری درخواست‌ها با cProfile و نمونه‌برداری از پشته
+
+    در حالت غیرفعال هزینه هر فراخوانی فقط بررسی یک attribute است. در حالت
+    فعال برای هر درخواست یک فایل .prof (قابل خواندن با pstats/snakeviz) و یک
+    فایل .folded (ورودی flamegraph.pl و speedscope) در directory نوشته می‌شود.
+    cProfile در هر لحظه فقط برای یک درخواست فعال است؛ درخواست‌های همزمان
+    دیگر فقط نمونه‌برداری می‌شوند. برای handlerهای async هر دو پروفایل کارهای
+    دیگر event loop در همان بازه را هم شامل می‌شوند.
+    """
+
+    def __init__(self, directory=None, sample_interval=0.005):
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.enabled = directory is not None
+        self._cprofile_lock = threading.Lock()
+        self._counter = itertools.count(1)
+
+    @classmethod
+    def from_env(cls):
+        """فعال‌سازی با متغیر محیطی PROFILE_DIR"""
+        interval = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+        return cls(os.getenv('PROFILE_DIR') or None, interval)
+
+    def enable(self, directory):
+        self.directory = directory
+        self.enabled = True
+        logger.info(f"پروفایل درخواست‌ها فعال شد: {directory}")
+
+    def disable(self):
+        self.enabled = False
+        logger.info("پروفایل درخواست‌ها غیرفعال شد")
+
+    def _begin(self, name):
+        """شروع پروفایل یک درخواست یا None اگر داخل پروفایل دیگری در همین thread است"""
+        thread_id = threading.get_ident()
+        if _active_thread.get() == thread_id:
+            return None
+        token = _active_thread.set(thread_id)
+        profile = None
+        if self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            profile.enable()
+        sampler = StackSampler(thread_id, self.sample_interval).start()
+        return name, token, profile, sampler, time.perf_counter()
+
+    def _end(self, state):
+        name, token, profile, sampler, started = state
+        elapsed = time.perf_counter() - started
+        stacks = sampler.stop()
+        if profile is not None:
+            profile.disable()
+            self._cprofile_lock.release()
+        _active_thread.reset(token)
+
+        try:
+            self._write(name, profile, stacks, elapsed)
+        except Exception as e:
+            logger.error(f"خطا در ذخیره پروفایل {name}: {e}")
+
+    def _write(self, name, profile, stacks, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory,
+            f"{datetime.now():%Y%m%d_%H%M%S}_{next(self._counter):05d}_{name.replace('.', '_')}"
+        )
+        if profile is not None:
+            pstats.Stats(profile).dump_stats(f"{base}.prof")
+        with open(f"{base}.folded", 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"پروفایل {name} ({elapsed * 1000:.1f} ms) ذخیره شد: {base}")
+
+    def wrap(self, func, name=None):
+        """پوشاندن یک تابع عادی، generator یا async با پروفایل اختیاری"""
+        name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return await func(*args, **kwargs)
+                state = self._begin(name)
+                if state is None:
+                    return await func(*args, **kwargs)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self._end(state)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            # پروفایل از اولین next تا پایان پیمایش؛ زمان مصرف‌کننده بین تکه‌ها هم شامل است
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return (yield from func(*args, **kwargs))
+                state = self._begin(name)
+                if state is None:
+                    return (yield from func(*args, **kwargs))
+                try:
+                    return (yield from func(*args, **kwargs))
+                finally:
+                    self._end(state)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            state = self._begin(name)
+            if state is None:
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._end(state)
+        return wrapper
+
+
+# پروفایلر سراسری پردازه؛ با PROFILE_DIR یا دستور /profile ادمین فعال می‌شود
+PROFILER = Profiler.from_env()
+
+
+def profiled(func):
+    """decorator پروفایل اختیاری با پروفایلر سراسری"""
+    return PROFILER.wrap(func)
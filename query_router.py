@@ -0,0 +1,40 @@
+import re
+
+
+class QueryRouter:
+    """تشخیص منطقه و کلمات کلیدی یک پیام در یک گذر
+
+    نام مناطق و نام‌های جایگزین آن‌ها یک بار در قالب یک regex تناوبی کامپایل
+    می‌شوند؛ نام‌های طولانی‌تر زودتر امتحان می‌شوند تا «قائم شهر» پیش از
+    بخش‌های کوتاه‌تر تطبیق یابد.
+    """
+
+    def __init__(self, areas, aliases=None):
+        self.areas = areas
+        self._names = {}
+        for area_name in areas:
+            self._names[area_name.lower()] = area_name
+            for alias in (aliases or {}).get(area_name, []):
+                self._names[alias.lower()] = area_name
+
+        alternation = '|'.join(re.escape(name) for name in sorted(self._names, key=len, reverse=True))
+        self._pattern = re.compile(alternation, re.IGNORECASE) if alternation else None
+
+    def route(self, query):
+        """برگرداندن (نام منطقه یا None، لیست کلمات کلیدی یا None)"""
+        if self._pattern is None:
+            terms = query.split()
+            return None, terms or None
+
+        area_name = None
+        pieces = []
+        position = 0
+        for match in self._pattern.finditer(query):
+            if area_name is None:
+                area_name = self._names[match.group(0).lower()]
+            pieces.append(query[position:match.start()])
+            position = match.end()
+        pieces.append(query[position:])
+
+        terms = ' '.join(pieces).split()
+        return area_name, terms or None
@@ -0,0 +1,65 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """سطل توکن با ظرفیت burst و نرخ پر شدن rate توکن در ثانیه"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now if now is not None else time.monotonic()
+
+    def refill(self, now):
+        """افزودن توکن‌های انباشته شده از آخرین به‌روزرسانی"""
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+
+class RequestThrottler:
+    """محدودسازی درخواست‌ها با سطل جداگانه برای هر کاربر و هر چت
+
+    یک درخواست فقط وقتی پذیرفته می‌شود که هر دو سطل توکن داشته باشند. سطل‌های
+    کم‌استفاده پس از رسیدن به max_keys به ترتیب LRU حذف می‌شوند.
+    """
+
+    def __init__(self, user_rate, user_burst, chat_rate, chat_burst, max_keys=10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, rate, capacity, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def allow(self, user_id, chat_id, cost=1):
+        """آیا این کاربر در این چت اجازه درخواست جدید دارد"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._bucket(('user', user_id), self.user_rate, self.user_burst, now)]
+            if chat_id is not None and chat_id != user_id:
+                buckets.append(self._bucket(('chat', chat_id), self.chat_rate, self.chat_burst, now))
+
+            if any(bucket.tokens < cost for bucket in buckets):
+                return False
+            for bucket in buckets:
+                bucket.tokens -= cost
+            return True
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SearchQueueFull(Exception):
+    """صف جستجو پر است و درخواست جدید پذیرفته نمی‌شود"""
+
+
+class SearchQueue:
+    """صف محدود جستجوها با تعداد ثابت worker و ادغام درخواست‌های یکسان
+
+    درخواست‌هایی که کلید یکسان دارند و هنوز در صف یا در حال اجرا هستند به یک
+    کار تبدیل می‌شوند و نتیجه آن به همه منتظرها می‌رسد. وقتی maxsize کار
+    متمایز در انتظارند، کار جدید با SearchQueueFull رد می‌شود.
+    """
+
+    def __init__(self, workers=4, maxsize=100):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.pending = {}       # کلید -> (شماره نوبت، future)
+        self.enqueued = 0
+        self.started = 0
+        self.finished = 0
+        self.coalesced = 0
+        self.shed = 0
+        self._queue = None
+        self._tasks = []
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.maxsize)
+            self._tasks = [
+                asyncio.get_running_loop().create_task(self._worker())
+                for _ in range(self.workers)
+            ]
+
+    async def _worker(self):
+        while True:
+            key, job, future = await self._queue.get()
+            self.started += 1
+            try:
+                result = await job()
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"خطا در اجرای جستجوی صف {key}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.finished += 1
+                self.pending.pop(key, None)
+                self._queue.task_done()
+
+    def position(self, sequence):
+        """جایگاه یک نوبت در صف انتظار؛ 0 یعنی در حال اجراست یا worker آزاد دارد"""
+        idle = self.workers - (self.started - self.finished)
+        return max(0, sequence - self.started - idle)
+
+    def submit(self, key, job):
+        """افزودن کار یا پیوستن به کار یکسان در انتظار؛ خروجی (future، جایگاه در صف)
+
+        job یک تابع بدون ورودی است که coroutine نتیجه را می‌سازد.
+        """
+        self._ensure_workers()
+        if key in self.pending:
+            sequence, future = self.pending[key]
+            self.coalesced += 1
+            return future, self.position(sequence)
+
+        if self._queue.full():
+            self.shed += 1
+            raise SearchQueueFull(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self.enqueued += 1
+        self.pending[key] = (self.enqueued, future)
+        self._queue.put_nowait((key, job, future))
+        return future, self.position(self.enqueued)
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'queued': self._queue.qsize() if self._queue else 0,
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'shed': self.shed,
+        }
+
+    async def close(self):
+        """توقف workerها"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for _, future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self._tasks = []
+        self._queue = None
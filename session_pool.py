@@ -0,0 +1,193 @@
+import time
+import logging
+import threading
+
+from main import PowerOutageChecker
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPoolExhausted(Exception):
+    """هیچ sessionی در مدت انتظار آزاد نشد"""
+
+
+class PooledSession:
+    """یک checker مستقل در مخزن به همراه آمار استفاده و خطای آن"""
+
+    def __init__(self, checker, now):
+        self.checker = checker
+        self.created_at = now
+        self.last_ok = now
+        self.uses = 0
+        self.errors = 0
+
+
+class SessionPool:
+    """مخزن checkerهای مستقل برای درخواست‌های همزمان به سایت
+
+    ViewState و EventValidation در ASP.NET به session (cookie) گره خورده‌اند،
+    پس هر PowerOutageChecker با requests.Session، cookieها و tokenهای خود فقط
+    در اختیار یک درخواست در هر لحظه است. sessionها در صورت نیاز تا size عدد
+    ساخته می‌شوند و آخرین session آزاد شده اول استفاده می‌شود تا tokenهایش
+    تازه بمانند. sessionی که max_errors بار پیاپی خطا داده یا max_uses بار
+    استفاده شده کنار گذاشته می‌شود و sessionی که idle_check ثانیه موفق نبوده
+    پیش از استفاده با دریافت دوباره صفحه اولیه بررسی می‌شود. call حداکثر
+    acquire_timeout ثانیه منتظر session آزاد می‌ماند و خود درخواست‌ها مهلت
+    request_timeout checker را دارند، پس اتصال معلق همه sessionها را قفل نمی‌کند.
+    """
+
+    def __init__(self, size=4, factory=None, max_errors=3, max_uses=500, idle_check=600, acquire_timeout=30):
+        self.size = max(1, size)
+        self.factory = factory or PowerOutageChecker
+        self.max_errors = max_errors
+        self.max_uses = max_uses
+        self.idle_check = idle_check
+        self.acquire_timeout = acquire_timeout
+        self._idle = []         # sessionهای آزاد؛ آخرین آزاد شده در انتها
+        self._leased = {}       # checker -> PooledSession
+        self._open = 0
+        self._cond = threading.Condition()
+        self.requests = 0
+        self.failures = 0
+        self.recycled = 0
+        self.health_checks = 0
+
+    def acquire(self, timeout=None):
+        """گرفتن یک checker آزاد؛ در صورت پر بودن مخزن تا timeout ثانیه منتظر می‌ماند"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise SessionPoolExhausted(f"هیچ session آزادی در {timeout} ثانیه پیدا نشد")
+                self._cond.wait(remaining)
+            self.requests += 1
+
+        now = time.monotonic()
+        try:
+            if entry is None:
+                entry = PooledSession(self.factory(), now)
+            elif now - entry.last_ok >= self.idle_check and entry.checker.form_tokens:
+                entry = self._check_health(entry, now)
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._leased[entry.checker] = entry
+        return entry.checker
+
+    def _check_health(self, entry, now):
+        """دریافت دوباره tokenهای session بی‌استفاده؛ در صورت شکست session تازه جایگزین می‌شود"""
+        with self._cond:
+            self.health_checks += 1
+        if entry.checker.get_form_tokens(refresh=True):
+            entry.last_ok = now
+            return entry
+        logger.warning("بررسی سلامت session ناموفق بود؛ session تازه جایگزین شد")
+        self._discard(entry)
+        return PooledSession(self.factory(), now)
+
+    def _discard(self, entry):
+        with self._cond:
+            self.recycled += 1
+        try:
+            entry.checker.session.close()
+        except Exception as e:
+            logger.debug(f"خطا در بستن session: {e}")
+
+    def release(self, checker, failed=False):
+        """بازگرداندن checker به مخزن پس از یک درخواست موفق یا ناموفق"""
+        with self._cond:
+            entry = self._leased.pop(checker)
+            entry.uses += 1
+            if failed:
+                entry.errors += 1
+                self.failures += 1
+            else:
+                entry.errors = 0
+                entry.last_ok = time.monotonic()
+            retire = entry.errors >= self.max_errors or entry.uses >= self.max_uses
+            if retire:
+                self._open -= 1
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+        if retire:
+            reason = f"{entry.errors} خطای پیاپی" if failed else f"{entry.uses} استفاده"
+            logger.info(f"session پس از {reason} کنار گذاشته شد")
+            self._discard(entry)
+
+    def call(self, method, *args, **kwargs):
+        """اجرای یک متد checker روی session آزاد؛ خروجی None یا استثنا خطا شمرده می‌شود
+
+        اگر در acquire_timeout ثانیه sessionی آزاد نشود SessionPoolExhausted بالا می‌آید.
+        """
+        checker = self.acquire(self.acquire_timeout)
+        failed = True
+        try:
+            result = getattr(checker, method)(*args, **kwargs)
+            failed = result is None
+            return result
+        finally:
+            self.release(checker, failed)
+
+    def export_state(self):
+        """tokenها و cookieهای sessionهای آزاد برای ذخیره در شروع دوباره"""
+        with self._cond:
+            return [entry.checker.export_state() for entry in self._idle]
+
+    def restore_state(self, states):
+        """ساخت sessionهای آزاد از وضعیت‌های ذخیره شده با export_state"""
+        now = time.monotonic()
+        for state in states or []:
+            with self._cond:
+                if self._open >= self.size:
+                    return
+                self._open += 1
+            checker = self.factory()
+            checker.restore_state(state)
+            with self._cond:
+                self._idle.append(PooledSession(checker, now))
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': len(self._leased),
+                'requests': self.requests,
+                'failures': self.failures,
+                'recycled': self.recycled,
+                'health_checks': self.health_checks,
+            }
+
+    def close(self):
+        """بستن sessionهای آزاد"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for entry in idle:
+            entry.checker.session.close()
+
+
+def build_session_pool(size=None, factory=None):
+    """مخزن session با تنظیمات config"""
+    from config import (
+        SESSION_POOL_SIZE, SESSION_MAX_ERRORS, SESSION_MAX_USES, SESSION_IDLE_CHECK, SESSION_ACQUIRE_TIMEOUT
+    )
+    return SessionPool(
+        size or SESSION_POOL_SIZE, factory, SESSION_MAX_ERRORS, SESSION_MAX_USES, SESSION_IDLE_CHECK,
+        SESSION_ACQUIRE_TIMEOUT
+    )
@@ -0,0 +1,119 @@
+import sys
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_size(obj, seen=None):
+    """تخمین حجم حافظه یک شیء و اشیای درون آن (بایت)؛ اشیای مشترک یک بار شمرده می‌شوند"""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__') and not isinstance(item, type):
+            stack.append(vars(item))
+    return total
+
+
+class SnapshotCache:
+    """کش LRU با بودجه حافظه برای snapshotها و ایندکس‌های تجزیه شده
+
+    حجم هر ورودی هنگام افزودن تخمین زده می‌شود و با عبور از max_bytes
+    کم‌استفاده‌ترین ورودی‌ها حذف می‌شوند. ورودی «جاری» هر گروه (مثلاً آخرین
+    snapshot دریافت شده یک منطقه) pin می‌شود و حذف نمی‌شود تا ورودی بعدی همان
+    گروه جای آن را بگیرد.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # کلید -> (مقدار، حجم)
+        self._pinned = {}               # گروه -> کلید
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """خواندن بدون تغییر ترتیب LRU و آمار"""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else default
+
+    def put(self, key, value, size=None, pin_group=None):
+        """افزودن ورودی؛ با pin_group ورودی جاری قبلی آن گروه قابل حذف می‌شود"""
+        size = approximate_size(value) if size is None else size
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            if pin_group is not None:
+                self._pinned[pin_group] = key
+            self._evict()
+
+    def keys(self):
+        """کپی کلیدهای کش به ترتیب LRU"""
+        with self._lock:
+            return list(self._entries)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= entry[1]
+            return entry[0]
+
+    def _evict(self):
+        pinned = set(self._pinned.values())
+        for key in list(self._entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in pinned:
+                continue
+            _, size = self._entries.pop(key)
+            self.bytes -= size
+            self.evictions += 1
+        if self.bytes > self.max_bytes:
+            logger.warning(f"ورودی‌های pin شده ({self.bytes} بایت) از بودجه کش ({self.max_bytes} بایت) بیشترند")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'pinned': len(self._pinned),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,511 @@
+import os
+import math
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+import functools
+from array import array
+from collections.abc import Mapping, Sequence
+
+from outage_index import OutageIndex, OUTAGE_FIELDS, parse_feeder_term
+from snapshot_store import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OUTSNAP\x00'
+# با هر تغییر ساختار فایل افزایش یابد؛ فایل‌های نسخه دیگر خوانده نمی‌شوند
+FORMAT_VERSION = 1
+# فیلدهای رشته‌ای هر ردیف به ترتیب ذخیره؛ بیت i ماسک حضور یعنی ردیف فیلد i را دارد
+ROW_FIELDS = OUTAGE_FIELDS + ['feeder']
+LOCALITIES_BIT = 1 << len(ROW_FIELDS)
+ROW_WIDTH = len(ROW_FIELDS) + 1     # ماسک حضور و شناسه رشته هر فیلد
+NO_STRING = 0xFFFFFFFF
+
+# بخش‌های فایل به ترتیب نوشتن با نوع عناصر (typecode ماژول array)
+SECTIONS = [
+    ('string_offsets', 'I'), ('string_blob', 'B'),
+    ('rows', 'I'), ('locality_offsets', 'I'), ('localities', 'I'),
+    ('texts', 'I'), ('lengths', 'I'), ('windows', 'd'),
+    ('tokens', 'I'), ('idf', 'd'), ('posting_offsets', 'I'), ('postings', 'I'), ('frequencies', 'I'),
+    ('grams', 'I'), ('gram_offsets', 'I'), ('gram_tokens', 'I'),
+    ('feeders', 'I'), ('feeder_offsets', 'I'), ('feeder_rows', 'I'),
+]
+# magic، نسخه، نشانه ترتیب بایت، تعداد ردیف، شناسه رشته منطقه و digest، زمان دریافت، میانگین طول ردیف‌ها
+HEADER = struct.Struct('=8sIIIIIdd')
+# شروع (بایت از ابتدای فایل) و تعداد عناصر هر بخش
+SECTION_ENTRY = struct.Struct('=QQ')
+# فایل با ترتیب بایت همان ماشین نوشته می‌شود و روی ماشین دیگر رد می‌شود
+BYTE_ORDER_MARK = 0x01020304
+
+
+def _align(offset):
+    """شروع هر بخش مضرب 8 بایت است تا آرایه‌های double هم‌تراز باشند"""
+    return (offset + 7) & ~7
+
+
+class _StringTable:
+    """جدول رشته‌های یکتای فایل: همه رشته‌ها یک بار و پشت سر هم به UTF-8"""
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array('I', [0])
+        self.blob = bytearray()
+
+    def add(self, text):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            if not isinstance(text, str):
+                raise ValueError(f"مقدار غیر رشته‌ای در snapshot: {text!r}")
+            string_id = self.ids[text] = len(self.ids)
+            self.blob += text.encode('utf-8')
+            self.offsets.append(len(self.blob))
+        return string_id
+
+
+def encode_snapshot(snapshot, index=None):
+    """محتوای فایل باینری یک snapshot و ایندکس جستجوی آن
+
+    ValueError یعنی خاموشی‌ها فیلدی دارند که در ROW_FIELDS نیست و ذخیره آن
+    در فایل باعث تفاوت با snapshot اصلی می‌شد.
+    """
+    outages = snapshot['outages']
+    index = index or OutageIndex(outages)
+    strings = _StringTable()
+    area_id = strings.add(snapshot['area'])
+    digest_id = strings.add(snapshot['digest'])
+
+    rows = array('I')
+    locality_offsets = array('I', [0])
+    localities = array('I')
+    for outage in outages:
+        unknown = set(outage) - set(ROW_FIELDS) - {'localities'}
+        if unknown:
+            raise ValueError(f"فیلد ناشناخته در خاموشی: {sorted(unknown)}")
+        mask = 0
+        ids = []
+        for bit, field in enumerate(ROW_FIELDS):
+            if field in outage:
+                mask |= 1 << bit
+                ids.append(strings.add(outage[field]))
+            else:
+                ids.append(NO_STRING)
+        if 'localities' in outage:
+            mask |= LOCALITIES_BIT
+            localities.extend(strings.add(locality) for locality in outage['localities'])
+        locality_offsets.append(len(localities))
+        rows.append(mask)
+        rows.extend(ids)
+
+    windows = array('d')
+    for window in index.windows:
+        windows.extend(window if window is not None else (math.nan, math.nan))
+
+    tokens, idf = array('I'), array('d')
+    posting_offsets, postings, frequencies = array('I', [0]), array('I'), array('I')
+    token_numbers = {}
+    for number, token in enumerate(index.sorted_tokens):
+        token_numbers[token] = number
+        tokens.append(strings.add(token))
+        idf.append(index.idf[token])
+        for position, frequency in sorted(index.token_frequencies(token)):
+            postings.append(position)
+            frequencies.append(frequency)
+        posting_offsets.append(len(postings))
+
+    grams, gram_offsets, gram_tokens = array('I'), array('I', [0]), array('I')
+    for gram in sorted(index.trigram_tokens):
+        grams.append(strings.add(gram))
+        gram_tokens.extend(token_numbers[token] for token in index.trigram_tokens[gram])
+        gram_offsets.append(len(gram_tokens))
+
+    feeders, feeder_offsets, feeder_rows = array('I'), array('I', [0]), array('I')
+    for feeder in sorted(index.feeder_rows):
+        feeders.append(strings.add(feeder))
+        feeder_rows.extend(index.feeder_rows[feeder])
+        feeder_offsets.append(len(feeder_rows))
+
+    texts = array('I', (strings.add(text) for text in index.texts))
+    # جدول رشته‌ها پس از افزودن همه رشته‌ها کامل است
+    sections = {
+        'string_offsets': strings.offsets, 'string_blob': array('B', strings.blob),
+        'rows': rows, 'locality_offsets': locality_offsets, 'localities': localities,
+        'texts': texts, 'lengths': array('I', index.lengths), 'windows': windows,
+        'tokens': tokens, 'idf': idf, 'posting_offsets': posting_offsets,
+        'postings': postings, 'frequencies': frequencies,
+        'grams': grams, 'gram_offsets': gram_offsets, 'gram_tokens': gram_tokens,
+        'feeders': feeders, 'feeder_offsets': feeder_offsets, 'feeder_rows': feeder_rows,
+    }
+
+    offset = _align(HEADER.size + SECTION_ENTRY.size * len(SECTIONS))
+    table = []
+    for name, _ in SECTIONS:
+        table.append((offset, len(sections[name])))
+        offset = _align(offset + len(sections[name]) * sections[name].itemsize)
+
+    buffer = bytearray(offset)
+    HEADER.pack_into(
+        buffer, 0, MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, len(outages),
+        area_id, digest_id, snapshot['fetched_at'], index.average_length
+    )
+    for number, ((name, _), (start, count)) in enumerate(zip(SECTIONS, table)):
+        SECTION_ENTRY.pack_into(buffer, HEADER.size + number * SECTION_ENTRY.size, start, count)
+        data = sections[name].tobytes()
+        buffer[start:start + len(data)] = data
+    return bytes(buffer)
+
+
+def write_snapshot_file(path, snapshot, index=None):
+    """نوشتن فایل snapshot در فایل موقت و جایگزینی اتمی
+
+    خواننده‌هایی که فایل قبلی را mmap کرده‌اند تا رها کردن آن همان نسخه را می‌بینند.
+    """
+    data = encode_snapshot(snapshot, index)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(data)
+
+
+class SnapshotFile:
+    """فایل snapshot نگاشته شده در حافظه (mmap فقط‌خواندنی)
+
+    بخش‌ها memoryviewهایی روی همان صفحات هستند، پس چند پردازه که یک فایل را
+    باز کرده‌اند یک نسخه در page cache سیستم‌عامل دارند. رشته‌ها فقط هنگام
+    دسترسی decode می‌شوند.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"فایل snapshot ناقص است: {path}")
+        magic, version, mark, self.row_count, area_id, digest_id, self.fetched_at, self.average_length = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or mark != BYTE_ORDER_MARK:
+            raise ValueError(f"قالب فایل snapshot سازگار نیست: {path}")
+
+        view = memoryview(self._map)
+        self.sections = {}
+        for number, (name, typecode) in enumerate(SECTIONS):
+            start, count = SECTION_ENTRY.unpack_from(self._map, HEADER.size + number * SECTION_ENTRY.size)
+            end = start + count * array(typecode).itemsize
+            if end > len(self._map):
+                raise ValueError(f"فایل snapshot ناقص است: {path}")
+            self.sections[name] = view[start:end].cast(typecode)
+        self._blob_start = SECTION_ENTRY.unpack_from(self._map, HEADER.size + SECTION_ENTRY.size)[0]
+
+        self.area = self.string(area_id)
+        self.digest = self.string(digest_id)
+        self.outages = MappedOutages(self)
+        self.index = MappedOutageIndex(self)
+
+    def span(self, string_id):
+        """بازه بایت‌های یک رشته در فایل"""
+        offsets = self.sections['string_offsets']
+        return self._blob_start + offsets[string_id], self._blob_start + offsets[string_id + 1]
+
+    def raw(self, string_id):
+        start, end = self.span(string_id)
+        return self._map[start:end]
+
+    def string(self, string_id):
+        return str(self.raw(string_id), 'utf-8')
+
+    def contains(self, string_id, needle):
+        """آیا رشته needle (بایت‌های UTF-8) را دارد، بدون کپی یا decode رشته"""
+        start, end = self.span(string_id)
+        return self._map.find(needle, start, end) != -1
+
+    def snapshot(self):
+        """دیکشنری snapshot مانند SnapshotStore به همراه ایندکس آماده در کلید index"""
+        return {
+            'area': self.area,
+            'outages': self.outages,
+            'fetched_at': self.fetched_at,
+            'digest': self.digest,
+            'index': self.index,
+        }
+
+
+class StringList(Sequence):
+    """لیست رشته‌هایی از فایل که با شناسه در جدول رشته‌ها ذخیره شده‌اند"""
+
+    def __init__(self, snapshot_file, ids):
+        self.file = snapshot_file
+        self.ids = ids
+        # کلمات پرسش‌ها تکرار می‌شوند؛ نتیجه جستجوی دودویی آن‌ها نگه داشته می‌شود
+        self.find = functools.lru_cache(maxsize=1024)(self._find)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.file.string(string_id) for string_id in self.ids[position]]
+        return self.file.string(self.ids[position])
+
+    def _find(self, text):
+        """شماره text در لیست مرتب یا -1
+
+        ترتیب بایت‌های UTF-8 همان ترتیب نویسه‌هاست، پس مقایسه بدون decode انجام می‌شود.
+        """
+        key = text.encode('utf-8')
+        low, high = 0, len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.file.raw(self.ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self.ids) and self.file.raw(self.ids[low]) == key else -1
+
+
+class SortedGroups(Mapping):
+    """نگاشت رشته‌های مرتب (کلمه، سه‌حرفی یا فیدر) به بازه‌ای از یک آرایه عددی"""
+
+    def __init__(self, keys, offsets, values, convert):
+        self.keys_list = keys
+        self.offsets = offsets
+        self.values_array = values
+        self.convert = convert
+
+    def __getitem__(self, key):
+        position = self.keys_list.find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self.convert(self.values_array[self.offsets[position]:self.offsets[position + 1]])
+
+    def __contains__(self, key):
+        return self.keys_list.find(key) >= 0
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
+
+
+class SortedValues(Mapping):
+    """نگاشت رشته‌های مرتب به یک عدد از آرایه هم‌ردیف (مثلاً idf هر کلمه)"""
+
+    def __init__(self, keys, values):
+        self.keys_list = keys
+        self.values_array = values
+
+    def __getitem__(self, key):
+        position = self.keys_list.find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self.values_array[position]
+
+    def __contains__(self, key):
+        return self.keys_list.find(key) >= 0
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
+
+
+class OutageWindows(Sequence):
+    """بازه (شروع، پایان) هر ردیف از آرایه double؛ شروع NaN یعنی بازه نامشخص"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values) // 2
+
+    def __getitem__(self, position):
+        start = self.values[2 * position]
+        if math.isnan(start):
+            return None
+        return start, self.values[2 * position + 1]
+
+
+class MappedOutages(Sequence):
+    """خاموشی‌های فایل به صورت لیست فقط‌خواندنی؛ هر ردیف هنگام دسترسی به دیکشنری تبدیل می‌شود"""
+
+    def __init__(self, snapshot_file):
+        self.file = snapshot_file
+        self.rows = snapshot_file.sections['rows']
+        self.locality_offsets = snapshot_file.sections['locality_offsets']
+        self.localities = snapshot_file.sections['localities']
+
+    def __len__(self):
+        return self.file.row_count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[row] for row in range(len(self))[position]]
+        row = range(len(self))[position]
+        base = row * ROW_WIDTH
+        mask = self.rows[base]
+        outage = {}
+        for bit, field in enumerate(ROW_FIELDS):
+            if mask >> bit & 1:
+                outage[field] = self.file.string(self.rows[base + 1 + bit])
+        if mask & LOCALITIES_BIT:
+            start, end = self.locality_offsets[row], self.locality_offsets[row + 1]
+            outage['localities'] = [self.file.string(string_id) for string_id in self.localities[start:end]]
+        return outage
+
+    def __reduce__(self):
+        # pickle (مثلاً در وضعیت شروع دوباره) به لیست معمولی تبدیل می‌شود
+        return list, (list(self),)
+
+
+class MappedOutageIndex(OutageIndex):
+    """همان پرسش‌های OutageIndex روی بخش‌های فایل snapshot، بدون ساخت دوباره ایندکس"""
+
+    def __init__(self, snapshot_file):
+        sections = snapshot_file.sections
+        self.file = snapshot_file
+        self.outages = snapshot_file.outages
+        self.texts = StringList(snapshot_file, sections['texts'])
+        self.sorted_tokens = StringList(snapshot_file, sections['tokens'])
+        self.token_postings = SortedGroups(self.sorted_tokens, sections['posting_offsets'], sections['postings'], set)
+        self.idf = SortedValues(self.sorted_tokens, sections['idf'])
+        self.trigram_tokens = SortedGroups(
+            StringList(snapshot_file, sections['grams']), sections['gram_offsets'], sections['gram_tokens'],
+            lambda numbers: [self.sorted_tokens[number] for number in numbers]
+        )
+        self.feeder_rows = SortedGroups(
+            StringList(snapshot_file, sections['feeders']), sections['feeder_offsets'], sections['feeder_rows'], list
+        )
+        self.lengths = sections['lengths']
+        self.windows = OutageWindows(sections['windows'])
+        self.average_length = snapshot_file.average_length
+
+    def match_positions(self, term):
+        if parse_feeder_term(term):
+            return super().match_positions(term)
+        needle = term.lower().encode('utf-8')
+        return [position for position, string_id in enumerate(self.texts.ids) if self.file.contains(string_id, needle)]
+
+    def token_frequencies(self, token):
+        position = self.sorted_tokens.find(token)
+        if position < 0:
+            return ()
+        offsets = self.file.sections['posting_offsets']
+        start, end = offsets[position], offsets[position + 1]
+        return zip(self.file.sections['postings'][start:end], self.file.sections['frequencies'][start:end])
+
+    def __reduce__(self):
+        return OutageIndex, (list(self.outages),)
+
+
+class MappedSnapshotStore(SnapshotStore):
+    """SnapshotStore که هر snapshot را در فایل باینری فقط‌خواندنی هم منتشر می‌کند
+
+    put_snapshot (در عمل فقط در رهبر) پس از ذخیره در store اصلی فایل منطقه را
+    با جایگزینی اتمی می‌نویسد. get_snapshot در همه پردازه‌ها فایل را mmap
+    می‌کند و تا تغییر فایل همان نگاشت را برمی‌گرداند، پس نه JSON خوانده
+    می‌شود و نه ایندکسی ساخته می‌شود. اگر فایلی نیست (مثلاً رهبر هنوز چیزی
+    منتشر نکرده) از store اصلی خوانده می‌شود. بقیه عملیات به store اصلی می‌رود.
+    """
+
+    def __init__(self, store, directory):
+        self.store = store
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}    # area_name -> (شناسه فایل روی دیسک، SnapshotFile)
+        self._lock = threading.Lock()
+
+    def path(self, area_name):
+        digest = hashlib.sha1(area_name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{digest}.snap")
+
+    def mapped_file(self, area_name):
+        """SnapshotFile جاری منطقه یا None؛ فقط وقتی فایل روی دیسک عوض شده باشد دوباره باز می‌شود"""
+        path = self.path(area_name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._files.get(area_name)
+            if cached is not None and cached[0] == file_key:
+                return cached[1]
+        try:
+            mapped = SnapshotFile(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"خطا در باز کردن فایل snapshot {area_name}: {e}")
+            return None
+        if mapped.area != area_name:
+            return None
+        with self._lock:
+            self._files[area_name] = (file_key, mapped)
+        return mapped
+
+    def get_snapshot(self, area_name):
+        mapped = self.mapped_file(area_name)
+        if mapped is None:
+            return self.store.get_snapshot(area_name)
+        return mapped.snapshot()
+
+    def get_digest(self, area_name):
+        mapped = self.mapped_file(area_name)
+        if mapped is None:
+            return self.store.get_digest(area_name)
+        return mapped.digest
+
+    def put_snapshot(self, area_name, outages, fetched_at=None):
+        snapshot = self.store.put_snapshot(area_name, outages, fetched_at)
+        path = self.path(area_name)
+        try:
+            size = write_snapshot_file(path, snapshot)
+        except (OSError, ValueError) as e:
+            logger.error(f"خطا در انتشار فایل snapshot {area_name}: {e}")
+            # فایل قدیمی نباید جلوی snapshot جدید store را بگیرد
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return snapshot
+        logger.debug(f"فایل snapshot {area_name} منتشر شد ({size} بایت)")
+        return self.get_snapshot(area_name)
+
+    def get_value(self, key):
+        return self.store.get_value(key)
+
+    def set_value(self, key, value, ttl=None):
+        return self.store.set_value(key, value, ttl)
+
+    def claim(self, key, ttl):
+        return self.store.claim(key, ttl)
+
+    def purge_expired(self):
+        return self.store.purge_expired()
+
+    def acquire_leadership(self, worker_id, ttl):
+        return self.store.acquire_leadership(worker_id, ttl)
+
+    def release_leadership(self, worker_id):
+        return self.store.release_leadership(worker_id)
+
+    def add_subscription(self, chat_id, area_name, term):
+        return self.store.add_subscription(chat_id, area_name, term)
+
+    def remove_subscriptions(self, chat_id, area_name=None, term=None):
+        return self.store.remove_subscriptions(chat_id, area_name, term)
+
+    def subscriptions(self, chat_id=None, area_name=None):
+        return self.store.subscriptions(chat_id, area_name)
+
+    def close(self):
+        with self._lock:
+            self._files.clear()
+        self.store.close()
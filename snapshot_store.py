@@ -0,0 +1,348 @@
+import json
+import sqlite3
+import threading
+import time
+import hashlib
+import logging
+
+from snapshot_cache import SnapshotCache
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_digest(outages):
+    """محاسبه اثر انگشت محتوای یک snapshot برای تشخیص تغییرات"""
+    payload = json.dumps(outages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class SnapshotStore:
+    """رابط مشترک ذخیره‌سازی snapshot خاموشی‌ها، کش کلید-مقدار و رهبری
+
+    هر snapshot یک دیکشنری با کلیدهای area، outages، fetched_at و digest است.
+    """
+
+    def get_snapshot(self, area_name):
+        """دریافت آخرین snapshot یک منطقه یا None"""
+        raise NotImplementedError
+
+    def put_snapshot(self, area_name, outages, fetched_at=None):
+        """ذخیره snapshot جدید یک منطقه و برگرداندن آن"""
+        raise NotImplementedError
+
+    def get_digest(self, area_name):
+        """digest آخرین snapshot یک منطقه یا None، بدون خواندن خاموشی‌ها"""
+        snapshot = self.get_snapshot(area_name)
+        return snapshot['digest'] if snapshot is not None else None
+
+    def get_value(self, key):
+        """دریافت مقدار کش شده یا None در صورت نبود/انقضا"""
+        raise NotImplementedError
+
+    def set_value(self, key, value, ttl=None):
+        """ذخیره مقدار قابل تبدیل به JSON با انقضای اختیاری (ثانیه)"""
+        raise NotImplementedError
+
+    def claim(self, key, ttl):
+        """ثبت یک‌باره کلید بین همه پردازه‌ها؛ True فقط برای اولین فراخوانی تا ttl ثانیه"""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """حذف مقدارها و claimهای منقضی شده؛ خروجی تعداد حذف شده"""
+        raise NotImplementedError
+
+    def acquire_leadership(self, worker_id, ttl):
+        """تلاش برای گرفتن/تمدید اجاره رهبری؛ True اگر این worker رهبر است"""
+        raise NotImplementedError
+
+    def release_leadership(self, worker_id):
+        """آزاد کردن اجاره رهبری اگر در اختیار این worker است"""
+        raise NotImplementedError
+
+    def add_subscription(self, chat_id, area_name, term):
+        """ثبت اشتراک یک چت روی فیدر یا کلمه کلیدی یک منطقه ('' برای کل منطقه)"""
+        raise NotImplementedError
+
+    def remove_subscriptions(self, chat_id, area_name=None, term=None):
+        """حذف همه اشتراک‌های یک چت یا فقط اشتراک‌های یک منطقه/یک کلمه؛ خروجی تعداد حذف شده"""
+        raise NotImplementedError
+
+    def subscriptions(self, chat_id=None, area_name=None):
+        """لیست (chat_id، منطقه، کلمه) اشتراک‌ها، در صورت نیاز فقط یک چت یا یک منطقه"""
+        raise NotImplementedError
+
+    def close(self):
+        """بستن منابع"""
+
+    def _make_snapshot(self, area_name, outages, fetched_at):
+        return {
+            'area': area_name,
+            'outages': outages,
+            'fetched_at': fetched_at if fetched_at is not None else time.time(),
+            'digest': snapshot_digest(outages),
+        }
+
+
+class MemorySnapshotStore(SnapshotStore):
+    """پیاده‌سازی محلی در حافظه برای اجرای تک‌پردازه‌ای
+
+    مقدارهای کش (نتایج جستجو و کد اشتراک) در یک LRU با بودجه max_value_bytes
+    نگه داشته می‌شوند تا در اجرای طولانی حافظه ثابت بماند.
+    """
+
+    def __init__(self, max_value_bytes=None):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._values = SnapshotCache(max_value_bytes or float('inf'))
+        self._leader = None
+        # کلیدهای claim جدا از کش LRU تا با حذف مقدارها دوباره قابل ثبت نشوند
+        self._claims = {}
+        # اشتراک‌ها برخلاف مقدارهای کش هرگز حذف خودکار نمی‌شوند
+        self._subscriptions = set()
+
+    def get_snapshot(self, area_name):
+        with self._lock:
+            return self._snapshots.get(area_name)
+
+    def get_digest(self, area_name):
+        with self._lock:
+            snapshot = self._snapshots.get(area_name)
+        return snapshot['digest'] if snapshot is not None else None
+
+    def put_snapshot(self, area_name, outages, fetched_at=None):
+        snapshot = self._make_snapshot(area_name, outages, fetched_at)
+        with self._lock:
+            self._snapshots[area_name] = snapshot
+        return snapshot
+
+    def get_value(self, key):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            self._values.pop(key)
+            return None
+        return value
+
+    def set_value(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._values.put(key, (value, expires_at))
+
+    def value_stats(self):
+        """آمار کش مقدارها (تعداد، حجم، hit/miss و حذف‌ها)"""
+        return self._values.stats()
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            self._claims = {name: expires_at for name, expires_at in self._claims.items() if expires_at > now}
+            if key in self._claims:
+                return False
+            self._claims[key] = now + ttl
+            return True
+
+    def purge_expired(self):
+        now = time.time()
+        removed = 0
+        for key in self._values.keys():
+            item = self._values.peek(key)
+            if item is not None and item[1] is not None and item[1] < now:
+                self._values.pop(key)
+                removed += 1
+        with self._lock:
+            claims = {name: expires_at for name, expires_at in self._claims.items() if expires_at > now}
+            removed += len(self._claims) - len(claims)
+            self._claims = claims
+        return removed
+
+    def acquire_leadership(self, worker_id, ttl):
+        now = time.time()
+        with self._lock:
+            if self._leader is None or self._leader[0] == worker_id or self._leader[1] < now:
+                self._leader = (worker_id, now + ttl)
+                return True
+            return False
+
+    def release_leadership(self, worker_id):
+        with self._lock:
+            if self._leader and self._leader[0] == worker_id:
+                self._leader = None
+
+    def add_subscription(self, chat_id, area_name, term):
+        with self._lock:
+            self._subscriptions.add((chat_id, area_name, term))
+
+    def remove_subscriptions(self, chat_id, area_name=None, term=None):
+        with self._lock:
+            removed = {
+                item for item in self._subscriptions
+                if item[0] == chat_id and area_name in (None, item[1]) and term in (None, item[2])
+            }
+            self._subscriptions -= removed
+            return len(removed)
+
+    def subscriptions(self, chat_id=None, area_name=None):
+        with self._lock:
+            return sorted(
+                item for item in self._subscriptions
+                if chat_id in (None, item[0]) and area_name in (None, item[1])
+            )
+
+
+class SQLiteSnapshotStore(SnapshotStore):
+    """ذخیره‌ساز مشترک بین چند پردازه روی SQLite در حالت WAL"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            area TEXT PRIMARY KEY,
+            fetched_at REAL NOT NULL,
+            digest TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at);
+        CREATE TABLE IF NOT EXISTS leader (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER NOT NULL,
+            area TEXT NOT NULL,
+            term TEXT NOT NULL,
+            PRIMARY KEY (chat_id, area, term)
+        );
+        CREATE INDEX IF NOT EXISTS subscriptions_area ON subscriptions (area);
+    """
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        """هر thread اتصال مستقل خود را دارد"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_snapshot(self, area_name):
+        row = self._connection().execute(
+            'SELECT fetched_at, digest, data FROM snapshots WHERE area = ?', (area_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'area': area_name,
+            'outages': json.loads(row[2]),
+            'fetched_at': row[0],
+            'digest': row[1],
+        }
+
+    def get_digest(self, area_name):
+        row = self._connection().execute(
+            'SELECT digest FROM snapshots WHERE area = ?', (area_name,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def put_snapshot(self, area_name, outages, fetched_at=None):
+        snapshot = self._make_snapshot(area_name, outages, fetched_at)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO snapshots (area, fetched_at, digest, data) VALUES (?, ?, ?, ?)',
+            (area_name, snapshot['fetched_at'], snapshot['digest'],
+             json.dumps(outages, ensure_ascii=False)),
+        )
+        return snapshot
+
+    def get_value(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM kv WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set_value(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+
+    def claim(self, key, ttl):
+        now = time.time()
+        conn = self._connection()
+        conn.execute('DELETE FROM kv WHERE key = ? AND expires_at < ?', (key, now))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(True), now + ttl),
+        )
+        return cursor.rowcount == 1
+
+    def purge_expired(self):
+        cursor = self._connection().execute(
+            'DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),)
+        )
+        return cursor.rowcount
+
+    def acquire_leadership(self, worker_id, ttl):
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT holder, expires_at FROM leader WHERE id = 1').fetchone()
+            if row is None or row[0] == worker_id or row[1] < now:
+                conn.execute(
+                    'INSERT OR REPLACE INTO leader (id, holder, expires_at) VALUES (1, ?, ?)',
+                    (worker_id, now + ttl),
+                )
+                conn.execute('COMMIT')
+                return True
+            conn.execute('ROLLBACK')
+            return False
+        except sqlite3.Error as e:
+            logger.error(f"خطا در تعیین رهبر: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            return False
+
+    def release_leadership(self, worker_id):
+        self._connection().execute('DELETE FROM leader WHERE id = 1 AND holder = ?', (worker_id,))
+
+    def add_subscription(self, chat_id, area_name, term):
+        self._connection().execute(
+            'INSERT OR IGNORE INTO subscriptions (chat_id, area, term) VALUES (?, ?, ?)',
+            (chat_id, area_name, term),
+        )
+
+    def remove_subscriptions(self, chat_id, area_name=None, term=None):
+        cursor = self._connection().execute(
+            'DELETE FROM subscriptions WHERE chat_id = ? AND (? IS NULL OR area = ?) AND (? IS NULL OR term = ?)',
+            (chat_id, area_name, area_name, term, term),
+        )
+        return cursor.rowcount
+
+    def subscriptions(self, chat_id=None, area_name=None):
+        rows = self._connection().execute(
+            'SELECT chat_id, area, term FROM subscriptions WHERE (? IS NULL OR chat_id = ?) AND (? IS NULL OR area = ?) '
+            'ORDER BY chat_id, area, term',
+            (chat_id, chat_id, area_name, area_name),
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
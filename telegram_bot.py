@@ -1,10 +1,46 @@
 import os
+import time
+import hashlib
+import socket
 import logging
 from datetime import datetime
+from collections import OrderedDict
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+)
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, ContextTypes
+)
+from telegram.error import Forbidden, BadRequest, RetryAfter
 from main import PowerOutageChecker
+from config import (
+    SNAPSHOT_TTL, PREFETCH_INTERVAL, LEADER_LEASE_TTL, KV_PURGE_INTERVAL, AREA_ALIASES, MESSAGES,
+    THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST,
+    SEARCH_CACHE_TTL, SUBSCRIBER_CACHE_TTL, ANALYTICS_HISTORY_GLOB,
+    INLINE_CACHE_TIME, INLINE_RESULTS_LIMIT, INLINE_CACHE_SIZE, PROFILE_DIR,
+    SEARCH_WORKERS, SEARCH_QUEUE_SIZE, INDEX_CACHE_BYTES, VALUE_CACHE_BYTES, STATE_SAVE_INTERVAL,
+    DIGEST_WINDOW, NOTIFY_CLAIM_TTL, SUBSCRIPTIONS_PER_CHAT, DEFAULT_CITY_CODE, DEFAULT_AREA_CODE,
+    LIVE_MESSAGE_TTL, LIVE_MESSAGES_LIMIT, LIVE_EDIT_RATE, LIVE_CHECK_INTERVAL
+)
+from snapshot_store import MemorySnapshotStore, SQLiteSnapshotStore
+from snapshot_file import MappedSnapshotStore
+from session_pool import build_session_pool, SessionPoolExhausted
+from prefetcher import SnapshotPrefetcher
+from poll_scheduler import build_scheduler
+from archive import ResponseArchive
+from profiling import PROFILER, profiled
+from outage_index import OutageIndex, parse_feeder_term, normalize_persian, outage_text, DIGITS_TRANSLATION
+from query_router import QueryRouter
+from rate_limit import RequestThrottler
+from search_queue import SearchQueue, SearchQueueFull
+from snapshot_cache import SnapshotCache
+from warm_state import WarmStateFile, StatePersister
+from notifications import DigestBatcher, diff_outages, subscription_matches
+from live_messages import LiveMessages, is_open_ended
+from analytics import OutageAnalytics
+from feeder_schedule import FeederSchedule
+from jalali import format_jalali_datetime, IRAN_TZ
 import pandas as pd
 
 # تنظیم logging
@@ -14,11 +50,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# حداکثر خاموشی‌های نمایش داده شده در یک پیام نتیجه
+MAX_RESULTS = 10
+
+LIVE_FOOTER = "🔄 تا اعلام ساعت پایان، این پیام با تغییر جدول خاموشی‌ها به‌روز می‌شود."
+
 class BlackoutTelegramBot:
-    def __init__(self, token):
+    def __init__(self, token, store=None, worker_id=None, archive=None, admin_ids=None, state_path=None, request=None):
         self.token = token
+        self.admin_ids = set(admin_ids or ())
         self.checker = PowerOutageChecker()
-        self.application = Application.builder().token(token).build()
+        # درخواست‌های همزمان به سایت هر کدام با session و tokenهای ViewState مستقل
+        self.sessions = build_session_pool()
+        builder = Application.builder().token(token).post_init(self.post_init).post_shutdown(self.post_shutdown)
+        if request is not None:
+            # BaseRequest جایگزین (مثلاً در load_test.py) به جای ارتباط واقعی با API تلگرام
+            builder = builder.request(request).get_updates_request(request)
+        self.application = builder.build()
         self.setup_handlers()
         
         # مناطق پیش‌فرض
@@ -29,16 +77,91 @@ class BlackoutTelegramBot:
             'قائم‌شهر': {'city_code': '990090348', 'area_code': '64'},
             'نوشهر': {'city_code': '990090349', 'area_code': '65'},
         }
+        
+        # با store مشترک چند worker داده‌ها را به اشتراک می‌گذارند و فقط رهبر از سایت می‌خواند
+        self.shared = store is not None
+        self.store = store if store is not None else MemorySnapshotStore(VALUE_CACHE_BYTES)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.prefetcher = SnapshotPrefetcher(
+            self.store,
+            self.default_areas,
+            self.worker_id,
+            interval=PREFETCH_INTERVAL,
+            lease_ttl=LEADER_LEASE_TTL,
+            checker=self.checker,
+            archive=archive,
+            scheduler=build_scheduler(self.default_areas),
+            sessions=self.sessions,
+            purge_interval=KV_PURGE_INTERVAL
+        )
+        
+        # ایندکس جستجوی snapshotها: (area_name, digest) -> OutageIndex؛ ایندکس جاری هر منطقه pin است
+        self.index_cache = SnapshotCache(INDEX_CACHE_BYTES)
+        
+        # نتایج آماده پرسش‌های inline: (digest, پرسش) -> لیست نتایج
+        self.inline_cache = OrderedDict()
+        self.warming_areas = set()
+        
+        # آمار تجمعی که با رسیدن هر snapshot جدید به‌روز می‌شود
+        self.analytics = OutageAnalytics()
+        self.schedule = FeederSchedule()
+        self.observed_digests = {}
+        history_area = self.find_area_name(DEFAULT_CITY_CODE, DEFAULT_AREA_CODE)
+        if history_area:
+            self.analytics.load_csv_history(ANALYTICS_HISTORY_GLOB, history_area)
+        self.prefetcher.add_listener(lambda area_name, snapshot, previous: self.observe_snapshot(area_name, snapshot))
+        
+        # تغییرات snapshotهای دریافت شده برای هر چت مشترک جمع و یک‌جا فرستاده می‌شوند؛
+        # snapshotهایی که پردازه دیگری (ربات یا API رهبر) نوشته از store تشخیص داده می‌شوند
+        self.digests = DigestBatcher(DIGEST_WINDOW)
+        self.digest_task = None
+        self.notified_snapshots = {}    # منطقه -> آخرین snapshot بررسی شده برای اعلان
+        self.prefetcher.add_listener(self.queue_notifications)
+        
+        # پیام‌های نتیجه با خاموشی بدون ساعت پایان به جای جستجوی دوباره کاربر در جا ویرایش می‌شوند
+        self.live_messages = LiveMessages(LIVE_MESSAGE_TTL, LIVE_MESSAGES_LIMIT, LIVE_EDIT_RATE)
+        self.live_task = None
+        
+        # تشخیص یک‌گذره منطقه/کلمات کلیدی و محدودسازی درخواست هر کاربر و چت
+        self.router = QueryRouter(self.default_areas, AREA_ALIASES)
+        self.throttler = RequestThrottler(
+            THROTTLE_USER_RATE, THROTTLE_USER_BURST,
+            THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST
+        )
+        
+        # همه جستجوها از یک صف محدود با worker ثابت می‌گذرند؛ جستجوهای یکسان ادغام می‌شوند
+        self.search_queue = SearchQueue(SEARCH_WORKERS, SEARCH_QUEUE_SIZE)
+        self.area_fetches = {}
+        
+        # وضعیت ذخیره شده پیش از توقف قبلی: ربات از همان ابتدا با snapshotها و ایندکس‌ها پاسخ می‌دهد
+        self.restored_areas = set()
+        self.persister = None
+        if state_path:
+            state_file = WarmStateFile(state_path)
+            self.restore_state(state_file.load())
+            self.persister = StatePersister(state_file, self.collect_state, STATE_SAVE_INTERVAL)
     
     def setup_handlers(self):
-        """تنظیم handlers برای bot"""
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("search", self.search_command))
-        self.application.add_handler(CommandHandler("areas", self.areas_command))
-        self.application.add_handler(CommandHandler("latest", self.latest_command))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        """تنظیم handlers برای bot (هر handler در صورت فعال بودن پروفایل، پروفایل می‌شود)"""
+        commands = {
+            "start": self.start_command,
+            "help": self.help_command,
+            "search": self.search_command,
+            "areas": self.areas_command,
+            "latest": self.latest_command,
+            "subscriber": self.subscriber_command,
+            "stats": self.stats_command,
+            "next": self.next_command,
+            "subscribe": self.subscribe_command,
+            "unsubscribe": self.unsubscribe_command,
+            "profile": self.profile_command,
+            "cache": self.cache_command,
+        }
+        for command, callback in commands.items():
+            self.application.add_handler(CommandHandler(command, PROFILER.wrap(callback)))
+        self.application.add_handler(CallbackQueryHandler(PROFILER.wrap(self.button_callback)))
+        self.application.add_handler(InlineQueryHandler(PROFILER.wrap(self.inline_query)))
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, PROFILER.wrap(self.handle_message)))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور شروع"""
@@ -53,6 +176,10 @@ class BlackoutTelegramBot:
 /search - جستجوی خاموشی
 /areas - لیست مناطق
 /latest - آخرین خاموشی‌ها
+/subscriber - جستجو با کد اشتراک
+/stats - آمار خاموشی‌ها
+/next - خاموشی بعدی یک فیدر
+/subscribe - اعلان تغییرات یک فیدر
 
 💡 **نحوه استفاده:**
 - برای جستجو: `/search منطقه کلمه_کلیدی`
@@ -72,7 +199,7 @@ class BlackoutTelegramBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
+        await update.effective_message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور راهنما"""
@@ -91,17 +218,39 @@ class BlackoutTelegramBot:
 📋 **آخرین خاموشی‌ها:**
 - `/latest` - نمایش آخرین خاموشی‌های ثبت شده
 
+🔢 **کد اشتراک:**
+- `/subscriber کد_اشتراک` - خاموشی‌های مربوط به کنتور شما
+- `/subscriber` - تکرار آخرین کد اشتراک وارد شده
+
+📊 **آمار:**
+- `/stats` - آمار همه مناطق
+- `/stats ساری` - آمار منطقه و پرخاموشی‌ترین فیدرها
+- `/stats ساری 53` - آمار یک فیدر
+
+⏭ **خاموشی بعدی:**
+- `/next ساری 53` - زمان خاموشی اعلام شده یا برآورد شده بعدی فیدر
+
+🔔 **اعلان تغییرات:**
+- `/subscribe ساری 53` - اعلان خاموشی‌های جدید، تغییر ساعت یا لغو فیدر 53
+- `/subscribe ساری شهاب نیا` - اعلان برای یک کلمه کلیدی
+- `/subscribe` - لیست اشتراک‌های این چت
+- `/unsubscribe ساری 53` یا `/unsubscribe` برای لغو همه
+- تغییرات چند دقیقه جمع و در یک پیام فرستاده می‌شوند
+
 💡 **جستجوی سریع:**
 - فقط نام منطقه را تایپ کنید: "ساری"
 - یا کلمه کلیدی: "شهاب نیا"
 - یا ترکیبی: "ساری شهاب"
 
+⌨️ **حالت inline:**
+- در هر چتی تایپ کنید: `@نام_ربات شهاب نیا`
+
 ⚙️ **نکات مهم:**
 - از کلمات فارسی استفاده کنید
 - برای جستجوی دقیق‌تر، نام منطقه + کلمه کلیدی را ترکیب کنید
 - نتایج شامل تاریخ، زمان شروع/پایان، منطقه و توضیحات است
         """
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await update.effective_message.reply_text(help_text, parse_mode='Markdown')
     
     async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور جستجو"""
@@ -132,26 +281,350 @@ class BlackoutTelegramBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(areas_text, reply_markup=reply_markup, parse_mode='Markdown')
+        await update.effective_message.reply_text(areas_text, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def latest_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """نمایش آخرین خاموشی‌ها"""
-        await update.message.reply_text("🔍 در حال دریافت آخرین خاموشی‌ها...")
+        await update.effective_message.reply_text("🔍 در حال دریافت آخرین خاموشی‌ها...")
         
         try:
             # دریافت خاموشی‌ها از ساری (پیش‌فرض)
-            html_content = self.checker.search_outages()
-            if html_content:
-                outages = self.checker.parse_outages(html_content)
-                if outages:
-                    await self.send_outages_result(update, context, outages, "آخرین خاموشی‌های ساری")
-                else:
-                    await update.message.reply_text("❌ هیچ خاموشی‌ای در حال حاضر یافت نشد.")
+            outages = await self.get_area_outages("ساری")
+            if outages is None:
+                await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات خاموشی‌ها")
+            elif outages:
+                await self.send_outages_result(update, context, outages, "آخرین خاموشی‌های ساری")
             else:
-                await update.message.reply_text("❌ خطا در دریافت اطلاعات خاموشی‌ها")
+                await update.effective_message.reply_text("❌ هیچ خاموشی‌ای در حال حاضر یافت نشد.")
         except Exception as e:
             logger.error(f"خطا در دریافت آخرین خاموشی‌ها: {e}")
-            await update.message.reply_text("❌ خطا در دریافت اطلاعات")
+            await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات")
+    
+    async def subscriber_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """جستجوی خاموشی‌ها با کد اشتراک"""
+        user_key = f"user_subscriber:{update.effective_user.id}"
+        if context.args:
+            subscriber_code = ''.join(context.args).translate(DIGITS_TRANSLATION)
+        else:
+            subscriber_code = self.store.get_value(user_key)
+            if not subscriber_code:
+                await update.effective_message.reply_text("💡 نحوه استفاده: `/subscriber کد_اشتراک`", parse_mode='Markdown')
+                return
+        
+        if not subscriber_code.isdigit():
+            await update.effective_message.reply_text("❌ کد اشتراک باید فقط شامل رقم باشد.")
+            return
+        
+        if not self.throttler.allow(update.effective_user.id, update.effective_chat.id):
+            await update.effective_message.reply_text(MESSAGES['throttled'])
+            return
+        
+        self.store.set_value(user_key, subscriber_code, ttl=SUBSCRIBER_CACHE_TTL)
+        
+        try:
+            outages = await self.lookup_subscriber(subscriber_code)
+            if outages is None:
+                await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات خاموشی‌ها")
+            elif outages:
+                await self.send_outages_result(update, context, outages, f"خاموشی‌های کد اشتراک {subscriber_code}")
+            else:
+                await update.effective_message.reply_text(f"✅ خاموشی‌ای برای کد اشتراک {subscriber_code} ثبت نشده است.")
+        except Exception as e:
+            logger.error(f"خطا در جستجوی کد اشتراک: {e}")
+            await update.effective_message.reply_text("❌ خطا در انجام جستجو")
+    
+    async def lookup_subscriber(self, subscriber_code):
+        """خاموشی‌های یک کد اشتراک؛ با نگاشت کش شده فقط از ایندکس محلی پاسخ داده می‌شود
+
+        منطقه از کد شهر پاسخ سایت (که امور برق را انتخاب نمی‌کند) یا از فیدرهای
+        نگاشت در ایندکس‌های موجود پیدا می‌شود. فقط کد اشتراکی که هنوز فیدر
+        شناخته شده‌ای ندارد (بدون خاموشی در پاسخ‌های قبلی) از سایت پرسیده می‌شود.
+        """
+        mapping_key = f"subscriber:{subscriber_code}"
+        result_key = f"subscriber_outages:{subscriber_code}"
+        
+        mapping = self.store.get_value(mapping_key)
+        if mapping and mapping['feeders']:
+            area_name = (self.find_area_name(mapping.get('city_code'), mapping.get('area_code'))
+                         or self.find_feeder_area(mapping['feeders']))
+            if area_name:
+                index = await self.get_area_index(area_name)
+                if index is not None:
+                    return [outage for feeder in mapping['feeders'] for outage in index.feeder_outages(feeder)]
+        
+        # منطقه نامشخص یا بدون فیدر: نتیجه اخیر همین کد اشتراک
+        cached = self.store.get_value(result_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            resolved = await asyncio.to_thread(self.sessions.call, 'resolve_subscriber', subscriber_code)
+        except SessionPoolExhausted as e:
+            logger.warning(f"جستجوی کد اشتراک انجام نشد: {e}")
+            resolved = None
+        if resolved is None:
+            return None
+        
+        outages = resolved.pop('outages')
+        if not resolved['feeders'] and mapping:
+            # پاسخ بدون خاموشی فیدر را مشخص نمی‌کند؛ فیدرهای شناخته شده قبلی حفظ می‌شوند
+            resolved['feeders'] = mapping['feeders']
+        self.store.set_value(mapping_key, resolved, ttl=SUBSCRIBER_CACHE_TTL)
+        self.store.set_value(result_key, outages, ttl=SNAPSHOT_TTL)
+        return outages
+    
+    def find_area_name(self, city_code, area_code=None):
+        """نام منطقه متناظر با کدهای شهر و امور برق یا None
+
+        بدون area_code (پاسخ جستجوی کد اشتراک فقط شهر را انتخاب می‌کند) منطقه
+        فقط وقتی برگردانده می‌شود که تنها منطقه آن شهر باشد.
+        """
+        matches = [
+            area_name for area_name, area_info in self.default_areas.items()
+            if area_info['city_code'] == city_code and area_code in (None, area_info['area_code'])
+        ]
+        return matches[0] if len(matches) == 1 else None
+    
+    def find_feeder_area(self, feeders):
+        """تنها منطقه‌ای که snapshot موجودش خاموشی همه فیدرها را دارد، بدون درخواست به سایت"""
+        matches = []
+        for area_name in self.default_areas:
+            index, _ = self.cached_area_index(area_name)
+            if index is not None and all(index.feeder_outages(feeder) for feeder in feeders):
+                matches.append(area_name)
+        return matches[0] if len(matches) == 1 else None
+    
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """نمایش آمار خاموشی‌ها از جدول‌های از پیش محاسبه شده"""
+        area_name, terms = self.router.route(' '.join(context.args or []))
+        feeder = next((parse_feeder_term(term) for term in terms or [] if parse_feeder_term(term)), None)
+        
+        if feeder:
+            area_name = area_name or "ساری"
+            stats = self.analytics.feeder_stats(area_name, feeder)
+            if not stats:
+                await update.effective_message.reply_text(f"❌ آماری برای فیدر {feeder} در {area_name} ثبت نشده است.")
+                return
+            await update.effective_message.reply_text(self.format_stats(f"آمار فیدر {feeder} - {area_name}", stats), parse_mode='Markdown')
+            return
+        
+        if area_name:
+            stats = self.analytics.area_stats(area_name)
+            if not stats:
+                await update.effective_message.reply_text(f"❌ آماری برای {area_name} ثبت نشده است.")
+                return
+            text = self.format_stats(f"آمار خاموشی‌های {area_name}", stats)
+            top = self.analytics.top_feeders(area_name)
+            if top:
+                text += "\n🔝 **بیشترین مدت خاموشی:**\n"
+                for feeder_number, feeder_stats in top:
+                    text += f"• فیدر {feeder_number}: {feeder_stats['total_minutes']:.0f} دقیقه در {feeder_stats['frequency']} نوبت\n"
+            await update.effective_message.reply_text(text, parse_mode='Markdown')
+            return
+        
+        if not self.analytics.area_table:
+            await update.effective_message.reply_text("❌ هنوز آماری ثبت نشده است.")
+            return
+        text = ""
+        for name, stats in self.analytics.area_table.items():
+            text += self.format_stats(f"آمار خاموشی‌های {name}", stats) + "\n"
+        await update.effective_message.reply_text(text, parse_mode='Markdown')
+    
+    async def next_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """زمان خاموشی بعدی یک فیدر از جدول از پیش ساخته شده"""
+        area_name, terms = self.router.route(' '.join(context.args or []))
+        feeder = next((parse_feeder_term(term) for term in terms or [] if parse_feeder_term(term)), None)
+        if not feeder:
+            await update.effective_message.reply_text("💡 نحوه استفاده: `/next ساری 53`", parse_mode='Markdown')
+            return
+        area_name = area_name or "ساری"
+        
+        # جدول منطقه با اولین snapshot مشاهده شده ساخته می‌شود
+        if area_name not in self.observed_digests:
+            await self.get_area_snapshot(area_name)
+        
+        now = time.time()
+        announced, estimate = self.schedule.next_outage(area_name, feeder, now)
+        if announced is None and estimate is None:
+            await update.effective_message.reply_text(f"✅ خاموشی‌ای برای فیدر {feeder} در {area_name} اعلام یا پیش‌بینی نشده است.")
+            return
+        
+        text = f"⏭ **خاموشی بعدی فیدر {feeder} - {area_name}**\n\n"
+        if announced is not None:
+            start_at = datetime.fromtimestamp(announced.start, IRAN_TZ)
+            end_text = datetime.fromtimestamp(announced.end, IRAN_TZ).strftime('%H:%M') if announced.end else "نامشخص"
+            kind = "با برنامه" if announced.planned else "بی برنامه"
+            if announced.start <= now:
+                text += f"🔴 هم‌اکنون خاموش است ({kind})، پایان: {end_text}\n"
+            else:
+                text += f"📅 {format_jalali_datetime(start_at)} تا {end_text} ({kind})\n"
+        if estimate is not None:
+            estimate_at = datetime.fromtimestamp(estimate, IRAN_TZ)
+            text += f"🔮 برآورد بر اساس تاریخچه: {format_jalali_datetime(estimate_at)}\n"
+        await update.effective_message.reply_text(text, parse_mode='Markdown')
+    
+    def subscription_terms(self, args):
+        """(منطقه، کلمات اشتراک) از ورودی دستور؛ هر شماره فیدر یک اشتراک جدا است"""
+        area_name, terms = self.router.route(' '.join(args))
+        terms = terms or []
+        feeders = [parse_feeder_term(term) for term in terms if parse_feeder_term(term)]
+        return area_name or "ساری", feeders or ([' '.join(terms)] if terms else [])
+    
+    def describe_subscription(self, area_name, term):
+        if parse_feeder_term(term):
+            return f"فیدر {term} - {area_name}"
+        return f"«{term}» - {area_name}" if term else f"همه خاموشی‌های {area_name}"
+    
+    async def subscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """ثبت اشتراک تغییرات یک فیدر یا کلمه کلیدی، یا نمایش اشتراک‌های چت"""
+        chat_id = update.effective_chat.id
+        if not context.args:
+            subscriptions = self.store.subscriptions(chat_id=chat_id)
+            if not subscriptions:
+                await update.effective_message.reply_text("💡 نحوه استفاده: `/subscribe ساری 53`", parse_mode='Markdown')
+                return
+            text = "🔔 **اشتراک‌های این چت:**\n\n"
+            for _, area_name, term in subscriptions:
+                text += f"• {self.describe_subscription(area_name, term)}\n"
+            await update.effective_message.reply_text(text, parse_mode='Markdown')
+            return
+        
+        area_name, terms = self.subscription_terms(context.args)
+        if not terms:
+            terms = ['']
+        current = {(area, term) for _, area, term in self.store.subscriptions(chat_id=chat_id)}
+        if len(current | {(area_name, term) for term in terms}) > SUBSCRIPTIONS_PER_CHAT:
+            await update.effective_message.reply_text(f"❌ هر چت حداکثر {SUBSCRIPTIONS_PER_CHAT} اشتراک می‌تواند داشته باشد.")
+            return
+        
+        for term in terms:
+            self.store.add_subscription(chat_id, area_name, term)
+        # در اجرای تک‌پردازه‌ای دریافت دوره‌ای با اولین اشتراک شروع می‌شود
+        if self.application.running:
+            self.prefetcher.start()
+        
+        described = '، '.join(self.describe_subscription(area_name, term) for term in terms)
+        await update.effective_message.reply_text(
+            f"✅ اشتراک {described} ثبت شد.\n"
+            f"تغییرات هر {max(1, DIGEST_WINDOW // 60)} دقیقه در یک پیام فرستاده می‌شوند."
+        )
+    
+    async def unsubscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """لغو همه اشتراک‌های چت، اشتراک‌های یک منطقه یا یک فیدر/کلمه"""
+        chat_id = update.effective_chat.id
+        if not context.args:
+            removed = self.store.remove_subscriptions(chat_id)
+            self.digests.discard(chat_id)
+        else:
+            area_name, terms = self.subscription_terms(context.args)
+            if terms:
+                removed = sum(self.store.remove_subscriptions(chat_id, area_name, term) for term in terms)
+            else:
+                removed = self.store.remove_subscriptions(chat_id, area_name)
+        
+        if removed:
+            await update.effective_message.reply_text(f"✅ {removed} اشتراک لغو شد.")
+        else:
+            await update.effective_message.reply_text("❌ اشتراکی با این مشخصات پیدا نشد.")
+    
+    def queue_notifications(self, area_name, snapshot, previous):
+        """افزودن تغییرات snapshot جدید به خلاصه چت‌های مشترک
+
+        هم listener پردازه‌ای که از سایت می‌خواند و هم بررسی دوره‌ای store آن را
+        صدا می‌زنند؛ با claim در store هر snapshot فقط یک بار در کل workerها اعلان می‌شود.
+        """
+        self.notified_snapshots[area_name] = snapshot
+        if previous is None or previous['digest'] == snapshot['digest']:
+            return
+        if not self.store.claim(f"notify:{area_name}:{snapshot['fetched_at']}", NOTIFY_CLAIM_TTL):
+            return
+        subscriptions = self.store.subscriptions(area_name=area_name)
+        if not subscriptions:
+            return
+        
+        changes = diff_outages(previous['outages'], snapshot['outages'])
+        chat_terms = {}
+        for chat_id, _, term in subscriptions:
+            chat_terms.setdefault(chat_id, []).append(term)
+        now = time.time()
+        for chat_id, terms in chat_terms.items():
+            for before, after in changes:
+                if any(subscription_matches(term, before) or subscription_matches(term, after) for term in terms):
+                    self.digests.add(chat_id, area_name, before, after, now)
+    
+    def check_snapshot_changes(self):
+        """تشخیص snapshotهای جدید store که این پردازه ننوشته (فقط digest خوانده می‌شود)"""
+        for area_name in self.default_areas:
+            seen = self.notified_snapshots.get(area_name)
+            digest = self.store.get_digest(area_name)
+            if digest is None or (seen is not None and seen['digest'] == digest):
+                continue
+            snapshot = self.store.get_snapshot(area_name)
+            if snapshot is not None:
+                self.queue_notifications(area_name, snapshot, seen)
+    
+    async def digest_loop(self):
+        """تشخیص تغییرات store و ارسال خلاصه تغییرات چت‌هایی که پنجره‌شان بسته شده"""
+        while True:
+            await asyncio.sleep(5)
+            try:
+                await asyncio.to_thread(self.check_snapshot_changes)
+            except Exception as e:
+                logger.error(f"خطا در بررسی تغییرات snapshotها: {e}")
+            for chat_id, events in self.digests.due(time.time()):
+                await self.send_digest(chat_id, events)
+    
+    async def send_digest(self, chat_id, events):
+        try:
+            await self.application.bot.send_message(chat_id, self.format_digest(events), parse_mode='Markdown')
+        except Forbidden:
+            # ربات توسط کاربر مسدود یا از گروه حذف شده است
+            logger.info(f"اشتراک‌های چت {chat_id} پس از مسدود شدن ربات حذف شد")
+            self.store.remove_subscriptions(chat_id)
+        except Exception as e:
+            logger.error(f"خطا در ارسال خلاصه تغییرات به {chat_id}: {e}")
+    
+    def format_digest(self, events):
+        """متن یک پیام خلاصه از لیست (منطقه، قبل، بعد)"""
+        text = "🔔 **تغییرات خاموشی‌های اشتراک شما**\n\n"
+        for position, (area_name, before, after) in enumerate(events):
+            if before is None:
+                section = f"🆕 **خاموشی جدید - {area_name}**\n" + self.format_outage(after)
+            elif after is None:
+                section = f"❌ **حذف از جدول - {area_name}**\n" + self.format_outage(before)
+            else:
+                section = f"✏️ **تغییر - {area_name}**\n" + self.format_outage(after)
+                for field, label in (('date', 'تاریخ'), ('start_time', 'شروع'), ('end_time', 'پایان')):
+                    if before.get(field) != after.get(field):
+                        section += f"↩️ {label} قبلی: {before.get(field, 'نامشخص')}\n"
+            section += "\n"
+            if len(text) + len(section) > 4000:
+                text += f"… و {len(events) - position} تغییر دیگر"
+                break
+            text += section
+        return text
+    
+    async def post_init(self, application):
+        loop = asyncio.get_running_loop()
+        self.digest_task = loop.create_task(self.digest_loop())
+        self.live_task = loop.create_task(self.live_update_loop())
+    
+    async def post_shutdown(self, application):
+        for task in (self.digest_task, self.live_task):
+            if task is not None:
+                task.cancel()
+        self.digest_task = self.live_task = None
+    
+    def format_stats(self, title, stats):
+        """قالب‌بندی یک ردیف از جدول آمار"""
+        text = f"📊 **{title}**\n"
+        text += f"🔢 تعداد خاموشی: {stats['frequency']}\n"
+        text += f"⏱ مجموع مدت: {stats['total_minutes'] / 60:.1f} ساعت\n"
+        if stats['mean_minutes'] == stats['mean_minutes']:  # NaN وقتی مدت هیچ خاموشی معلوم نیست
+            text += f"⏳ میانگین مدت: {stats['mean_minutes']:.0f} دقیقه\n"
+        text += f"🕘 ساعت رایج شروع: {stats['typical_start_hour']:02d}:00\n"
+        text += f"⚡ سهم بی‌برنامه: {stats['unplanned_share'] * 100:.0f}٪\n"
+        return text
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پردازش پیام‌های متنی"""
@@ -171,7 +644,7 @@ class BlackoutTelegramBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "🔍 **انتخاب منطقه برای جستجو:**\n\n"
             "یکی از مناطق زیر را انتخاب کنید یا برای جستجوی آزاد کلیک کنید:",
             reply_markup=reply_markup,
@@ -203,138 +676,504 @@ class BlackoutTelegramBot:
                 "مثال: شهاب نیا، خیابان امام، و غیره"
             )
     
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """روشن/خاموش کردن پروفایل درخواست‌ها (فقط ادمین‌ها)"""
+        if update.effective_user.id not in self.admin_ids:
+            return
+        
+        action = context.args[0] if context.args else ''
+        if action == 'on':
+            PROFILER.enable(context.args[1] if len(context.args) > 1 else PROFILER.directory or PROFILE_DIR)
+        elif action == 'off':
+            PROFILER.disable()
+        elif action:
+            await update.effective_message.reply_text("💡 نحوه استفاده: `/profile on [مسیر]` یا `/profile off`", parse_mode='Markdown')
+            return
+        
+        state = f"فعال ({PROFILER.directory})" if PROFILER.enabled else "غیرفعال"
+        await update.effective_message.reply_text(f"🩺 پروفایل: {state}")
+    
+    async def cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """آمار کش‌ها و صف جستجو (فقط ادمین‌ها)"""
+        if update.effective_user.id not in self.admin_ids:
+            return
+        
+        caches = {'ایندکس‌ها': self.index_cache.stats()}
+        if hasattr(self.store, 'value_stats'):
+            caches['مقدارها'] = self.store.value_stats()
+        
+        text = "🧮 **آمار کش‌ها**\n\n"
+        for name, stats in caches.items():
+            limit = f"{stats['max_bytes'] / 1048576:.0f}" if stats['max_bytes'] != float('inf') else "∞"
+            text += f"• {name}: {stats['entries']} ورودی ({stats['pinned']} pin)، "
+            text += f"{stats['bytes'] / 1048576:.1f} از {limit} MB، "
+            text += f"hit {stats['hits']} / miss {stats['misses']}، حذف {stats['evictions']}\n"
+        queue = self.search_queue.stats()
+        text += f"• صف جستجو: {queue['pending']} در انتظار، {queue['coalesced']} ادغام، {queue['shed']} رد شده\n"
+        text += f"• نتایج inline: {len(self.inline_cache)} پرسش\n"
+        live = self.live_messages.stats()
+        text += f"• پیام‌های زنده: {live['messages']} پیام، {live['edited']} ویرایش، {live['pending_edits']} در انتظار، {live['superseded']} ادغام\n"
+        sessions = self.sessions.stats()
+        text += f"• sessionهای سایت: {sessions['in_use']} در حال استفاده از {sessions['open']} (حداکثر {sessions['size']})، "
+        text += f"{sessions['requests']} درخواست، {sessions['failures']} خطا، {sessions['recycled']} جایگزینی\n"
+        digests = self.digests.stats()
+        text += f"• اعلان‌ها: {digests['events']} تغییر، {digests['collapsed']} ادغام، {digests['digests']} پیام، {digests['pending_chats']} چت در انتظار\n"
+        if self.prefetcher.scheduler is not None:
+            text += "\n⏱️ **زمان‌بندی دریافت**\n"
+            for area_name, (rate, interval) in self.prefetcher.scheduler.describe(time.time()).items():
+                text += f"• {area_name}: هر {interval / 60:.1f} دقیقه ({rate:.2f} تغییر در ساعت)\n"
+        await update.effective_message.reply_text(text, parse_mode='Markdown')
+    
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """پاسخ به پرسش inline (@bot شهاب نیا) فقط از ایندکس snapshot موجود
+
+        این پرسش‌ها با هر کلید فشرده شده فرستاده می‌شوند، پس هرگز منتظر سایت
+        نمی‌مانند؛ نبود snapshot فقط یک دریافت پس‌زمینه را آغاز می‌کند. کلید کش
+        از digest منطقه ساخته می‌شود و snapshot فقط با تغییر digest خوانده می‌شود.
+        """
+        inline = update.inline_query
+        area_name, terms = self.router.route(inline.query)
+        area_name = area_name or "ساری"
+        
+        digest = self.store.get_digest(area_name)
+        if digest is None:
+            self.warm_area(area_name)
+            await inline.answer([], cache_time=0)
+            return
+        
+        query = normalize_persian(' '.join(terms or []))
+        cache_key = (digest, area_name, query)
+        results = self.inline_cache.get(cache_key)
+        if results is None:
+            index, digest = self.cached_area_index(area_name)
+            if index is None:
+                await inline.answer([], cache_time=0)
+                return
+            cache_key = (digest, area_name, query)
+            outages = index.prefix_search(query, limit=INLINE_RESULTS_LIMIT)
+            results = self.build_inline_results(outages, area_name)
+            self.inline_cache[cache_key] = results
+            if len(self.inline_cache) > INLINE_CACHE_SIZE:
+                self.inline_cache.popitem(last=False)
+        else:
+            self.inline_cache.move_to_end(cache_key)
+        
+        await inline.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+    
+    def build_inline_results(self, outages, area_name):
+        """ساخت نتایج inline؛ شناسه هر نتیجه از محتوای خاموشی ساخته می‌شود"""
+        results = []
+        seen = set()
+        for outage in outages:
+            result_id = hashlib.md5(outage_text(outage).encode('utf-8')).hexdigest()
+            if result_id in seen:
+                continue
+            seen.add(result_id)
+            feeder = outage.get('feeder')
+            title = f"فیدر {feeder} - {area_name}" if feeder else area_name
+            results.append(InlineQueryResultArticle(
+                id=result_id,
+                title=f"{title} | {outage.get('date', '')} {outage.get('start_time', '')}-{outage.get('end_time', '')}",
+                description=outage.get('description', '')[:100],
+                input_message_content=InputTextMessageContent(
+                    f"🔌 **{title}**\n\n{self.format_outage(outage)}", parse_mode='Markdown'
+                )
+            ))
+        return results
+    
+    def warm_area(self, area_name):
+        """دریافت پس‌زمینه snapshot منطقه بدون منتظر ماندن (هر منطقه یک بار همزمان)"""
+        if area_name in self.warming_areas:
+            return
+        self.warming_areas.add(area_name)
+        task = asyncio.get_running_loop().create_task(self.get_area_snapshot(area_name))
+        task.add_done_callback(lambda _: self.warming_areas.discard(area_name))
+    
     async def perform_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
         """انجام جستجو"""
-        await update.message.reply_text(f"🔍 در حال جستجو برای: **{query}**")
+        # تشخیص منطقه و کلمات کلیدی از query
+        area_name, search_terms = self.router.route(query)
+        if area_name is None:
+            # جستجو در ساری (پیش‌فرض)
+            area_name = "ساری"
+        cache_key = f"search:{area_name}:{'|'.join(search_terms or [])}"
+        
+        # درخواست‌های بیش از حد فقط از کش پاسخ می‌گیرند
+        user = update.effective_user
+        chat = update.effective_chat
+        if not self.throttler.allow(user.id if user else None, chat.id if chat else None):
+            cached = self.store.get_value(cache_key)
+            if cached:
+                await self.send_search_reply(update, context, cached)
+            else:
+                await update.effective_message.reply_text(MESSAGES['throttled'])
+            return
         
+        # جستجوهای یکسان در انتظار یک کار مشترک می‌شوند؛ صف پر یعنی پاسخ از کش یا رد درخواست
         try:
-            # تشخیص منطقه از query
-            area_info = self.detect_area_from_query(query)
-            
-            if area_info:
-                # جستجو در منطقه خاص
-                html_content = self.checker.search_outages(
-                    city_code=area_info['city_code'],
-                    area_code=area_info['area_code']
-                )
-                area_name = area_info['area_name']
+            future, position = self.search_queue.submit(
+                cache_key, lambda: self.build_search_reply(area_name, search_terms, cache_key)
+            )
+        except SearchQueueFull:
+            cached = self.store.get_value(cache_key)
+            if cached:
+                await self.send_search_reply(update, context, cached)
             else:
-                # جستجو در ساری (پیش‌فرض)
-                html_content = self.checker.search_outages()
-                area_name = "ساری"
-            
-            if html_content:
-                # جستجوی کلمات کلیدی در نتایج
-                search_terms = self.extract_search_terms(query)
-                if search_terms:
-                    # بررسی وجود کلمات کلیدی
-                    found = self.checker.check_specific_outage(html_content, search_terms)
-                    if not found:
-                        await update.message.reply_text(
-                            f"❌ هیچ خاموشی‌ای با کلمات کلیدی '{', '.join(search_terms)}' در {area_name} یافت نشد."
-                        )
-                        return
+                await update.effective_message.reply_text(MESSAGES['overloaded'])
+            return
+        
+        if position:
+            await update.effective_message.reply_text(f"⏳ جستجوی **{query}** در صف قرار گرفت، نوبت {position}")
+        else:
+            await update.effective_message.reply_text(f"🔍 در حال جستجو برای: **{query}**")
+        
+        try:
+            reply = await future
+            if reply is not None:
+                live = 'outages' in reply and any(is_open_ended(outage) for outage in reply['outages'][:MAX_RESULTS])
+                messages = await self.send_search_reply(update, context, reply, footer=LIVE_FOOTER if live else None)
+                if live and len(messages) == 1:
+                    self.track_live_message(messages[0], area_name, search_terms, reply)
+            else:
+                await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات خاموشی‌ها")
                 
-                # تجزیه نتایج
-                outages = self.checker.parse_outages(html_content)
+        except Exception as e:
+            logger.error(f"خطا در جستجو: {e}")
+            await update.effective_message.reply_text("❌ خطا در انجام جستجو")
+    
+    async def build_search_reply(self, area_name, search_terms, cache_key):
+        """ساخت و کش پاسخ یک جستجو (لیست خاموشی‌ها یا پیام متنی)؛ None یعنی خطا در دریافت"""
+        snapshot = await self.get_area_snapshot(area_name)
+        if snapshot is None:
+            return None
+        
+        reply = self.search_reply(self.index_for_snapshot(area_name, snapshot), area_name, search_terms)
+        reply['digest'] = snapshot['digest']
+        self.store.set_value(cache_key, reply, ttl=SEARCH_CACHE_TTL)
+        return reply
+    
+    def search_reply(self, index, area_name, search_terms):
+        """پاسخ یک جستجو از ایندکس snapshot: {'outages', 'title'} یا {'text'}"""
+        outages = index.outages
+        if outages:
+            # فیلتر کردن نتایج بر اساس کلمات کلیدی، مرتبط‌ترین و در حال اجرا اول
+            if search_terms:
+                filtered_outages = index.ranked_search(search_terms)
+                similar = []
+                if not filtered_outages:
+                    # املای متفاوت نام خیابان: نزدیک‌ترین نتایج به ترتیب شباهت
+                    text_terms = [term for term in search_terms if not parse_feeder_term(term)]
+                    if text_terms:
+                        similar = [outage for outage, _ in index.fuzzy_search(' '.join(text_terms))]
                 
-                if outages:
-                    # فیلتر کردن نتایج بر اساس کلمات کلیدی
-                    if search_terms:
-                        filtered_outages = self.filter_outages_by_terms(outages, search_terms)
-                        if filtered_outages:
-                            await self.send_outages_result(update, context, filtered_outages, f"نتایج جستجو در {area_name}")
-                        else:
-                            await update.message.reply_text(
-                                f"❌ هیچ خاموشی‌ای با کلمات کلیدی '{', '.join(search_terms)}' در {area_name} یافت نشد."
-                            )
-                    else:
-                        await self.send_outages_result(update, context, outages, f"تمام خاموشی‌های {area_name}")
+                if filtered_outages:
+                    reply = {'outages': filtered_outages, 'title': f"نتایج جستجو در {area_name}"}
+                elif similar:
+                    reply = {'outages': similar, 'title': f"نتایج مشابه در {area_name}"}
                 else:
-                    await update.message.reply_text(f"❌ هیچ خاموشی‌ای در {area_name} یافت نشد.")
+                    reply = {'text': f"❌ هیچ خاموشی‌ای با کلمات کلیدی '{', '.join(search_terms)}' در {area_name} یافت نشد."}
             else:
-                await update.message.reply_text("❌ خطا در دریافت اطلاعات خاموشی‌ها")
-                
+                # لیست معمولی تا پاسخ در کش store (JSON) ذخیره شود، حتی برای snapshot نگاشته شده
+                reply = {'outages': list(outages), 'title': f"تمام خاموشی‌های {area_name}"}
+        else:
+            reply = {'text': f"❌ هیچ خاموشی‌ای در {area_name} یافت نشد."}
+        return reply
+    
+    async def send_search_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE, reply, footer=None):
+        """ارسال پاسخ جستجو (لیست خاموشی‌ها یا پیام متنی)؛ خروجی پیام‌های فرستاده شده"""
+        if 'text' in reply:
+            return [await update.effective_message.reply_text(reply['text'])]
+        return await self.send_outages_result(update, context, reply['outages'], reply['title'], footer=footer)
+    
+    def track_live_message(self, message, area_name, search_terms, reply):
+        """ثبت پیام نتیجه برای ویرایش با تغییر snapshot منطقه"""
+        key = (area_name, tuple(search_terms or ()))
+        body = self.render_outages_result(reply['outages'], reply['title'])
+        self.live_messages.register(message.chat_id, message.message_id, key, reply.get('digest'), body)
+        # در اجرای تک‌پردازه‌ای snapshotها فقط با دریافت دوره‌ای تازه می‌شوند
+        if self.application.running:
+            self.prefetcher.start()
+    
+    def refresh_live_messages(self):
+        """ساخت دوباره متن پیام‌های زنده مناطقی که snapshot آن‌ها عوض شده است"""
+        for area_name in self.live_messages.areas():
+            snapshot = self.store.get_snapshot(area_name)
+            if snapshot is None:
+                continue
+            stale = self.live_messages.stale(area_name, snapshot['digest'])
+            if not stale:
+                continue
+            
+            index = self.index_for_snapshot(area_name, snapshot)
+            updated_at = datetime.now(IRAN_TZ).strftime('%H:%M')
+            for (_, terms), refs in stale.items():
+                reply = self.search_reply(index, area_name, list(terms))
+                if 'text' in reply:
+                    body, finished = reply['text'], True
+                else:
+                    body = self.render_outages_result(reply['outages'], reply['title'])
+                    finished = not any(is_open_ended(outage) for outage in reply['outages'][:MAX_RESULTS])
+                footer = "✅ به‌روزرسانی خودکار این پیام پایان یافت." if finished else LIVE_FOOTER
+                text = f"{body.rstrip()}\n\n{footer}\n🕘 به‌روز شده در {updated_at}"
+                for ref in refs:
+                    if len(text) > 4096:
+                        # نتیجه جدید در یک پیام جا نمی‌شود؛ پیام قبلی دست نمی‌خورد
+                        self.live_messages.forget(ref)
+                    else:
+                        self.live_messages.refresh(ref, snapshot['digest'], body, text, finished)
+    
+    async def live_update_loop(self):
+        """بررسی دوره‌ای snapshotها و ارسال ویرایش‌های صف با رعایت محدودیت نرخ تلگرام"""
+        last_check = 0
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            if now - last_check >= LIVE_CHECK_INTERVAL:
+                last_check = now
+                try:
+                    self.refresh_live_messages()
+                except Exception as e:
+                    logger.error(f"خطا در به‌روزرسانی پیام‌های زنده: {e}")
+            for chat_id, message_id, text in self.live_messages.take_edits():
+                await self.apply_live_edit(chat_id, message_id, text)
+    
+    async def apply_live_edit(self, chat_id, message_id, text):
+        try:
+            await self.application.bot.edit_message_text(
+                text, chat_id=chat_id, message_id=message_id, parse_mode='Markdown'
+            )
+        except RetryAfter as e:
+            logger.warning(f"محدودیت نرخ تلگرام: ویرایش‌ها {e.retry_after} ثانیه متوقف شدند")
+            self.live_messages.retry_after(chat_id, message_id, text, float(e.retry_after))
+        except BadRequest as e:
+            # «message is not modified» بی‌اثر است؛ پیام حذف شده یا قدیمی دیگر دنبال نمی‌شود
+            if 'not modified' not in str(e).lower():
+                self.live_messages.forget((chat_id, message_id))
+        except Forbidden:
+            self.live_messages.forget((chat_id, message_id))
         except Exception as e:
-            logger.error(f"خطا در جستجو: {e}")
-            await update.message.reply_text("❌ خطا در انجام جستجو")
+            logger.error(f"خطا در ویرایش پیام {message_id} در {chat_id}: {e}")
+    
+    def collect_state(self):
+        """snapshotهای جاری، ایندکس آن‌ها و tokenهای sessionهای سایت برای ذخیره"""
+        snapshots = {}
+        indexes = {}
+        for area_name in self.default_areas:
+            snapshot = self.store.get_snapshot(area_name)
+            if snapshot is None:
+                continue
+            # ایندکس snapshot نگاشته شده در فایل آن است؛ pickle آن ایندکس حافظه کامل می‌سازد
+            snapshots[area_name] = {key: value for key, value in snapshot.items() if key != 'index'}
+            index = self.index_cache.peek((area_name, snapshot['digest']))
+            if index is not None:
+                indexes[area_name] = (snapshot['digest'], index)
+        state = {'snapshots': snapshots, 'indexes': indexes, 'sessions': self.sessions.export_state()}
+        if self.prefetcher.scheduler is not None:
+            state['scheduler'] = self.prefetcher.scheduler.export_state()
+        if not self.shared:
+            # store مشترک اشتراک‌ها را خودش نگه می‌دارد
+            state['subscriptions'] = self.store.subscriptions()
+        return state
+    
+    def restore_state(self, state):
+        """بازگرداندن وضعیت ذخیره شده با collect_state (snapshotهای جدیدتر store حفظ می‌شوند)"""
+        if not state:
+            return
+        for area_name, saved in state['snapshots'].items():
+            if area_name not in self.default_areas:
+                continue
+            current = self.store.get_snapshot(area_name)
+            if current is None or current['fetched_at'] < saved['fetched_at']:
+                current = self.store.put_snapshot(area_name, saved['outages'], fetched_at=saved['fetched_at'])
+            self.restored_areas.add(area_name)
+            self.observe_snapshot(area_name, current)
+            
+            digest, index = state['indexes'].get(area_name, (None, None))
+            if digest == current['digest']:
+                self.index_cache.put((area_name, digest), index, pin_group=area_name)
+        self.sessions.restore_state(state['sessions'])
+        if self.prefetcher.scheduler is not None:
+            self.prefetcher.scheduler.restore_state(state.get('scheduler'))
+        if not self.shared:
+            for chat_id, area_name, term in state.get('subscriptions', []):
+                self.store.add_subscription(chat_id, area_name, term)
+        logger.info(f"وضعیت {len(self.restored_areas)} منطقه بازیابی شد")
+    
+    async def get_area_snapshot(self, area_name):
+        """دریافت snapshot منطقه از store و در صورت قدیمی بودن، از سایت
+
+        در حالت چند worker فقط رهبر از سایت می‌خواند و بقیه آخرین snapshot
+        موجود در store را برمی‌گردانند. با زمان‌بند تطبیقی دریافت فقط وقتی انجام
+        می‌شود که منطقه در بودجه سررسید شده باشد. None یعنی هیچ داده‌ای در دسترس نیست.
+        """
+        snapshot = self.store.get_snapshot(area_name)
+        if snapshot and time.time() - snapshot['fetched_at'] < SNAPSHOT_TTL:
+            self.observe_snapshot(area_name, snapshot)
+            return snapshot
+        
+        if snapshot and area_name in self.restored_areas:
+            # اولین استفاده از snapshot بازیابی شده: پاسخ فوری و به‌روزرسانی در پس‌زمینه
+            self.restored_areas.discard(area_name)
+            self.warm_area(area_name)
+            return snapshot
+        
+        if (not self.shared or self.prefetcher.is_leader) and self.prefetcher.on_demand_allowed(area_name, snapshot):
+            fresh = await self.fetch_area_once(area_name)
+            if fresh:
+                return fresh
+        
+        if snapshot:
+            self.observe_snapshot(area_name, snapshot)
+        return snapshot
+    
+    async def fetch_area_once(self, area_name):
+        """دریافت snapshot منطقه از سایت؛ درخواست‌های همزمان یک منطقه منتظر همان دریافت می‌مانند"""
+        task = self.area_fetches.get(area_name)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.prefetcher.fetch_area, area_name))
+            self.area_fetches[area_name] = task
+            task.add_done_callback(lambda _: self.area_fetches.pop(area_name, None))
+        # shield: لغو یک منتظر نباید دریافت مشترک را لغو کند
+        return await asyncio.shield(task)
+    
+    def observe_snapshot(self, area_name, snapshot):
+        """ثبت هر snapshot جدید (بر اساس digest) در آمار"""
+        if self.observed_digests.get(area_name) == snapshot['digest']:
+            return
+        self.observed_digests[area_name] = snapshot['digest']
+        self.analytics.add_snapshot(area_name, snapshot['outages'])
+        self.schedule.rebuild_area(area_name, snapshot['outages'], self.analytics)
+    
+    async def get_area_outages(self, area_name):
+        """دریافت لیست خاموشی‌های منطقه یا None"""
+        snapshot = await self.get_area_snapshot(area_name)
+        return snapshot['outages'] if snapshot else None
+    
+    async def get_area_index(self, area_name):
+        """ایندکس جستجوی snapshot جاری منطقه؛ فقط با تغییر snapshot دوباره ساخته می‌شود"""
+        snapshot = await self.get_area_snapshot(area_name)
+        if snapshot is None:
+            return None
+        return self.index_for_snapshot(area_name, snapshot)
+    
+    def index_for_snapshot(self, area_name, snapshot):
+        """ایندکس یک snapshot با استفاده دوباره از ایندکس ساخته شده برای همان digest"""
+        if 'index' in snapshot:
+            # snapshot نگاشته شده از فایل (SNAPSHOT_MMAP_DIR) ایندکس آماده خود را دارد
+            return snapshot['index']
+        key = (area_name, snapshot['digest'])
+        index = self.index_cache.get(key)
+        if index is None:
+            index = OutageIndex(snapshot['outages'])
+            self.index_cache.put(key, index, pin_group=area_name)
+        return index
+    
+    def cached_area_index(self, area_name):
+        """(ایندکس، digest) آخرین snapshot موجود در store، حتی قدیمی، بدون درخواست به سایت
+
+        اگر ایندکس digest جاری ساخته شده باشد snapshot از store خوانده نمی‌شود.
+        """
+        digest = self.store.get_digest(area_name)
+        if digest is None:
+            return None, None
+        index = self.index_cache.get((area_name, digest))
+        if index is not None:
+            return index, digest
+        snapshot = self.store.get_snapshot(area_name)
+        if snapshot is None:
+            return None, None
+        return self.index_for_snapshot(area_name, snapshot), snapshot['digest']
     
     def detect_area_from_query(self, query):
         """تشخیص منطقه از query"""
-        query_lower = query.lower()
-        
-        for area_name, area_info in self.default_areas.items():
-            if area_name.lower() in query_lower:
-                return {
-                    'area_name': area_name,
-                    'city_code': area_info['city_code'],
-                    'area_code': area_info['area_code']
-                }
+        area_name, _ = self.router.route(query)
+        if area_name is None:
+            return None
         
-        return None
+        area_info = self.default_areas[area_name]
+        return {
+            'area_name': area_name,
+            'city_code': area_info['city_code'],
+            'area_code': area_info['area_code']
+        }
     
     def extract_search_terms(self, query):
         """استخراج کلمات کلیدی از query"""
-        # حذف نام مناطق از query
-        query_clean = query
-        for area_name in self.default_areas.keys():
-            query_clean = query_clean.replace(area_name, '').strip()
-        
-        # تقسیم به کلمات کلیدی
-        terms = [term.strip() for term in query_clean.split() if term.strip()]
-        return terms if terms else None
+        _, terms = self.router.route(query)
+        return terms
     
     def filter_outages_by_terms(self, outages, search_terms):
         """فیلتر کردن خاموشی‌ها بر اساس کلمات کلیدی"""
-        filtered = []
-        
-        for outage in outages:
-            outage_text = ' '.join(str(v) for v in outage.values()).lower()
-            for term in search_terms:
-                if term.lower() in outage_text:
-                    filtered.append(outage)
-                    break
-        
-        return filtered
+        return OutageIndex(outages).search(search_terms)
     
-    async def send_outages_result(self, update: Update, context: ContextTypes.DEFAULT_TYPE, outages, title):
-        """ارسال نتایج خاموشی‌ها"""
+    @profiled
+    async def send_outages_result(self, update: Update, context: ContextTypes.DEFAULT_TYPE, outages, title, footer=None):
+        """ارسال نتایج خاموشی‌ها؛ خروجی پیام‌های فرستاده شده"""
         if not outages:
-            await update.message.reply_text("❌ هیچ نتیجه‌ای یافت نشد.")
-            return
+            return [await update.effective_message.reply_text("❌ هیچ نتیجه‌ای یافت نشد.")]
         
+        result_text = self.render_outages_result(outages, title)
+        if footer:
+            result_text = f"{result_text.rstrip()}\n\n{footer}"
+        
+        # تقسیم پیام اگر خیلی طولانی است
+        if len(result_text) > 4096:
+            chunks = [result_text[i:i+4096] for i in range(0, len(result_text), 4096)]
+            return [await update.effective_message.reply_text(chunk, parse_mode='Markdown') for chunk in chunks]
+        return [await update.effective_message.reply_text(result_text, parse_mode='Markdown')]
+    
+    def render_outages_result(self, outages, title):
+        """متن پیام نتایج (حداکثر MAX_RESULTS خاموشی)"""
         # محدود کردن تعداد نتایج
-        max_results = 10
-        if len(outages) > max_results:
-            outages = outages[:max_results]
-            title += f" (نمایش {max_results} نتیجه اول)"
+        if len(outages) > MAX_RESULTS:
+            outages = outages[:MAX_RESULTS]
+            title += f" (نمایش {MAX_RESULTS} نتیجه اول)"
         
         result_text = f"🔌 **{title}**\n\n"
         
         for i, outage in enumerate(outages, 1):
             result_text += f"**{i}. خاموشی:**\n"
-            result_text += f"📅 تاریخ: {outage.get('date', 'نامشخص')}\n"
-            result_text += f"⏰ شروع: {outage.get('start_time', 'نامشخص')}\n"
-            result_text += f"⏰ پایان: {outage.get('end_time', 'نامشخص')}\n"
-            result_text += f"📍 منطقه: {outage.get('region', 'نامشخص')}\n"
-            result_text += f"📝 توضیحات: {outage.get('description', 'نامشخص')}\n"
+            result_text += self.format_outage(outage)
             result_text += "─" * 30 + "\n\n"
         
-        if len(outages) == max_results:
-            result_text += f"⚠️ فقط {max_results} نتیجه اول نمایش داده شد."
-        
-        # تقسیم پیام اگر خیلی طولانی است
-        if len(result_text) > 4096:
-            chunks = [result_text[i:i+4096] for i in range(0, len(result_text), 4096)]
-            for chunk in chunks:
-                await update.message.reply_text(chunk, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(result_text, parse_mode='Markdown')
+        if len(outages) == MAX_RESULTS:
+            result_text += f"⚠️ فقط {MAX_RESULTS} نتیجه اول نمایش داده شد."
+        return result_text
+    
+    def format_outage(self, outage):
+        """متن جزئیات یک خاموشی"""
+        text = f"📅 تاریخ: {outage.get('date', 'نامشخص')}\n"
+        text += f"⏰ شروع: {outage.get('start_time', 'نامشخص')}\n"
+        text += f"⏰ پایان: {outage.get('end_time', 'نامشخص')}\n"
+        text += f"📍 منطقه: {outage.get('region', 'نامشخص')}\n"
+        text += f"📝 توضیحات: {outage.get('description', 'نامشخص')}\n"
+        return text
     
-    def run(self):
+    def run(self, webhook_url=None, webhook_port=8443):
         """اجرای bot"""
-        logger.info("شروع ربات خاموشی‌های برق...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info(f"شروع ربات خاموشی‌های برق (worker {self.worker_id})...")
+        # بدون store مشترک دریافت دوره‌ای فقط برای اعلان به مشترکان لازم است
+        if self.shared or self.store.subscriptions():
+            self.prefetcher.start()
+        if self.persister:
+            self.persister.start()
+        
+        try:
+            if webhook_url:
+                # چند worker پشت یک reverse proxy فقط در حالت webhook ممکن است
+                self.application.run_webhook(
+                    listen='0.0.0.0',
+                    port=webhook_port,
+                    url_path=self.token,
+                    webhook_url=f"{webhook_url.rstrip('/')}/{self.token}",
+                    allowed_updates=Update.ALL_TYPES
+                )
+            else:
+                self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        finally:
+            self.prefetcher.stop()
+            if self.persister:
+                self.persister.stop()
 
 def main():
     """تابع اصلی"""
@@ -346,9 +1185,30 @@ def main():
         print("لطفاً token ربات خود را در متغیر محیطی TELEGRAM_BOT_TOKEN تنظیم کنید.")
         return
     
-    # ایجاد و اجرای bot
-    bot = BlackoutTelegramBot(token)
-    bot.run()
+    # store مشترک برای اجرای چند worker (SQLite در حالت WAL)
+    snapshot_db = os.getenv('SNAPSHOT_DB')
+    store = SQLiteSnapshotStore(snapshot_db) if snapshot_db else None
+    # snapshotها و ایندکس‌ها در فایل‌هایی که همه workerها mmap می‌کنند منتشر می‌شوند
+    mmap_dir = os.getenv('SNAPSHOT_MMAP_DIR')
+    if store is not None and mmap_dir:
+        store = MappedSnapshotStore(store, mmap_dir)
+    
+    # بایگانی اختیاری پاسخ‌های دریافت شده توسط prefetcher
+    archive_dir = os.getenv('ARCHIVE_DIR')
+    archive = ResponseArchive(archive_dir) if archive_dir else None
+    
+    # ادمین‌ها (شناسه‌های عددی جدا شده با کاما) می‌توانند پروفایل را با /profile روشن کنند
+    admin_ids = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
+    
+    # ایجاد و اجرای bot (با STATE_FILE وضعیت برای شروع دوباره ذخیره و بازیابی می‌شود)
+    bot = BlackoutTelegramBot(
+        token, store=store, worker_id=os.getenv('WORKER_ID'), archive=archive,
+        admin_ids=admin_ids, state_path=os.getenv('STATE_FILE')
+    )
+    bot.run(
+        webhook_url=os.getenv('WEBHOOK_URL'),
+        webhook_port=int(os.getenv('WEBHOOK_PORT', '8443'))
+    )
 
 if __name__ == "__main__":
     main()
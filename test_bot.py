@@ -6,14 +6,43 @@ This script tests the bot functionality without actually running the bot
 
 import os
 import sys
+import glob
+import gzip
+import json
+import tempfile
 from unittest.mock import Mock, patch
 import asyncio
+import requests
 
 # Add current directory to path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from main import PowerOutageChecker
-from config import AREAS, MESSAGES
+from main import PowerOutageChecker, OutageStreamParser
+from config import AREAS, MESSAGES, AREA_ALIASES
+from snapshot_store import SQLiteSnapshotStore, MemorySnapshotStore
+from query_router import QueryRouter
+from outage_index import OutageIndex, split_description
+from analytics import OutageAnalytics
+from jalali import jalali_to_gregorian, gregorian_to_jalali, IRAN_TZ
+from feeder_schedule import FeederSchedule
+from datetime import datetime
+from rate_limit import RequestThrottler
+from archive import ResponseArchive, extract_grid
+from profiling import Profiler
+from search_queue import SearchQueue, SearchQueueFull
+from snapshot_cache import SnapshotCache
+from parsers import verify_backends
+import warm_state
+from warm_state import WarmStateFile
+from api_server import OutageAPI
+from ical_feeds import CalendarFeeds
+from poll_scheduler import AdaptivePollScheduler
+from notifications import DigestBatcher, diff_outages
+from live_messages import LiveMessages
+from session_pool import SessionPool, SessionPoolExhausted
+from prefetcher import SnapshotPrefetcher
+from snapshot_file import MappedSnapshotStore
+from load_test import run_load_test, parse_mix
 
 def test_power_outage_checker():
     """تست کلاس PowerOutageChecker"""
@@ -35,6 +64,1293 @@ def test_power_outage_checker():
         print(f"❌ خطا در تست PowerOutageChecker: {e}")
         return False
 
+def test_stream_parser():
+    """تست یکسان بودن خروجی تجزیه‌گر افزایشی با parse_outages"""
+    print("\n🌊 تست تجزیه‌گر افزایشی...")
+    
+    try:
+        checker = PowerOutageChecker()
+        fixtures = sorted(glob.glob('raw_response_*.html'))
+        
+        for fixture in fixtures:
+            with open(fixture, encoding='utf-8') as f:
+                html_content = f.read()
+            expected = checker.parse_outages(html_content)
+            
+            # ارسال تکه‌های کوچک برای شبیه‌سازی دریافت تدریجی
+            parser = OutageStreamParser()
+            streamed = []
+            for i in range(0, len(html_content), 37):
+                parser.feed(html_content[i:i + 37])
+                streamed.extend(parser.drain())
+            parser.close()
+            streamed.extend(parser.drain())
+            
+            if streamed != expected:
+                print(f"❌ {fixture}: {len(streamed)} != {len(expected)}")
+                return False
+            print(f"✅ {fixture}: {len(streamed)} خاموشی")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست تجزیه‌گر افزایشی: {e}")
+        return False
+
+def test_streamed_search():
+    """تست iter_outages با پاسخ تکه‌ای ساختگی: تکرار با tokenهای تازه و تحویل پیش از پایان پاسخ"""
+    print("\n📡 تست دریافت تدریجی...")
+    
+    try:
+        from unittest.mock import MagicMock
+        import time
+        from main import run_job
+        
+        fixture = sorted(glob.glob('raw_response_*.html'))[-1]
+        with open(fixture, encoding='utf-8') as f:
+            html_content = f.read()
+        checker = PowerOutageChecker()
+        expected = checker.parse_outages(html_content)
+        
+        consumed = []
+        
+        def chunked_response(text):
+            response = MagicMock(status_code=200, encoding='utf-8')
+            
+            def iter_content(chunk_size, decode_unicode):
+                for i in range(0, len(text), 500):
+                    consumed.append(i)
+                    yield text[i:i + 500]
+            response.iter_content.side_effect = iter_content
+            return response
+        
+        # tokenهای کش شده رد می‌شوند و درخواست با tokenهای تازه تکرار می‌شود
+        checker.form_tokens = {'__VIEWSTATE': 'old', '__VIEWSTATEGENERATOR': '', '__EVENTVALIDATION': ''}
+        checker.form_tokens_at = time.time() - 60
+        checker.get_initial_data = Mock(return_value={'__VIEWSTATE': 'new', '__VIEWSTATEGENERATOR': '', '__EVENTVALIDATION': ''})
+        checker.session.post = Mock(side_effect=lambda url, data, stream, timeout: chunked_response(
+            html_content if data['__VIEWSTATE'] == 'new' else '0|error|500|Invalid viewstate|'
+        ))
+        
+        outages = checker.iter_outages()
+        first = next(outages)
+        if len(consumed) >= len(html_content) // 500 or first != expected[0]:
+            print("❌ اولین خاموشی پیش از پایان پاسخ تحویل نشد")
+            return False
+        if [first] + list(outages) != expected or checker.session.post.call_count != 2:
+            print("❌ خاموشی‌های دریافت تدریجی با parse_outages یکسان نیست")
+            return False
+        print(f"✅ {len(expected)} خاموشی پس از تکرار با tokenهای تازه، اولی پس از {len(consumed) - 1} تکه")
+        
+        # کار دسته‌ای هم از همان مسیر تدریجی استفاده می‌کند
+        result = run_job(checker, {'id': 1, 'city_code': '1', 'area_code': '2', 'terms': ['شهاب نیا']})
+        if result['outage_count'] != len(expected) or result['matches'] != [o for o in expected if checker.outage_matches(o, ['شهاب نیا'])]:
+            print(f"❌ نتیجه کار دسته‌ای نادرست: {result['outage_count']}")
+            return False
+        path = os.path.join(tempfile.mkdtemp(), 'outages.csv')
+        if checker.save_stream_to_csv(checker.iter_outages(), path) != len(expected):
+            print("❌ ذخیره تدریجی CSV کامل نبود")
+            return False
+        print("✅ کار دسته‌ای و CSV تدریجی")
+        
+        # قطع اتصال در میانه پاسخ به ذخیره CSV می‌رسد و فایل ناقص موفق گزارش نمی‌شود
+        def broken_response(url, data, stream, timeout):
+            response = chunked_response(html_content)
+            
+            def iter_content(chunk_size, decode_unicode):
+                yield html_content[:len(html_content) // 2]
+                raise requests.exceptions.ChunkedEncodingError('connection reset')
+            response.iter_content.side_effect = iter_content
+            return response
+        checker.session.post = Mock(side_effect=broken_response)
+        try:
+            checker.save_stream_to_csv(checker.iter_outages(), path)
+            print("❌ قطع اتصال میانه پاسخ پنهان ماند")
+            return False
+        except requests.exceptions.ChunkedEncodingError:
+            pass
+        print("✅ خطای میانه پاسخ به فراخواننده می‌رسد")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست دریافت تدریجی: {e}")
+        return False
+
+def test_batch_jobs():
+    """تست خواندن فایل کارها، تطبیق فیدر در run_job و کد خروج run_batch"""
+    print("\n🗂️ تست اجرای دسته‌ای...")
+    
+    try:
+        from main import load_jobs, run_job, run_batch
+        
+        class FakeChecker(PowerOutageChecker):
+            """checker ساختگی که به جای سایت خاموشی‌های ثابت برمی‌گرداند"""
+            
+            def stream_outages(self, city_code='', area_code='', date_from='', date_to='', chunk_size=8192, raw=None):
+                if area_code == 'bad':
+                    return None
+                return iter([
+                    {'date': '1404/05/16', 'feeder': '153', 'description': '153- کوچه گلزار'},
+                    {'date': '1404/05/16', 'feeder': '53', 'description': '53- شهاب نیا'},
+                ])
+        
+        directory = tempfile.mkdtemp()
+        jobs_path = os.path.join(directory, 'jobs.jsonl')
+        area_name = next(iter(AREAS))
+        with open(jobs_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'area': area_name, 'terms': ['53']}, ensure_ascii=False) + '\n')
+            f.write('# توضیح\n')
+            f.write(json.dumps({'id': 'x', 'city_code': '1', 'area_code': '2', 'terms': 'گلزار'}, ensure_ascii=False) + '\n')
+        jobs = load_jobs(jobs_path)
+        if [job['id'] for job in jobs] != [1, 'x'] or jobs[0]['area_code'] != AREAS[area_name]['area_code'] or jobs[1]['terms'] != ['گلزار']:
+            print(f"❌ فایل کارها درست خوانده نشد: {jobs}")
+            return False
+        
+        for content, expected in (('{"city_code": "1", "area_code": "2"}\n[1, 2]\n', 'خط 2'), ('{"city_code": \n', 'خط 1'),
+                                  ('{"terms": ["53"]}\n', 'خط 1')):
+            bad_path = os.path.join(directory, 'bad.jsonl')
+            with open(bad_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            try:
+                load_jobs(bad_path)
+                print(f"❌ خط نامعتبر پذیرفته شد: {content!r}")
+                return False
+            except ValueError as e:
+                if expected not in str(e):
+                    print(f"❌ شماره خط در خطا نیامده: {e}")
+                    return False
+        print("✅ خواندن فایل کارها و گزارش خط نامعتبر")
+        
+        # فیدر ۵۳ با فیدر ۱۵۳ منطبق نیست، مثل جستجوی ربات و run_check
+        result = run_job(FakeChecker(), jobs[0])
+        if not result['ok'] or result['outage_count'] != 2 or [m['feeder'] for m in result['matches']] != ['53']:
+            print(f"❌ تطبیق فیدر در کار دسته‌ای نادرست: {result}")
+            return False
+        print("✅ تطبیق فیدر مثل run_check")
+        
+        # کد خروج: ۰ برای موفقیت همه، ۱ برای خطای جزئی، ۲ برای فایل نامعتبر
+        output = os.path.join(directory, 'results.jsonl')
+        with patch('session_pool.build_session_pool', side_effect=lambda size: SessionPool(size, FakeChecker)):
+            codes = [run_batch(jobs_path, output, workers=2)]
+            with open(output, encoding='utf-8') as f:
+                results = [json.loads(line) for line in f]
+            with open(jobs_path, 'a', encoding='utf-8') as f:
+                f.write('{"city_code": "1", "area_code": "bad"}\n')
+            codes.append(run_batch(jobs_path, output, workers=2))
+            codes.append(run_batch(bad_path, output))
+        if codes != [0, 1, 2] or sorted(str(r['id']) for r in results) != ['1', 'x']:
+            print(f"❌ کد خروج یا نتایج اجرای دسته‌ای نادرست: {codes}")
+            return False
+        print("✅ کد خروج اجرای دسته‌ای")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست اجرای دسته‌ای: {e}")
+        return False
+
+def test_parser_backends():
+    """تست یکسان بودن خروجی همه backendهای تجزیه روی فایل‌های نمونه"""
+    print("\n🧩 تست backendهای تجزیه...")
+    
+    try:
+        fixtures = sorted(glob.glob('raw_response_*.html'))
+        if not fixtures:
+            print("⚠️ فایل نمونه پاسخ سایت پیدا نشد")
+            return True
+        
+        for name, (elapsed, mismatches) in verify_backends(fixtures).items():
+            if mismatches:
+                print(f"❌ {name} با html.parser یکسان نیست: {mismatches}")
+                return False
+            print(f"✅ {name}: {elapsed * 1000:.1f} ms برای {len(fixtures)} فایل")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست backendهای تجزیه: {e}")
+        return False
+
+def test_feeder_index():
+    """تست استخراج شماره فیدر و ایندکس فیدرها"""
+    print("\n🔢 تست ایندکس فیدرها...")
+    
+    try:
+        feeder, localities = split_description('۵۳- شهاب نیا، کوچه های گلزار و ایثار')
+        if feeder != '53' or localities != ['شهاب نیا', 'کوچه های گلزار', 'ایثار']:
+            print(f"❌ تجزیه توضیحات نادرست: {feeder} {localities}")
+            return False
+        print("✅ استخراج شماره فیدر و محله‌ها")
+        
+        checker = PowerOutageChecker()
+        with open('raw_response_20250807_152211.html', encoding='utf-8') as f:
+            outages = checker.parse_outages(f.read())
+        index = OutageIndex(outages)
+        
+        expected = [o for o in outages if o['description'].startswith('53-')]
+        if index.feeder_outages('53') != expected or index.feeder_outages('۵۳') != expected:
+            print("❌ جستجوی فیدر ۵۳ نادرست است")
+            return False
+        print(f"✅ فیدر ۵۳: {len(expected)} خاموشی")
+        
+        # شماره فیدر نباید با اعداد داخل آدرس‌ها اشتباه گرفته شود
+        if index.feeder_outages('999'):
+            print("❌ فیدر ناموجود پیدا شد")
+            return False
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست ایندکس فیدرها: {e}")
+        return False
+
+def test_subscriber_lookup():
+    """تست یافتن منطقه و فیدرهای کد اشتراک و پاسخ تکرارها از ایندکس محلی"""
+    print("\n🧾 تست جستجوی کد اشتراک...")
+    
+    try:
+        import time
+        from telegram_bot import BlackoutTelegramBot
+        
+        checker = PowerOutageChecker()
+        bot = BlackoutTelegramBot('1000000:TEST')
+        fixtures = sorted(glob.glob('raw_response_*.html'))
+        for fixture in fixtures:
+            with open(fixture, encoding='utf-8') as f:
+                location = checker.extract_selected_location(f.read())
+            # پاسخ سایت فقط شهر را انتخاب می‌کند و امور برق روی «-1» می‌ماند
+            if location != {'city_code': AREAS['ساری']['city_code']} or bot.find_area_name(location['city_code']) != 'ساری':
+                print(f"❌ منطقه {fixture} تشخیص داده نشد: {location}")
+                return False
+        print(f"✅ منطقه {len(fixtures)} پاسخ نمونه از کد شهر")
+        
+        with open(fixtures[-1], encoding='utf-8') as f:
+            html_content = f.read()
+        outages = checker.parse_outages(html_content)
+        checker.search_by_subscriber_code = Mock(return_value=html_content)
+        resolved = checker.resolve_subscriber('123456')
+        feeders = list(dict.fromkeys(outage['feeder'] for outage in outages if outage.get('feeder')))
+        if (resolved['city_code'], resolved['area_code'], resolved['feeders']) != (AREAS['ساری']['city_code'], None, feeders) \
+                or resolved['outages'] != outages:
+            print(f"❌ نتیجه resolve_subscriber نادرست: {resolved['city_code']} {resolved['feeders']}")
+            return False
+        print("✅ resolve_subscriber")
+        
+        # اولین جستجو از سایت، تکرار پس از انقضای نتیجه از ایندکس snapshot محلی
+        feeder_53 = [outage for outage in outages if outage.get('feeder') == '53']
+        bot.sessions.call = Mock(return_value={
+            'subscriber_code': '123456', 'city_code': AREAS['ساری']['city_code'], 'area_code': None,
+            'feeders': ['53'], 'outages': feeder_53,
+        })
+        bot.store.put_snapshot('ساری', outages, fetched_at=time.time())
+        first = asyncio.run(bot.lookup_subscriber('123456'))
+        bot.store.set_value('subscriber_outages:123456', None)
+        added = {'date': '1404/05/17', 'start_time': '08:00', 'end_time': '10:00', 'description': '53- شهاب نیا', 'feeder': '53'}
+        bot.store.put_snapshot('ساری', outages + [added], fetched_at=time.time())
+        second = asyncio.run(bot.lookup_subscriber('123456'))
+        if first != feeder_53 or second != feeder_53 + [added] or bot.sessions.call.call_count != 1:
+            print(f"❌ تکرار جستجو از ایندکس محلی پاسخ داده نشد ({bot.sessions.call.call_count} درخواست)")
+            return False
+        
+        # بدون کد شهر منطقه از فیدرهای snapshotهای موجود پیدا می‌شود
+        bot.store.set_value('subscriber:123456', {'subscriber_code': '123456', 'city_code': None, 'area_code': None, 'feeders': ['53']})
+        if asyncio.run(bot.lookup_subscriber('123456')) != feeder_53 + [added] or bot.sessions.call.call_count != 1:
+            print("❌ منطقه از فیدرهای ایندکس پیدا نشد")
+            return False
+        print("✅ تکرار جستجوی کد اشتراک از ایندکس محلی")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست جستجوی کد اشتراک: {e}")
+        return False
+
+def test_fuzzy_search():
+    """تست جستجوی تقریبی با املاهای مختلف نام خیابان"""
+    print("\n🔤 تست جستجوی تقریبی...")
+    
+    try:
+        outages = [
+            {'description': '53- شهاب نیا (حر 6 تا 14)'},
+            {'description': '31- فیضیه 2، گلستان های 3'},
+            {'description': '41- چهار راه شهدا'},
+        ]
+        index = OutageIndex(outages)
+        
+        for query, expected in [('شهابنیا', 0), ('شهاب‌نیا', 0), ('شهاب نيا', 0), ('فیظیه', 1)]:
+            results = index.fuzzy_search(query)
+            if not results or results[0][0] is not outages[expected]:
+                print(f"❌ '{query}' پیدا نشد")
+                return False
+            print(f"✅ '{query}' -> {results[0][0]['description']}")
+        
+        if index.fuzzy_search('بلوار طالقانی'):
+            print("❌ نتیجه نامرتبط برگردانده شد")
+            return False
+        
+        # جستجوی هنگام تایپ: کلمه آخر ناقص است
+        for query, expected in [('شه', [0, 2]), ('شهاب ن', [0]), ('گلستان ه', [1]), ('شهاب چهار', [])]:
+            results = index.prefix_search(query)
+            if results != [outages[i] for i in expected]:
+                print(f"❌ جستجوی پیشوندی '{query}' نادرست: {results}")
+                return False
+        print("✅ جستجوی پیشوندی")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست جستجوی تقریبی: {e}")
+        return False
+
+def test_search_ranking():
+    """تست رتبه‌بندی نتایج: کلمه دقیق، فیدر دقیق و خاموشی در حال اجرا اول"""
+    print("\n🏅 تست رتبه‌بندی نتایج...")
+    
+    try:
+        outages = [
+            {'date': '1404/05/16', 'start_time': '08:00', 'end_time': '10:00', 'description': '12- بلوار کشاورز، کوچه شهابیه'},
+            {'date': '1404/05/16', 'start_time': '14:00', 'end_time': '16:00', 'description': '53- شهاب نیا (حر 6 تا 14)'},
+            {'date': '1404/05/16', 'start_time': '10:35', 'end_time': '***', 'description': '41- چهار راه شهدا، شهاب نیا'},
+            {'date': '1404/05/16', 'start_time': '18:00', 'end_time': '20:00', 'description': '8- جاده فرح آباد، روستای 53 دستگاه'},
+        ]
+        for outage in outages:
+            outage['feeder'] = split_description(outage['description'])[0]
+        index = OutageIndex(outages)
+        
+        # ساعت 11 روز 1404/05/16: فقط خاموشی فیدر 41 در حال اجراست
+        now = datetime(2025, 8, 7, 11, 0, tzinfo=IRAN_TZ).timestamp()
+        ranked = index.ranked_search(['شهاب', 'نیا'], now=now)
+        if ranked != [outages[2], outages[1], outages[0]]:
+            print(f"❌ ترتیب نتایج «شهاب نیا» نادرست: {[o['feeder'] for o in ranked]}")
+            return False
+        print("✅ خاموشی در حال اجرا و کلمه دقیق پیش از تطبیق ابتدای کلمه")
+        
+        # ساعت 9: خاموشی در حال اجرای فیدر 12 با وجود تطبیق ضعیف‌تر متن اول است
+        morning = datetime(2025, 8, 7, 9, 0, tzinfo=IRAN_TZ).timestamp()
+        if index.ranked_search(['شهاب', 'نیا'], now=morning)[0] is not outages[0]:
+            print("❌ خاموشی در حال اجرا اول نیامد")
+            return False
+        
+        later = datetime(2025, 8, 7, 17, 0, tzinfo=IRAN_TZ).timestamp()
+        
+        ranked = index.ranked_search(['53', 'دستگاه'], now=later)
+        if ranked != [outages[1], outages[3]]:
+            print(f"❌ فیدر دقیق اول نیامد: {[o['feeder'] for o in ranked]}")
+            return False
+        print("✅ فیدر دقیق پیش از تطبیق متنی")
+        
+        if sorted(map(id, ranked)) != sorted(map(id, index.search(['53', 'دستگاه']))):
+            print("❌ رتبه‌بندی مجموعه نتایج را تغییر داد")
+            return False
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست رتبه‌بندی نتایج: {e}")
+        return False
+
+def test_analytics():
+    """تست تبدیل تاریخ شمسی و آمار برداری خاموشی‌ها"""
+    print("\n📊 تست آمار خاموشی‌ها...")
+    
+    try:
+        if jalali_to_gregorian(1404, 5, 16) != (2025, 8, 7) or gregorian_to_jalali(2025, 3, 20) != (1403, 12, 30):
+            print("❌ تبدیل تاریخ شمسی نادرست است")
+            return False
+        print("✅ تبدیل تاریخ شمسی")
+        
+        analytics = OutageAnalytics(capacity=2)
+        analytics.add_snapshot('ساری', [
+            {'date': '1404/05/16', 'start_time': '10:00', 'end_time': '***', 'region': 'بی برنامه', 'feeder': '53'},
+            {'date': '1404/05/16', 'start_time': '19:00', 'end_time': '21:00', 'region': 'بابرنامه', 'feeder': '53'},
+            {'date': '1404/05/16', 'start_time': '09:00', 'end_time': '11:00', 'region': 'بابرنامه', 'feeder': '30'},
+        ])
+        # snapshot بعدی فقط ساعت پایان خاموشی جاری را مشخص می‌کند
+        analytics.add_snapshot('ساری', [
+            {'date': '1404/05/16', 'start_time': '10:00', 'end_time': '10:45', 'region': 'بی برنامه', 'feeder': '53'},
+        ])
+        
+        stats = analytics.feeder_stats('ساری', '53')
+        if stats['frequency'] != 2 or stats['total_minutes'] != 165 or stats['unplanned_share'] != 0.5:
+            print(f"❌ آمار فیدر ۵۳ نادرست است: {stats}")
+            return False
+        if analytics.area_stats('ساری')['frequency'] != 3 or len(analytics) != 3:
+            print("❌ آمار منطقه نادرست است")
+            return False
+        print("✅ آمار فیدر و منطقه")
+        
+        # مجموع‌های تدریجی با ساخت دوباره کامل یکسان‌اند
+        analytics.add_snapshot('آمل', [
+            {'date': '1404/05/17', 'start_time': '08:30', 'end_time': '09:00', 'region': 'بابرنامه', 'feeder': '53'},
+            {'date': '1404/05/17', 'start_time': '12:00', 'end_time': '***', 'region': 'بابرنامه', 'description': 'بدون فیدر'},
+        ])
+        incremental = (analytics.area_table, analytics.feeder_table)
+        analytics._rebuild()
+        if (analytics.area_table, analytics.feeder_table) != incremental:
+            print("❌ آمار تدریجی با ساخت دوباره کامل فرق دارد")
+            return False
+        print("✅ آمار تدریجی برابر ساخت دوباره کامل")
+
+        # اصلاح ساعت پایان ثبت شده جایگزین مدت قبلی می‌شود
+        analytics.add_snapshot('ساری', [
+            {'date': '1404/05/16', 'start_time': '10:00', 'end_time': '11:15', 'region': 'بی برنامه', 'feeder': '53'},
+        ])
+        stats = analytics.feeder_stats('ساری', '53')
+        incremental = (analytics.area_table, analytics.feeder_table)
+        analytics._rebuild()
+        if stats['total_minutes'] != 195 or stats['frequency'] != 2 or (analytics.area_table, analytics.feeder_table) != incremental:
+            print(f"❌ اصلاح ساعت پایان در آمار اعمال نشد: {stats}")
+            return False
+        print("✅ اصلاح ساعت پایان")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست آمار: {e}")
+        return False
+
+def test_feeder_schedule():
+    """تست جدول خاموشی بعدی فیدرها"""
+    print("\n⏭ تست جدول خاموشی بعدی...")
+    
+    try:
+        now = datetime(2025, 8, 7, 12, 0, tzinfo=IRAN_TZ).timestamp()  # 1404/05/16 ساعت 12
+        analytics = OutageAnalytics()
+        analytics.add_snapshot('ساری', [
+            {'date': f'1404/05/{day}', 'start_time': '08:00', 'end_time': '10:00', 'region': 'بابرنامه', 'feeder': '7'}
+            for day in (10, 12, 14)
+        ])
+        
+        schedule = FeederSchedule()
+        schedule.rebuild_area('ساری', [
+            {'date': '1404/05/16', 'start_time': '19:00', 'end_time': '21:00', 'region': 'بابرنامه', 'feeder': '53'},
+            {'date': '1404/05/16', 'start_time': '09:00', 'end_time': '11:00', 'region': 'بابرنامه', 'feeder': '30'},
+        ], analytics, now=now)
+        
+        announced, _ = schedule.next_outage('ساری', '53', now)
+        if announced is None or datetime.fromtimestamp(announced.start, IRAN_TZ).hour != 19:
+            print("❌ خاموشی اعلام شده فیدر ۵۳ پیدا نشد")
+            return False
+        print("✅ خاموشی اعلام شده")
+        
+        # خاموشی تمام شده فیدر ۳۰ نباید در جدول بماند
+        if schedule.next_outage('ساری', '30', now) != (None, None):
+            print("❌ خاموشی گذشته در جدول مانده است")
+            return False
+        
+        # چرخش هر دو روز: آخرین شروع 1404/05/14 ساعت 8 -> بعدی 1404/05/18
+        _, estimate = schedule.next_outage('ساری', '7', now)
+        if estimate != datetime(2025, 8, 9, 8, 0, tzinfo=IRAN_TZ).timestamp():
+            print("❌ برآورد چرخش نادرست است")
+            return False
+        print("✅ برآورد چرخش از تاریخچه")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست جدول خاموشی بعدی: {e}")
+        return False
+
+def test_snapshot_store():
+    """تست store مشترک و انتخاب یک رهبر بین چند worker"""
+    print("\n🗄️ تست store مشترک...")
+    
+    try:
+        import time
+        
+        path = os.path.join(tempfile.mkdtemp(), 'snapshots.db')
+        worker_a = SQLiteSnapshotStore(path)
+        worker_b = SQLiteSnapshotStore(path)
+        
+        # فقط یک worker می‌تواند رهبر باشد
+        leaders = [worker_a.acquire_leadership('a', 60), worker_b.acquire_leadership('b', 60)]
+        if leaders != [True, False]:
+            print(f"❌ انتخاب رهبر نادرست: {leaders}")
+            return False
+        print("✅ فقط یک رهبر انتخاب شد")
+        
+        # snapshot نوشته شده توسط رهبر برای worker دیگر قابل خواندن است
+        outages = [{'date': '1404/05/16', 'description': '53- شهاب نیا'}]
+        worker_a.put_snapshot('ساری', outages)
+        snapshot = worker_b.get_snapshot('ساری')
+        if not snapshot or snapshot['outages'] != outages or worker_b.get_digest('ساری') != snapshot['digest']:
+            print("❌ snapshot در worker دیگر دیده نشد")
+            return False
+        print("✅ snapshot بین workerها به اشتراک گذاشته شد")
+        
+        worker_a.release_leadership('a')
+        if not worker_b.acquire_leadership('b', 60):
+            print("❌ رهبری پس از آزاد شدن منتقل نشد")
+            return False
+        print("✅ رهبری منتقل شد")
+
+        # رهبر مقدارها و claimهای منقضی شده را حذف می‌کند و بقیه می‌مانند
+        worker_a.set_value('search:قدیمی', [1], ttl=60)
+        worker_a.set_value('subscriber:123', {'area': 'ساری'})
+        worker_a.claim('notify:ساری:1', 60)
+        worker_a.set_value('search:تازه', [2], ttl=60)
+        worker_a._connection().execute(
+            "UPDATE kv SET expires_at = ? WHERE key != 'search:تازه' AND expires_at IS NOT NULL", (time.time() - 1,)
+        )
+        prefetcher = SnapshotPrefetcher(worker_b, AREAS, 'b', purge_interval=3600)
+        prefetcher.checker.search_outages = Mock(return_value=None)
+        prefetcher.run_once()
+        prefetcher.run_once()
+        keys = [row[0] for row in worker_a._connection().execute('SELECT key FROM kv ORDER BY key')]
+        if prefetcher.purged_at == 0 or sorted(keys) != sorted(['search:تازه', 'subscriber:123']):
+            print(f"❌ مقدارهای منقضی شده حذف نشدند: {keys}")
+            return False
+        memory = MemorySnapshotStore()
+        memory.set_value('search:قدیمی', [1], ttl=0.01)
+        memory.claim('notify:ساری:1', 0.01)
+        memory.set_value('subscriber:123', {'area': 'ساری'})
+        time.sleep(0.02)
+        if memory.purge_expired() != 2 or memory.get_value('subscriber:123') is None:
+            print("❌ حذف مقدارهای منقضی شده store حافظه نادرست است")
+            return False
+        print("✅ رهبر مقدارهای منقضی شده store را حذف می‌کند")
+
+        # پرسش‌های inline پیاپی با digest ثابت snapshot را دوباره از store نمی‌خوانند
+        from unittest.mock import AsyncMock
+        from telegram_bot import BlackoutTelegramBot
+        bot = BlackoutTelegramBot('1000000:TEST', store=SQLiteSnapshotStore(path), worker_id='w')
+        bot.store.get_snapshot = Mock(side_effect=bot.store.get_snapshot)
+        answers = []
+        for query in ('ساری ش', 'ساری شه', 'ساری شهاب', 'ساری ش'):
+            update = Mock()
+            update.inline_query.query = query
+            update.inline_query.answer = AsyncMock()
+            asyncio.run(bot.inline_query(update, None))
+            answers.append(update.inline_query.answer.call_args.args[0])
+        if bot.store.get_snapshot.call_count != 1 or not answers[2] or answers[0] != answers[3]:
+            print(f"❌ snapshot برای هر پرسش inline خوانده شد ({bot.store.get_snapshot.call_count} بار)")
+            return False
+        worker_a.put_snapshot('ساری', outages + [{'date': '1404/05/17', 'description': '12- شهرک'}])
+        update.inline_query.answer = AsyncMock()
+        asyncio.run(bot.inline_query(update, None))
+        if bot.store.get_snapshot.call_count != 2 or len(update.inline_query.answer.call_args.args[0]) != 2:
+            print("❌ پرسش inline پس از تغییر digest از snapshot جدید پاسخ نداد")
+            return False
+        print("✅ پرسش‌های inline فقط با تغییر digest snapshot را می‌خوانند")
+
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست store مشترک: {e}")
+        return False
+
+def test_mapped_snapshots():
+    """تست فایل snapshot نگاشته شده: همان خاموشی‌ها و نتایج، جایگزینی اتمی و خواندن در worker دیگر"""
+    print("\n🗺️ تست snapshot نگاشته شده...")
+    
+    try:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'snapshots.db')
+        leader = MappedSnapshotStore(SQLiteSnapshotStore(path), os.path.join(directory, 'mapped'))
+        follower = MappedSnapshotStore(SQLiteSnapshotStore(path), os.path.join(directory, 'mapped'))
+        
+        checker = PowerOutageChecker()
+        with open('raw_response_20250807_152211.html', encoding='utf-8') as f:
+            outages = checker.parse_outages(f.read())
+        outages.append({'description': 'ردیف بدون فیلدهای دیگر'})
+        leader.put_snapshot('ساری', outages)
+        
+        snapshot = follower.get_snapshot('ساری')
+        if list(snapshot['outages']) != outages or snapshot['digest'] != leader.store.get_snapshot('ساری')['digest']:
+            print("❌ خاموشی‌های فایل با snapshot اصلی یکسان نیست")
+            return False
+        print(f"✅ {len(snapshot['outages'])} خاموشی از فایل نگاشته شده")
+        
+        mapped, built = snapshot['index'], OutageIndex(outages)
+        now = datetime(2025, 8, 7, 11, 0, tzinfo=IRAN_TZ).timestamp()
+        for terms in (['شهاب', 'نیا'], ['53'], ['کیاکلا'], ['بدون']):
+            if mapped.ranked_search(terms, now=now) != built.ranked_search(terms, now=now):
+                print(f"❌ نتیجه جستجوی {terms} با ایندکس حافظه فرق دارد")
+                return False
+        for query in ('شهابنیا', 'کیاکل'):
+            if mapped.fuzzy_search(query) != built.fuzzy_search(query) or mapped.prefix_search(query) != built.prefix_search(query):
+                print(f"❌ جستجوی تقریبی/پیشوندی '{query}' با ایندکس حافظه فرق دارد")
+                return False
+        print("✅ نتایج ایندکس نگاشته شده با ایندکس حافظه یکسان است")
+        
+        # snapshot قبلی پس از جایگزینی فایل همچنان قابل استفاده است
+        leader.put_snapshot('ساری', outages[:3])
+        if len(follower.get_snapshot('ساری')['outages']) != 3 or list(snapshot['outages']) != outages:
+            print("❌ جایگزینی فایل snapshot درست انجام نشد")
+            return False
+        print("✅ جایگزینی اتمی فایل")
+        
+        # منطقه بدون فایل از store اصلی خوانده می‌شود
+        leader.store.put_snapshot('آمل', outages[:1])
+        if follower.get_snapshot('آمل')['outages'] != outages[:1]:
+            print("❌ بازگشت به store اصلی انجام نشد")
+            return False
+        
+        # وضعیت شروع دوباره ایندکس نگاشته شده را (که با pickle از نو ساخته می‌شود) ذخیره نمی‌کند
+        import pickle
+        from telegram_bot import BlackoutTelegramBot
+        bot = BlackoutTelegramBot('1000000:TEST', store=follower, worker_id='w')
+        with patch('snapshot_file.OutageIndex') as rebuilt:
+            state = pickle.loads(pickle.dumps(bot.collect_state()))
+        if rebuilt.called or 'index' in state['snapshots']['ساری'] or state['snapshots']['ساری']['outages'] != outages[:3]:
+            print("❌ ایندکس نگاشته شده در وضعیت ذخیره شد")
+            return False
+        print("✅ وضعیت شروع دوباره بدون ایندکس نگاشته شده")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست snapshot نگاشته شده: {e}")
+        return False
+
+def test_session_pool():
+    """تست مخزن session: سقف همزمانی، sessionهای جدا، جایگزینی session خراب و دریافت موازی"""
+    print("\n🔌 تست مخزن session...")
+    
+    try:
+        import threading
+        import time
+        
+        class FakeChecker:
+            """checker ساختگی که همزمانی و tokenهای هر session را ثبت می‌کند"""
+            active = 0
+            peak = 0
+            lock = threading.Lock()
+            
+            def __init__(self):
+                self.session = Mock()
+                self.form_tokens = None
+                self.fail = False
+            
+            def search_outages(self, city_code, area_code):
+                with FakeChecker.lock:
+                    FakeChecker.active += 1
+                    FakeChecker.peak = max(FakeChecker.peak, FakeChecker.active)
+                time.sleep(0.05)
+                with FakeChecker.lock:
+                    FakeChecker.active -= 1
+                self.form_tokens = {'__VIEWSTATE': str(id(self))}
+                return None if self.fail else f'<table>{area_code}</table>'
+        
+        pool = SessionPool(size=2, factory=FakeChecker, max_errors=2)
+        first, second = pool.acquire(), pool.acquire()
+        if first is second:
+            print("❌ دو درخواست همزمان session یکسان گرفتند")
+            return False
+        try:
+            pool.acquire(timeout=0.05)
+            print("❌ مخزن پر بیش از size session داد")
+            return False
+        except SessionPoolExhausted:
+            pass
+        pool.release(first)
+        pool.release(second)
+        if pool.acquire() is not second:
+            print("❌ آخرین session آزاد شده دوباره استفاده نشد")
+            return False
+        pool.release(second)
+        print("✅ سقف همزمانی و استفاده دوباره از session گرم")
+        
+        # session که پیاپی خطا می‌دهد بسته و جایگزین می‌شود
+        second.fail = True
+        pool.call('search_outages', city_code='1', area_code='2')
+        pool.call('search_outages', city_code='1', area_code='2')
+        stats = pool.stats()
+        if stats['recycled'] != 1 or stats['failures'] != 2 or not second.session.close.called:
+            print(f"❌ session خراب کنار گذاشته نشد: {stats}")
+            return False
+        print("✅ جایگزینی session پس از خطاهای پیاپی")
+
+        # call بیش از acquire_timeout منتظر نمی‌ماند و مخزن پر دریافت را بی‌نتیجه رها می‌کند
+        pool = SessionPool(size=1, factory=FakeChecker, acquire_timeout=0.05)
+        held = pool.acquire()
+        started = time.monotonic()
+        try:
+            pool.call('search_outages', city_code='1', area_code='2')
+            print("❌ call با مخزن پر بدون انتظار محدود اجرا شد")
+            return False
+        except SessionPoolExhausted:
+            pass
+        if time.monotonic() - started > 1:
+            print("❌ انتظار call از acquire_timeout بیشتر شد")
+            return False
+        blocked = SnapshotPrefetcher(MemorySnapshotStore(), AREAS, 'test', sessions=pool)
+        if blocked.fetch_area(next(iter(AREAS))) is not None:
+            print("❌ دریافت با مخزن پر باید بی‌نتیجه برگردد")
+            return False
+        pool.release(held)
+
+        # درخواست‌های checker واقعی مهلت دارند
+        checker = PowerOutageChecker()
+        checker.session = Mock()
+        checker.session.get.side_effect = requests.exceptions.Timeout()
+        if checker.get_initial_data() or checker.session.get.call_args.kwargs.get('timeout') != checker.request_timeout:
+            print("❌ درخواست به سایت بدون مهلت ارسال شد")
+            return False
+        print("✅ انتظار session و درخواست‌های سایت محدود است")
+
+        # دریافت موازی مناطق با حداکثر size درخواست همزمان
+        FakeChecker.peak = 0
+        store = MemorySnapshotStore()
+        pool = SessionPool(size=3, factory=FakeChecker)
+        prefetcher = SnapshotPrefetcher(store, AREAS, 'test', sessions=pool)
+        prefetcher.checker.parse_outages = lambda html: [{'description': html}]
+        published = []
+        prefetcher.add_listener(lambda area_name, snapshot, previous: published.append(area_name))
+        prefetcher.run_once()
+        if sorted(published) != sorted(AREAS) or not 1 < FakeChecker.peak <= 3:
+            print(f"❌ دریافت موازی درست انجام نشد (همزمانی {FakeChecker.peak})")
+            return False
+        if any(store.get_snapshot(name)['outages'][0]['description'] != f"<table>{info['area_code']}</table>"
+               for name, info in AREAS.items()):
+            print("❌ پاسخ یک منطقه در snapshot منطقه دیگر ذخیره شد")
+            return False
+        print(f"✅ {len(published)} منطقه با {FakeChecker.peak} درخواست همزمان دریافت شد")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست مخزن session: {e}")
+        return False
+
+def test_response_archive():
+    """تست بایگانی فشرده پاسخ‌ها و بازخوانی آن‌ها"""
+    print("\n📦 تست بایگانی پاسخ‌ها...")
+    
+    try:
+        archive = ResponseArchive(tempfile.mkdtemp())
+        checker = PowerOutageChecker()
+        fixtures = sorted(glob.glob('raw_response_*.html'))
+        if not fixtures:
+            print("⚠️ فایل نمونه پاسخ سایت پیدا نشد")
+            return True
+        
+        contents = []
+        for hour, fixture in enumerate(fixtures):
+            with open(fixture, encoding='utf-8') as f:
+                contents.append(f.read())
+            archive.store(contents[-1], area='ساری', timestamp=datetime(2025, 8, 7, hour))
+        
+        # پاسخ‌های تکراری فقط یک بار ذخیره می‌شوند
+        objects = glob.glob(os.path.join(archive.root, 'objects', '*', '*'))
+        if len(objects) > len(fixtures) or len(archive.entries('ساری')) != len(fixtures):
+            print(f"❌ تعداد فایل‌های بایگانی نادرست: {len(objects)}")
+            return False
+        print(f"✅ {len(fixtures)} پاسخ در {len(objects)} فایل بایگانی شد")
+        
+        # جدول بایگانی شده همان خاموشی‌های پاسخ کامل را می‌دهد
+        replayed = archive.replay(datetime(2025, 8, 7, 0, 30), area='ساری')
+        if checker.parse_outages(replayed) != checker.parse_outages(contents[0]):
+            print("❌ خاموشی‌های بازخوانی شده با پاسخ اصلی یکسان نیست")
+            return False
+        # زمان بدون ثانیه یا با منطقه زمانی به صورت زمان مقایسه می‌شود نه رشته
+        if len(fixtures) > 1:
+            from datetime import timezone, timedelta
+            archive.store(contents[1], area='ساری', timestamp=datetime(2025, 8, 7, 14, 40))
+            if archive.replay('2025-08-07T14:40', area='ساری') != extract_grid(contents[1]):
+                print("❌ پاسخ ثبت شده در همان دقیقه برای زمان بدون ثانیه انتخاب نشد")
+                return False
+            # همان لحظه با ساعت دیواری کوچک‌تر در منطقه زمانی دیگر
+            shifted = datetime(2025, 8, 7, 14, 40).astimezone().astimezone(timezone(timedelta(hours=-5)))
+            if archive.replay(shifted.isoformat(), area='ساری') != archive.replay('2025-08-07T14:40:00', area='ساری'):
+                print("❌ زمان با منطقه زمانی درست مقایسه نشد")
+                return False
+        if archive.replay(datetime(2025, 8, 6)) is not None:
+            print("❌ بازخوانی پیش از اولین پاسخ باید خالی باشد")
+            return False
+        print("✅ بازخوانی پاسخ بایگانی شده درست است")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست بایگانی پاسخ‌ها: {e}")
+        return False
+
+def test_profiling():
+    """تست پروفایل اختیاری درخواست‌ها"""
+    print("\n🩺 تست پروفایل...")
+    
+    try:
+        directory = tempfile.mkdtemp()
+        profiler = Profiler()
+        checker = PowerOutageChecker()
+        parse = profiler.wrap(checker.parse_outages, 'parse_outages')
+        with open('raw_response_20250807_152211.html', encoding='utf-8') as f:
+            html_content = f.read()
+        
+        expected = parse(html_content)
+        if os.listdir(directory):
+            print("❌ پروفایل غیرفعال فایل نوشت")
+            return False
+        
+        profiler.enable(directory)
+        if parse(html_content) != expected:
+            print("❌ نتیجه تابع پروفایل شده تغییر کرد")
+            return False
+        profiler.disable()
+        
+        files = sorted(os.listdir(directory))
+        if [os.path.splitext(name)[1] for name in files] != ['.folded', '.prof']:
+            print(f"❌ فایل‌های پروفایل نادرست: {files}")
+            return False
+        print(f"✅ پروفایل ذخیره شد: {files}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست پروفایل: {e}")
+        return False
+
+def test_search_queue():
+    """تست ادغام جستجوهای یکسان و رد درخواست در صف پر"""
+    print("\n🚦 تست صف جستجو...")
+    
+    async def scenario():
+        queue = SearchQueue(workers=1, maxsize=2)
+        calls = []
+        
+        def job(key):
+            async def run():
+                calls.append(key)
+                await asyncio.sleep(0.01)
+                return key.upper()
+            return run
+        
+        first, _ = queue.submit('a', job('a'))
+        await asyncio.sleep(0)  # worker کار اول را برمی‌دارد
+        second, position = queue.submit('b', job('b'))
+        same, same_position = queue.submit('b', job('b'))
+        queue.submit('c', job('c'))
+        try:
+            queue.submit('d', job('d'))
+            shed = False
+        except SearchQueueFull:
+            shed = True
+        results = await asyncio.gather(first, second, same)
+        await queue.close()
+        return results, calls, position, same_position, shed
+    
+    try:
+        results, calls, position, same_position, shed = asyncio.run(scenario())
+        if results != ['A', 'B', 'B'] or calls.count('b') != 1:
+            print(f"❌ جستجوهای یکسان ادغام نشدند: {results} {calls}")
+            return False
+        print("✅ جستجوهای یکسان یک بار اجرا شدند")
+        
+        if (position, same_position) != (1, 1) or not shed:
+            print(f"❌ نوبت یا رد درخواست نادرست: {position} {same_position} {shed}")
+            return False
+        print("✅ نوبت صف و رد درخواست در صف پر")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست صف جستجو: {e}")
+        return False
+
+def test_snapshot_cache():
+    """تست کش LRU با بودجه حافظه و pin ورودی جاری هر منطقه"""
+    print("\n🧮 تست کش snapshotها...")
+    
+    try:
+        cache = SnapshotCache(max_bytes=300)
+        cache.put(('ساری', 'd1'), 'x', size=100, pin_group='ساری')
+        cache.put(('آمل', 'd1'), 'y', size=100, pin_group='آمل')
+        cache.put(('ساری', 'd2'), 'z', size=100, pin_group='ساری')
+        
+        # d1 ساری دیگر جاری نیست و کم‌استفاده‌ترین ورودی قابل حذف است
+        cache.get(('آمل', 'd1'))
+        cache.put('search', 'w', size=100)
+        if ('ساری', 'd1') in cache or ('آمل', 'd1') not in cache or cache.bytes != 300:
+            print(f"❌ ورودی نادرستی حذف شد: {cache.stats()}")
+            return False
+        print("✅ کم‌استفاده‌ترین ورودی pin نشده حذف شد")
+        
+        cache.put('big', 'v', size=1000)
+        stats = cache.stats()
+        if ('ساری', 'd2') not in cache or ('آمل', 'd1') not in cache or stats['evictions'] != 3:
+            print(f"❌ ورودی pin شده حذف شد: {stats}")
+            return False
+        if cache.get('missing') is not None or cache.stats()['misses'] != 1:
+            print("❌ آمار miss نادرست است")
+            return False
+        print(f"✅ آمار کش: {stats}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست کش snapshotها: {e}")
+        return False
+
+def test_warm_state():
+    """تست ذخیره و بازیابی وضعیت برای شروع دوباره"""
+    print("\n♻️ تست وضعیت شروع دوباره...")
+    
+    try:
+        path = os.path.join(tempfile.mkdtemp(), 'state.pickle')
+        outages = [{'description': '53- شهاب نیا', 'feeder': '53'}]
+        state_file = WarmStateFile(path)
+        state_file.save({'snapshots': {'ساری': {'outages': outages}}, 'index': OutageIndex(outages)})
+        
+        state = state_file.load()
+        index = state['index']
+        if index.feeder_outages('53') != outages or index.outages is not state['snapshots']['ساری']['outages']:
+            print("❌ ایندکس بازیابی شده با snapshot یکسان نیست")
+            return False
+        print("✅ snapshot و ایندکس بازیابی شدند")
+        
+        with patch.object(warm_state, 'STATE_VERSION', warm_state.STATE_VERSION + 1):
+            if state_file.load() is not None:
+                print("❌ وضعیت با نسخه ناسازگار بارگذاری شد")
+                return False
+        print("✅ وضعیت با نسخه ناسازگار نادیده گرفته شد")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست وضعیت شروع دوباره: {e}")
+        return False
+
+def test_api_server():
+    """تست API وب: ETag، پاسخ 304 و فشرده‌سازی gzip"""
+    print("\n🌐 تست API وب...")
+    
+    try:
+        store = MemorySnapshotStore()
+        outages = [
+            {'date': '1404/05/16', 'start_time': '19:00', 'end_time': '21:00', 'description': f'53- شهاب نیا {i}', 'feeder': '53'}
+            for i in range(30)
+        ]
+        store.put_snapshot('ساری', outages)
+        api = OutageAPI(store, AREAS, AREA_ALIASES)
+        
+        status, headers, body = api.respond('GET', '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/feeders/53', {'accept-encoding': 'gzip'})
+        if status != 200 or headers.get('Content-Encoding') != 'gzip' or len(json.loads(gzip.decompress(body))['outages']) != 30:
+            print(f"❌ پاسخ فیدر نادرست: {status} {headers}")
+            return False
+        print("✅ پاسخ فشرده فیدر")
+        
+        status, _, body = api.respond('GET', '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/feeders/53', {'if-none-match': headers['ETag']})
+        if status != 304 or body:
+            print(f"❌ درخواست شرطی پاسخ 304 نگرفت: {status}")
+            return False
+        
+        store.put_snapshot('ساری', outages[:1])
+        status, _, body = api.respond('GET', '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/feeders/53', {'if-none-match': headers['ETag']})
+        if status != 200 or len(json.loads(body)['outages']) != 1:
+            print("❌ ETag پس از تغییر snapshot عوض نشد")
+            return False
+        print("✅ ETag بر اساس snapshot")
+        
+        status, _, body = api.respond('GET', '/active?at=2025-08-07T20:00&area=ساری', {})
+        if status != 200 or json.loads(body)['areas'][0]['count'] != 1:
+            print(f"❌ خاموشی‌های فعال نادرست: {body[:200]}")
+            return False
+        if api.respond('GET', '/areas/x/outages', {})[0] != 404:
+            print("❌ منطقه ناشناخته باید 404 باشد")
+            return False
+        print("✅ خاموشی‌های فعال و خطای منطقه ناشناخته")
+        
+        # درخواست شرطی فقط digest می‌خواند، نه خاموشی‌ها
+        status, headers, _ = api.respond('GET', '/areas', {})
+        store.get_snapshot = Mock(side_effect=RuntimeError('خرابی store'))
+        if api.respond('GET', '/areas', {'if-none-match': headers['ETag']})[0] != 304 or store.get_snapshot.called:
+            print("❌ درخواست شرطی snapshot را بارگذاری کرد")
+            return False
+        print("✅ پاسخ 304 فقط با digestها")
+
+        # انتشار snapshot بین resolve و ساخت بدنه: ETag از snapshot خوانده شده در ساخت است
+        published = MemorySnapshotStore()
+        published.put_snapshot('ساری', outages)
+        racing = OutageAPI(published, AREAS, AREA_ALIASES)
+        target = '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/outages'
+        _, render = racing.resolve('GET', target, {})
+        stale_etag = racing.etag(f"{target}?[]", published.get_digest('ساری'))
+        published.put_snapshot('ساری', outages[:5])
+        status, headers, body = render()
+        fresh = racing.respond('GET', target, {})
+        if len(json.loads(body)['outages']) != 5 or headers['ETag'] == stale_etag or headers['ETag'] != fresh[1]['ETag'] \
+                or racing.responses.get(stale_etag) is not None:
+            print("❌ بدنه snapshot جدید زیر ETag قدیمی کش شد")
+            return False
+        print("✅ ETag و بدنه از یک snapshot")
+
+        # خطای غیرمنتظره در ساخت بدنه پاسخ 500 می‌گیرد و اتصال بسته نمی‌شود
+        async def request_over_socket():
+            server = await asyncio.start_server(api.handle_connection, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b'GET /areas/%D8%B3%D8%A7%D8%B1%DB%8C/outages HTTP/1.1\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+                return response
+        response = asyncio.run(request_over_socket())
+        if not response.startswith(b'HTTP/1.1 500'):
+            print(f"❌ خطای داخلی پاسخ 500 نگرفت: {response[:40]}")
+            return False
+        print("✅ پاسخ 500 برای خطای داخلی")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست API وب: {e}")
+        return False
+
+def test_calendar_feeds():
+    """تست فیدهای iCalendar: زمان UTC، ساخت دوباره فقط فیدر تغییر کرده و پاسخ 304"""
+    print("\n📅 تست فیدهای تقویم...")
+    
+    try:
+        outages = [
+            {'date': '1404/05/16', 'start_time': '19:00', 'end_time': '21:00', 'description': '53- شهاب نیا', 'feeder': '53'},
+            {'date': '1404/05/16', 'start_time': '09:00', 'end_time': '11:00', 'description': '12- خیابان فرهنگ', 'feeder': '12'},
+        ]
+        now = datetime(2025, 8, 7, 8, 0, tzinfo=IRAN_TZ).timestamp()
+        feeds = CalendarFeeds()
+        store = MemorySnapshotStore()
+        store.put_snapshot('ساری', outages)
+        rebuilt = feeds.update_area('ساری', store.get_snapshot('ساری'), now)
+        body = feeds.feed('ساری', '53').body.decode('utf-8')
+        if rebuilt != {('ساری', None), ('ساری', '53'), ('ساری', '12')} or 'DTSTART:20250807T153000Z' not in body:
+            print(f"❌ فید اولیه نادرست: {rebuilt}")
+            return False
+        print("✅ رویدادها با زمان UTC")
+        
+        changed = [dict(outages[0]), dict(outages[1], end_time='12:00')]
+        store.put_snapshot('ساری', changed)
+        rebuilt = feeds.update_area('ساری', store.get_snapshot('ساری'), now)
+        if rebuilt != {('ساری', None), ('ساری', '12')}:
+            print(f"❌ فیدهای تغییر نکرده دوباره ساخته شدند: {rebuilt}")
+            return False
+        if feeds.feed('ساری', '53').body.decode('utf-8') != body:
+            print("❌ فید فیدر 53 نباید تغییر کند")
+            return False
+        print("✅ ساخت دوباره فقط فیدر تغییر کرده")
+        
+        api = OutageAPI(store, AREAS, AREA_ALIASES)
+        status, headers, _ = api.respond('GET', '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/feeders/53/calendar.ics', {})
+        if status != 200 or not headers['Content-Type'].startswith('text/calendar'):
+            print(f"❌ پاسخ فید نادرست: {status} {headers}")
+            return False
+        status, _, _ = api.respond('GET', '/areas/%D8%B3%D8%A7%D8%B1%DB%8C/feeders/53/calendar.ics', {'if-none-match': headers['ETag']})
+        if status != 304:
+            print(f"❌ درخواست شرطی فید پاسخ 304 نگرفت: {status}")
+            return False
+        print("✅ فید از API با پاسخ 304")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست فیدهای تقویم: {e}")
+        return False
+
+def test_poll_scheduler():
+    """تست زمان‌بندی تطبیقی: بودجه، بیشینه کهنگی و اولویت منطقه پرتغییر"""
+    print("\n⏱️ تست زمان‌بندی دریافت...")
+    
+    try:
+        scheduler = AdaptivePollScheduler(['ساری', 'آمل', 'بابل'], budget_per_hour=20, min_interval=60, max_staleness=1800)
+        store = MemorySnapshotStore()
+        start = datetime(2025, 8, 7, 18, 0, tzinfo=IRAN_TZ).timestamp()
+        for step in range(24):
+            for area_name in scheduler.areas:
+                # ساری در هر دریافت تغییر می‌کند و بقیه ثابت‌اند
+                outages = [{'date': '1404/05/16', 'description': f'53- شهاب نیا {step if area_name == "ساری" else 0}'}]
+                previous = store.get_snapshot(area_name)
+                scheduler.observe(area_name, store.put_snapshot(area_name, outages, fetched_at=start + step * 300), previous)
+        
+        now = start + 24 * 300
+        intervals = scheduler.intervals(now)
+        if not intervals['ساری'] < intervals['آمل'] <= 1800:
+            print(f"❌ فاصله‌ها با نرخ تغییر متناسب نیستند: {intervals}")
+            return False
+        if abs(sum(3600 / interval for interval in intervals.values()) - 20) > 0.1:
+            print(f"❌ بودجه رعایت نشد: {intervals}")
+            return False
+        print("✅ بودجه به نسبت نرخ تغییر تقسیم شد")
+        
+        fetched = {'ساری': now - intervals['ساری'] - 1, 'آمل': now - 60, 'بابل': None}
+        if scheduler.due_areas(fetched, now) != ['بابل', 'ساری']:
+            print(f"❌ ترتیب مناطق نادرست: {scheduler.due_areas(fetched, now)}")
+            return False
+        
+        restored = AdaptivePollScheduler(scheduler.areas, budget_per_hour=20, min_interval=60, max_staleness=1800)
+        restored.restore_state(scheduler.export_state())
+        if restored.intervals(now) != intervals:
+            print("❌ آمار بازیابی شده متفاوت است")
+            return False
+        print("✅ مناطق سررسید و بازیابی آمار")
+        
+        # دریافت به خاطر کاربر فقط وقتی منطقه در بودجه سررسید شده باشد
+        import time
+        from config import SNAPSHOT_TTL
+        from telegram_bot import BlackoutTelegramBot
+        bot = BlackoutTelegramBot('1000000:TEST')
+        bot.restored_areas = set()
+        bot.prefetcher.scheduler = AdaptivePollScheduler(['ساری'], budget_per_hour=100, min_interval=SNAPSHOT_TTL * 2)
+        bot.prefetcher.fetch_area = Mock(return_value=None)
+        bot.store.put_snapshot('ساری', outages, fetched_at=time.time() - SNAPSHOT_TTL - 1)
+        asyncio.run(bot.get_area_snapshot('ساری'))
+        if bot.prefetcher.fetch_area.called:
+            print("❌ snapshot کهنه پیش از سررسید منطقه از سایت دریافت شد")
+            return False
+        bot.store.put_snapshot('ساری', outages, fetched_at=time.time() - SNAPSHOT_TTL * 2 - 1)
+        asyncio.run(bot.get_area_snapshot('ساری'))
+        if not bot.prefetcher.fetch_area.called:
+            print("❌ منطقه سررسید شده دریافت نشد")
+            return False
+        print("✅ دریافت درخواستی کاربر در بودجه زمان‌بند")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست زمان‌بندی دریافت: {e}")
+        return False
+
+def test_digest_batching():
+    """تست خلاصه اعلان‌ها: تشخیص تغییرات، ادغام تغییرات پیاپی و اشتراک‌های store"""
+    print("\n🔔 تست خلاصه اعلان‌ها...")
+    
+    try:
+        outage = {'date': '1404/05/16', 'start_time': '19:00', 'end_time': '***', 'description': '53- شهاب نیا', 'feeder': '53'}
+        other = {'date': '1404/05/16', 'start_time': '09:00', 'end_time': '11:00', 'description': '12- فرهنگ', 'feeder': '12'}
+        extended = dict(outage, end_time='20:00')
+        changes = diff_outages([outage, other], [extended])
+        if changes != [(outage, extended), (other, None)]:
+            print(f"❌ تغییرات نادرست: {changes}")
+            return False
+        print("✅ تشخیص تغییر و حذف")
+        
+        batcher = DigestBatcher(window=120)
+        batcher.add(1, 'ساری', None, outage, now=0)
+        batcher.add(1, 'ساری', outage, extended, now=10)
+        batcher.add(1, 'ساری', extended, dict(outage, end_time='21:00'), now=20)
+        batcher.add(1, 'ساری', None, other, now=30)
+        batcher.add(1, 'ساری', other, None, now=40)
+        if batcher.due(now=100):
+            print("❌ خلاصه پیش از پایان پنجره فرستاده شد")
+            return False
+        digests = batcher.due(now=120)
+        if digests != [(1, [('ساری', None, dict(outage, end_time='21:00'))])]:
+            print(f"❌ تغییرات پیاپی ادغام نشدند: {digests}")
+            return False
+        print("✅ پنج تغییر در یک مورد خلاصه شدند")
+        
+        store = SQLiteSnapshotStore(os.path.join(tempfile.mkdtemp(), 'snapshots.db'))
+        store.add_subscription(1, 'ساری', '53')
+        store.add_subscription(1, 'ساری', '53')
+        store.add_subscription(2, 'ساری', '')
+        store.add_subscription(1, 'آمل', 'شهاب نیا')
+        if len(store.subscriptions(area_name='ساری')) != 2 or store.remove_subscriptions(1) != 2 or store.subscriptions() != [(2, 'ساری', '')]:
+            print(f"❌ اشتراک‌های store نادرست: {store.subscriptions()}")
+            return False
+        print("✅ ثبت و حذف اشتراک‌ها")
+        
+        # رهبر (مثلاً API) بدون listener اعلان می‌نویسد؛ هر تغییر دقیقاً یک بار در یکی از رباتها اعلان می‌شود
+        from telegram_bot import BlackoutTelegramBot
+        path = os.path.join(tempfile.mkdtemp(), 'shared.db')
+        bots = [BlackoutTelegramBot('1000000:TEST', store=SQLiteSnapshotStore(path), worker_id=name) for name in 'ab']
+        leader = SnapshotPrefetcher(SQLiteSnapshotStore(path), bots[0].default_areas, 'api')
+        versions = [[outage], [extended], [dict(outage, end_time='21:00')]]
+        for prefetcher in (leader, bots[1].prefetcher):
+            prefetcher.sessions = None
+            prefetcher.checker.search_outages = Mock(return_value='<html/>')
+            prefetcher.checker.parse_outages = Mock(side_effect=lambda html: versions.pop(0))
+        leader.store.add_subscription(1, 'ساری', '53')
+        
+        leader.fetch_area('ساری')
+        for bot in bots:
+            bot.check_snapshot_changes()
+        leader.fetch_area('ساری')
+        for bot in bots:
+            bot.check_snapshot_changes()
+        if sum(bot.digests.events for bot in bots) != 1:
+            print(f"❌ تغییر snapshot رهبر دیگر {sum(bot.digests.events for bot in bots)} بار اعلان شد")
+            return False
+        
+        # رباتی که خودش دریافت می‌کند (listener) و بررسی دوره‌ای store اعلان را تکرار نمی‌کنند
+        bots[1].prefetcher.fetch_area('ساری')
+        for bot in bots:
+            bot.check_snapshot_changes()
+        if sum(bot.digests.events for bot in bots) != 2:
+            print("❌ اعلان snapshot ربات رهبر تکرار شد")
+            return False
+        print("✅ اعلان یک‌باره تغییرات در چند worker")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست خلاصه اعلان‌ها: {e}")
+        return False
+
+def test_live_messages():
+    """تست پیام‌های زنده: ویرایش فقط با تغییر نتایج، ادغام ویرایش‌ها و محدودیت نرخ"""
+    print("\n🔄 تست پیام‌های زنده...")
+    
+    try:
+        live = LiveMessages(ttl=3600, rate=2, chat_interval=1.0)
+        key = ('ساری', ('53',))
+        live.register(1, 10, key, 'd1', 'نتیجه ۱', now=0)
+        live.register(2, 20, key, 'd1', 'نتیجه ۱', now=0)
+        live.register(-3, 30, key, 'd1', 'نتیجه ۱', now=0)
+        live.register(1, 11, ('آمل', ()), 'd9', 'نتیجه آمل', now=0)
+        
+        stale = live.stale('ساری', 'd2', now=10)
+        if stale != {key: [(1, 10), (2, 20), (-3, 30)]}:
+            print(f"❌ پیام‌های قدیمی نادرست: {stale}")
+            return False
+        live.refresh((1, 10), 'd2', 'نتیجه ۱', 'نتیجه ۱ + زمان')
+        if live.stats()['pending_edits'] or live.stale('ساری', 'd2', now=10).get(key) != [(2, 20), (-3, 30)]:
+            print("❌ نتیجه بدون تغییر نباید ویرایش شود")
+            return False
+        print("✅ ویرایش فقط با تغییر نتایج")
+        
+        for ref in [(2, 20), (-3, 30)]:
+            live.refresh(ref, 'd2', 'نتیجه ۲', 'نتیجه ۲')
+            live.refresh(ref, 'd3', 'نتیجه ۳', 'نتیجه ۳')
+        if live.stats()['superseded'] != 2:
+            print(f"❌ ویرایش‌های پیاپی ادغام نشدند: {live.stats()}")
+            return False
+        
+        edits = live.take_edits(now=10)
+        if edits != [(2, 20, 'نتیجه ۳'), (-3, 30, 'نتیجه ۳')] or live.take_edits(now=10):
+            print(f"❌ ویرایش‌های مجاز نادرست: {edits}")
+            return False
+        live.refresh((-3, 30), 'd4', 'نتیجه ۴', 'نتیجه ۴', finished=True)
+        if live.take_edits(now=12) or live.take_edits(now=13.1) != [(-3, 30, 'نتیجه ۴')]:
+            print("❌ فاصله ویرایش گروه رعایت نشد")
+            return False
+        if live.stale('ساری', 'd5', now=20).get(key) != [(1, 10), (2, 20)]:
+            print("❌ پیام پایان یافته باید رها شود")
+            return False
+        print("✅ ادغام ویرایش‌ها و محدودیت نرخ هر چت")
+        
+        live.refresh((2, 20), 'd5', 'نتیجه ۵', 'نتیجه ۵')
+        live.retry_after(2, 20, 'نتیجه ۵', delay=5, now=20)
+        if live.take_edits(now=22) or live.take_edits(now=26) != [(2, 20, 'نتیجه ۵')]:
+            print("❌ توقف پس از RetryAfter رعایت نشد")
+            return False
+        if live.stale('آمل', 'd10', now=7200):
+            print("❌ پیام منقضی باید رها شود")
+            return False
+        print("✅ RetryAfter و انقضا")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست پیام‌های زنده: {e}")
+        return False
+
+def test_load_harness():
+    """تست کوتاه آزمون بار: همه انواع Update بدون خطا و با یک دریافت برای هر منطقه"""
+    print("\n🏋️ تست آزمون بار...")
+    
+    try:
+        files = sorted(glob.glob('raw_response_*.html'))
+        if not files:
+            print("⚠️ فایل پاسخ نمونه‌ای برای آزمون بار پیدا نشد")
+            return True
+        with open(files[-1], encoding='utf-8') as f:
+            response_html = f.read()
+        
+        result = asyncio.run(run_load_test(
+            rate=60, duration=1, users=50, mix=parse_mix('search=40,text=30,latest=15,callback=15'),
+            response_html=response_html, seed=1
+        ))
+        summary = result['latency']['all']
+        if summary['count'] != 60 or summary['errors']:
+            print(f"❌ نتیجه آزمون بار نادرست: {summary}")
+            return False
+        if result['upstream'].get('POST', 0) > 5:
+            print(f"❌ درخواست‌های تکراری به سایت: {result['upstream']}")
+            return False
+        print(f"✅ {summary['count']} درخواست، p95 {summary['p95']:.0f} ms، {result['upstream'].get('POST', 0)} درخواست به سایت")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست آزمون بار: {e}")
+        return False
+
 def test_config():
     """تست تنظیمات"""
     print("\n⚙️ تست تنظیمات...")
@@ -121,6 +1437,38 @@ def test_bot_functionality():
         print(f"❌ خطا در تست عملکرد ربات: {e}")
         return False
 
+def test_query_router():
+    """تست مسیریاب پیام‌ها و محدودسازی درخواست"""
+    print("\n🧭 تست مسیریاب پیام‌ها...")
+    
+    try:
+        router = QueryRouter(AREAS, AREA_ALIASES)
+        expected = {
+            "ساری شهاب نیا": ('ساری', ['شهاب', 'نیا']),
+            "ساري شهاب": ('ساری', ['شهاب']),
+            "قائمشهر خیابان امام": ('قائم‌شهر', ['خیابان', 'امام']),
+            "نوشهر": ('نوشهر', None),
+            "شهاب نیا": (None, ['شهاب', 'نیا']),
+        }
+        for query, route in expected.items():
+            if router.route(query) != route:
+                print(f"❌ '{query}' -> {router.route(query)}")
+                return False
+            print(f"✅ '{query}' -> {route[0]}")
+        
+        # پس از پایان burst درخواست‌های بعدی رد می‌شوند
+        throttler = RequestThrottler(0.01, 3, 0.01, 10)
+        allowed = [throttler.allow(1, 1) for _ in range(5)]
+        if allowed != [True, True, True, False, False]:
+            print(f"❌ محدودسازی نادرست: {allowed}")
+            return False
+        print("✅ محدودسازی درخواست")
+        
+        return True
+    except Exception as e:
+        print(f"❌ خطا در تست مسیریاب: {e}")
+        return False
+
 def test_environment():
     """تست محیط اجرا"""
     print("\n🌍 تست محیط اجرا...")
@@ -182,7 +1530,32 @@ def run_all_tests():
         ("وابستگی‌ها", test_dependencies),
         ("تنظیمات", test_config),
         ("PowerOutageChecker", test_power_outage_checker),
-        ("عملکرد ربات", test_bot_functionality)
+        ("تجزیه‌گر افزایشی", test_stream_parser),
+        ("دریافت تدریجی", test_streamed_search),
+        ("اجرای دسته‌ای", test_batch_jobs),
+        ("backendهای تجزیه", test_parser_backends),
+        ("ایندکس فیدرها", test_feeder_index),
+        ("جستجوی کد اشتراک", test_subscriber_lookup),
+        ("جستجوی تقریبی", test_fuzzy_search),
+        ("رتبه‌بندی نتایج", test_search_ranking),
+        ("آمار خاموشی‌ها", test_analytics),
+        ("جدول خاموشی بعدی", test_feeder_schedule),
+        ("store مشترک", test_snapshot_store),
+        ("snapshot نگاشته شده", test_mapped_snapshots),
+        ("مخزن session", test_session_pool),
+        ("بایگانی پاسخ‌ها", test_response_archive),
+        ("پروفایل درخواست‌ها", test_profiling),
+        ("صف جستجو", test_search_queue),
+        ("کش snapshotها", test_snapshot_cache),
+        ("وضعیت شروع دوباره", test_warm_state),
+        ("API وب", test_api_server),
+        ("فیدهای تقویم", test_calendar_feeds),
+        ("زمان‌بندی دریافت", test_poll_scheduler),
+        ("خلاصه اعلان‌ها", test_digest_batching),
+        ("پیام‌های زنده", test_live_messages),
+        ("آزمون بار", test_load_harness),
+        ("عملکرد ربات", test_bot_functionality),
+        ("مسیریاب پیام‌ها", test_query_router)
     ]
     
     passed = 0
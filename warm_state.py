@@ -0,0 +1,87 @@
+import os
+import time
+import pickle
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# با هر تغییر ساختار snapshot، OutageIndex یا وضعیت checker افزایش یابد تا فایل‌های قدیمی نادیده گرفته شوند
+STATE_VERSION = 3
+
+
+class WarmStateFile:
+    """ذخیره و بارگذاری وضعیت ربات برای شروع دوباره بدون حافظه خالی
+
+    وضعیت با pickle ذخیره می‌شود (سریع و با حفظ اشیای مشترک بین snapshot و
+    ایندکس)، پس فقط فایلی بارگذاری شود که خود ربات نوشته است. نوشتن در فایل
+    موقت و جایگزینی اتمی انجام می‌شود تا قطع ناگهانی فایل قبلی را خراب نکند.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, state):
+        """ذخیره دیکشنری وضعیت همراه با نسخه و زمان ذخیره"""
+        payload = {'version': STATE_VERSION, 'saved_at': time.time(), 'state': state}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def load(self):
+        """وضعیت ذخیره شده یا None اگر فایل نیست، خراب است یا نسخه آن فرق دارد"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            logger.error(f"خطا در خواندن وضعیت ذخیره شده {self.path}: {e}")
+            return None
+
+        if not isinstance(payload, dict) or payload.get('version') != STATE_VERSION:
+            logger.warning(f"نسخه وضعیت ذخیره شده {self.path} سازگار نیست و نادیده گرفته شد")
+            return None
+        age = time.time() - payload['saved_at']
+        logger.info(f"وضعیت ذخیره شده {age:.0f} ثانیه پیش بارگذاری شد")
+        return payload['state']
+
+
+class StatePersister:
+    """ذخیره دوره‌ای وضعیت در thread پس‌زمینه و یک بار دیگر هنگام توقف"""
+
+    def __init__(self, state_file, collect, interval=60):
+        self.state_file = state_file
+        self.collect = collect
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def save_now(self):
+        try:
+            started = time.perf_counter()
+            self.state_file.save(self.collect())
+            logger.info(f"وضعیت در {(time.perf_counter() - started) * 1000:.0f} ms ذخیره شد")
+        except Exception as e:
+            logger.error(f"خطا در ذخیره وضعیت: {e}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.save_now()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='state-persister', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """توقف thread و ذخیره نهایی"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.save_now()